@@ -1,14 +1,35 @@
-from flask import Flask
+from flask import Flask, current_app
 from flask_login import LoginManager
 from flask_restx import Api
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.local import LocalProxy
 
+from .cache import ResponseCache, UserCache
 from .config import Config
+from .database import RoutingSession, configure_database, configure_engines
+from .metrics import Metrics
+from .serializer import output_json
+from .passwords import LoginThrottle, PasswordHasher
+from .pubsub import ChangeFeed
 from .uri import API_ENDPOINT
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 login_manager = LoginManager()
-api = Api(version="0.1", doc=API_ENDPOINT, title="Todo API", validate=True)
+
+
+def _extension(name):
+    """The instance of an extension that belongs to the current app."""
+    return LocalProxy(lambda: current_app.extensions[name])
+
+
+# Each app gets its own instances, so apps with other configs don't share
+# caches, counters or engine listeners
+response_cache: ResponseCache = _extension("response_cache")
+user_cache: UserCache = _extension("user_cache")
+password_hasher: PasswordHasher = _extension("password_hasher")
+login_throttle: LoginThrottle = _extension("login_throttle")
+metrics: Metrics = _extension("metrics")
+change_feed: ChangeFeed = _extension("change_feed")
 
 
 def create_app(test_config=None):
@@ -19,22 +40,59 @@ def create_app(test_config=None):
     if test_config:
         app.config.update(test_config)
 
+    # Bind extensions to the app
+    configure_database(app)
+    db.init_app(app)
+    app_metrics = Metrics()
+    with app.app_context():
+        configure_engines(app, db.engines)
+        app_metrics.init_app(app, db.engines.values())
+    login_manager.init_app(app)
+    ResponseCache().init_app(app)
+    UserCache().init_app(app)
+    PasswordHasher().init_app(app)
+    LoginThrottle().init_app(app)
+    ChangeFeed().init_app(app)
+
     # Import the namespaces
     from .auth import auth_ns
+    from .feed import feed_ns
+    from .search import search_ns
+    from .sync import sync_ns
     from .list import list_ns
     from .task import task_ns
 
-    # Add the namespaces to the API
+    # Add the namespaces to an API of this app only, so the factory can be
+    # called more than once. The Swagger spec is built on its first request
+    api = Api(
+        version="0.1",
+        doc=API_ENDPOINT if app.config["SWAGGER_UI"] else False,
+        title="Todo API",
+        validate=True,
+    )
     api.add_namespace(auth_ns)
     api.add_namespace(list_ns)
     api.add_namespace(task_ns)
-
-    # Bind extensions to the app
-    db.init_app(app)
-    login_manager.init_app(app)
+    api.add_namespace(feed_ns)
+    api.add_namespace(sync_ns)
+    api.add_namespace(search_ns)
+    if app.config["FAST_SERIALIZER"]:
+        api.representations["application/json"] = output_json
+    app_metrics.instrument_api(api)
     api.init_app(app)
 
-    with app.app_context():
-        db.create_all()
+    from .tokens import TokenRevocations
+
+    TokenRevocations().init_app(app)
+
+    # Register the CLI commands. The schema is made or migrated with
+    # "flask db upgrade", not on every start
+    from .migrations import db_command
+    from .sync import sync_command
+    from .transfer import import_command
+
+    app.cli.add_command(db_command)
+    app.cli.add_command(sync_command)
+    app.cli.add_command(import_command)
 
     return app
@@ -1,22 +1,25 @@
 from typing import Tuple
 
-from flask import Response, jsonify, request
-from flask_login import login_user, logout_user
+from flask import current_app, request
+from flask_login import current_user, login_user, logout_user
 from flask_restx import Namespace, Resource, fields
 
-from . import api, db
-from .models import User
+from . import db, login_throttle, password_hasher
+from .models import SessionUser, User, forget_session_user, remember_session_user
+from .passwords import HasherBusy
+from .tokens import REFRESH, bearer_token, issue_tokens, token_revocations, verify
 from .uri import (
     AUTH_ENDPOINT,
     LOGIN_ENDPOINT,
     LOGOUT_ENDPOINT,
+    REFRESH_ENDPOINT,
     REGISTER_ENDPOINT,
     SIGNIN_ENDPOINT,
     SIGNOUT_ENDPOINT,
     SIGNUP_ENDPOINT,
 )
 
-auth_ns = api.namespace("auth", description="User authentication", path=AUTH_ENDPOINT)
+auth_ns = Namespace("auth", description="User authentication", path=AUTH_ENDPOINT)
 
 user_model = auth_ns.model(
     "User",
@@ -40,28 +43,55 @@ class Login(Resource):
     @auth_ns.response(200, "Login succeeded")
     @auth_ns.response(401, "Invalid username or password")
     @auth_ns.response(400, "Failed to log in")
-    @auth_ns.response(500, "Internal server error")
+    @auth_ns.response(429, "Too many failed logins")
+    @auth_ns.response(503, "Too many logins in progress")
     @auth_ns.doc("Log in a user")
-    def post(self) -> Tuple[Response, int]:
+    def post(self) -> Tuple[dict, int]:
         """Log in a user with a username and password."""
-        try:
-            username = request.json.get("username")
-            password = request.json.get("password")
+        username = request.json.get("username")
+        password = request.json.get("password")
+        address = request.remote_addr
 
+        # Refuse brute-force attempts before spending any time on hashing
+        retry_after = login_throttle.retry_after(username, address)
+        if retry_after:
+            return (
+                {"message": "Too many failed logins. Try again later."},
+                429,
+                {"Retry-After": str(retry_after)},
+            )
+
+        try:
             query_user = db.select(User).where(User.username == username)
             user = db.session.execute(query_user).scalar_one_or_none()
 
-            # if user exists and password is correct
-            if user and user.is_password_valid(password):
-                login_user(user)
-                return (
-                    jsonify({"message": "Login succeeded", "user": user.to_dict()}),
-                    200,
-                )
-            else:
-                return jsonify({"message": "Invalid username or password"}), 401
+            if user is None:
+                password_hasher.verify_missing(password)
+            if not user or not user.is_password_correct(password):
+                login_throttle.fail(username, address)
+                return {"message": "Invalid username or password"}, 401
+
+            login_throttle.reset(username, address)
+            # Upgrade the hash while the plaintext is at hand
+            if user.needs_rehash():
+                user.set_password(password)
+                db.session.commit()
+
+            if current_app.config["AUTH_MODE"] == "token":
+                return {
+                    "message": "Login succeeded",
+                    "user": user.to_dict(),
+                    **issue_tokens(user),
+                }, 200
+
+            login_user(user)
+            remember_session_user(user)
+            return {"message": "Login succeeded", "user": user.to_dict()}, 200
+        except HasherBusy:
+            auth_ns.abort(503, "Too many logins in progress. Try again later.")
         except Exception as e:
-            return jsonify({"error": e}), 400
+            db.session.rollback()
+            auth_ns.abort(400, f"Failed to log in. Error: {e}")
 
 
 @auth_ns.route(REGISTER_ENDPOINT)
@@ -69,49 +99,85 @@ class Register(Resource):
     @auth_ns.expect(user_model)
     @auth_ns.response(201, "Created a new user")
     @auth_ns.response(400, "Failed to create a user")
-    def post(self) -> Tuple[Response, int]:
+    @auth_ns.response(503, "Too many sign-ups in progress")
+    def post(self) -> Tuple[dict, int]:
         """Create a new user."""
         try:
             username = request.json.get("username")
             password = request.json.get("password")
 
             user_exists = db.session.execute(
-                db.select(User).where(User.username == username).scalar_one_or_none()
-            )
+                db.select(User).where(User.username == username)
+            ).scalar_one_or_none()
 
             if user_exists:
-                return jsonify({"message": "Username already exists"}), 400
+                return {"message": "Username already exists"}, 400
 
             new_user = User(username=username, password=password)
             db.session.add(new_user)
             db.session.commit()
 
-            return (
-                jsonify(
-                    {
-                        "message": "Successfully created a new user",
-                        "user": new_user.to_dict(),
-                    }
-                ),
-                201,
-            )
+            return {
+                "message": "Successfully created a new user",
+                "user": new_user.to_dict(),
+            }, 201
+        except HasherBusy:
+            auth_ns.abort(503, "Too many sign-ups in progress. Try again later.")
         except Exception as e:
             db.session.rollback()
-            return (
-                jsonify({"message": f"Failed to create a new user. Error {e}"}),
-                400,
-            )
+            return {"message": f"Failed to create a new user. Error {e}"}, 400
 
 
 @auth_ns.route(LOGOUT_ENDPOINT)
 class Logout(Resource):
     @auth_ns.response(200, "Successfully logged out")
     @auth_ns.response(400, "Failed to log out")
-    def post(self) -> Tuple[Response, int]:
+    def post(self) -> Tuple[dict, int]:
         """Log out a user."""
 
         try:
+            if current_app.config["AUTH_MODE"] == "token":
+                token = bearer_token(request)
+                claims = token and verify(token)
+                if claims:
+                    token_revocations.revoke(
+                        claims["sid"],
+                        claims["iat"] + current_app.config["REFRESH_TOKEN_TTL"],
+                    )
+                    db.session.commit()
+                return {"message": "Successfully logged out"}, 200
+
+            if current_user.is_authenticated:
+                forget_session_user(current_user.id)
             logout_user()
-            return jsonify({"message": "Successfully logged out"}), 200
+            return {"message": "Successfully logged out"}, 200
         except Exception as e:
-            return jsonify({"message": f"Error {e}"}), 400
+            return {"message": f"Error {e}"}, 400
+
+
+refresh_model = auth_ns.model(
+    "Refresh token",
+    {"refresh_token": fields.String(required=True, description="The refresh token")},
+)
+
+
+@auth_ns.route(REFRESH_ENDPOINT)
+class Refresh(Resource):
+    @auth_ns.expect(refresh_model)
+    @auth_ns.response(200, "Issued new tokens")
+    @auth_ns.response(401, "Invalid or expired refresh token")
+    @auth_ns.response(404, "Tokens are not enabled")
+    def post(self) -> Tuple[dict, int]:
+        """Trade a refresh token for a new access token (AUTH_MODE "token")."""
+        if current_app.config["AUTH_MODE"] != "token":
+            auth_ns.abort(404, "Tokens are not enabled")
+
+        claims = verify(request.json.get("refresh_token", ""), REFRESH)
+        if not claims:
+            return {"message": "Invalid or expired refresh token"}, 401
+
+        user = SessionUser(claims["sub"], claims["name"])
+        tokens = issue_tokens(user, claims["sid"])
+        # Keep the refresh token, so the session still ends when it expires
+        tokens["refresh_token"] = request.json["refresh_token"]
+        return {"message": "Issued new tokens", **tokens}, 200
@@ -0,0 +1,290 @@
+"""Cache serialized list/task responses and logged-in users, invalidated by writes."""
+
+import hashlib
+import itertools
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Iterable, Optional
+
+from flask import Flask, Response, current_app, g, request
+from flask_login import current_user
+
+try:
+    import redis
+except ImportError:  # The shared backend is optional
+    redis = None
+
+
+class NullCache:
+    """A backend that stores nothing, to turn caching off."""
+
+    def get(self, key: str) -> Optional[Any]:
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def incr(self, key: str) -> int:
+        return 0
+
+    def generation(self, key: str) -> int:
+        return 0
+
+
+class LRUCache:
+    """
+    An in-process cache that holds at most `max_size` entries for `ttl` seconds.
+
+    Generation counters are entries too, so they count towards `max_size`.
+    Each new generation is a value no key has had before, so a counter that
+    was evicted can't come back with the value of an invalidated entry. They
+    start from the clock, so no other process or earlier run hands them out.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._generations = itertools.count(time.time_ns())
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._store(key, time.monotonic() + self.ttl, value)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            return self._new_generation(key)
+
+    def generation(self, key: str) -> int:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return self._new_generation(key)
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _new_generation(self, key: str) -> int:
+        generation = next(self._generations)
+        self._store(key, math.inf, generation)  # Only evicted, never expired
+        return generation
+
+    def _store(self, key: str, expires_at: float, value: Any) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class RedisCache:
+    """A cache shared by every worker, stored in Redis."""
+
+    def __init__(self, url: str, ttl: float = 60):
+        if redis is None:
+            raise RuntimeError("The redis package is required for CACHE_TYPE 'redis'")
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        self.client.set(key, json.dumps(value), ex=int(self.ttl))
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def generation(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+
+class ResponseCache:
+    """
+    Cache the marshalled output of read endpoints.
+
+    Entries are keyed by user and by the version of the data they were built
+    from, as read from the database: so an entry built before a write of any
+    worker is never served after it. Writes through the API also bump the
+    generation of the user or list they touch, which is in the key too, so
+    entries built in the same transaction as a write go stale as well.
+    """
+
+    def __init__(self):
+        self.backend = NullCache()
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions["response_cache"] = self
+        cache_type = app.config.get("CACHE_TYPE", "lru")
+        ttl = app.config.get("CACHE_TTL", 60)
+
+        if cache_type == "lru":
+            self.backend = LRUCache(app.config.get("CACHE_MAX_SIZE", 1024), ttl)
+        elif cache_type == "redis":
+            self.backend = RedisCache(app.config["CACHE_URL"], ttl)
+        else:
+            self.backend = NullCache()
+
+    def invalidate(self, user_id: int, list_ids: Iterable[int] = ()) -> None:
+        """Make the cached reads of a user and some of their lists stale."""
+        self.backend.incr(f"user:{user_id}")
+        for list_id in set(list_ids):
+            self.backend.incr(f"list:{list_id}")
+
+
+class UserCache:
+    """
+    Remember the users that sessions log in as, for `ttl` seconds.
+
+    Entries are plain column values, so they don't hold on to any database
+    session, and live in each process. Invalidating a user bumps their
+    generation, which stales their entries and the session payloads issued
+    before. Generations are shared by every worker through Redis when it is
+    the CACHE_TYPE; otherwise they are per process, so payloads are only
+    trusted by the process that issued them.
+    """
+
+    def __init__(self):
+        self.backend = NullCache()
+        self.generations = NullCache()
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions["user_cache"] = self
+        ttl = app.config.get("USER_CACHE_TTL", 60)
+        max_size = app.config.get("USER_CACHE_MAX_SIZE", 1024)
+        if ttl:
+            self.backend = LRUCache(max_size, ttl)
+        else:
+            self.backend = NullCache()
+
+        if app.config.get("CACHE_TYPE") == "redis":
+            self.generations = RedisCache(app.config["CACHE_URL"])
+        else:
+            self.generations = LRUCache(max_size)
+
+    def get(self, user_id: int) -> Optional[dict]:
+        return self.backend.get(self._key(user_id))
+
+    def set(self, user_id: int, columns: dict) -> None:
+        self.backend.set(self._key(user_id), columns)
+
+    def generation(self, user_id: int) -> int:
+        return self.generations.generation(f"user-generation:{user_id}")
+
+    def invalidate(self, user_id: int) -> None:
+        self.generations.incr(f"user-generation:{user_id}")
+
+    def _key(self, user_id: int) -> str:
+        return f"user:{user_id}:{self.generation(user_id)}"
+
+
+def make_etag(*parts: Any) -> str:
+    """Hash the versions a response was built from into a strong ETag."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def conditional(get_version: Callable[..., Any]) -> Callable:
+    """
+    Answer conditional GETs of a resource method that returns (data, code, headers).
+
+    `get_version` gets the URL arguments and returns the current version of
+    the data, or None to let the method answer (e.g. with a 404). The ETag is
+    made from it, and `cached` below keys its entry by the same
+    version, so a cached body never goes out with a newer ETag. When the ETag
+    matches If-None-Match, a 304 is sent without calling the method at all.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            version = get_version(**kwargs)
+            if version is None:
+                return method(*args, **kwargs)
+
+            g.response_version = version
+            etag = make_etag(
+                request.endpoint, current_user.id, sorted(kwargs.items()), version
+            )
+
+            # Let clients store the response, but make them revalidate it
+            etag_headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+            if request.if_none_match.contains(etag):
+                return Response(status=304, headers=etag_headers)
+
+            data, code, headers = method(*args, **kwargs)
+            return data, code, {**headers, **etag_headers}
+
+        return wrapper
+
+    return decorator
+
+
+def cached(get_version: Callable[..., Any], per_list: bool = True) -> Callable:
+    """
+    Cache a resource method that returns (data, code, headers) in the
+    ResponseCache of the current app.
+
+    `get_version` gets the URL arguments and returns the version of the
+    data, e.g. from the list's version column. With `per_list`, entries
+    also follow the generation of the `list_id` URL argument; otherwise
+    they follow the current user's generation.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            backend = current_app.extensions["response_cache"].backend
+            if per_list:
+                generation = backend.generation(f"list:{kwargs['list_id']}")
+            else:
+                generation = backend.generation(f"user:{current_user.id}")
+
+            # The version `conditional` made the ETag from, if it ran
+            if "response_version" in g:
+                version = g.response_version
+            else:
+                version = get_version(**kwargs)
+            key = ":".join(
+                [
+                    "response",
+                    request.endpoint,
+                    str(current_user.id),
+                    make_etag(version),
+                    str(generation),
+                    request.query_string.decode(),
+                    json.dumps(kwargs, sort_keys=True),
+                ]
+            )
+            hit = backend.get(key)
+            if hit is not None:
+                data, headers = hit
+                return data, 200, headers
+
+            data, code, headers = method(*args, **kwargs)
+            if code == 200:
+                backend.set(key, (data, headers))
+            return data, code, headers
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,261 @@
+"""
+Record the tasks and lists a request changes, as deltas for the change feed
+and entries of the change log that clients sync from.
+"""
+
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import sqlalchemy as sa
+from flask import g
+
+from . import db
+from .models import ChangeLog, SyncHorizon, Task, TaskList
+
+# Kinds of changed rows
+TASK = "task"
+LIST = "list"
+
+# What happened to them. "status" and "moved" changes apply to the task's
+# whole subtree
+CREATED = "created"
+UPDATED = "updated"
+MOVED = "moved"
+STATUS = "status"
+DELETED = "deleted"
+# In order of precedence, when a row changes more than once
+OPS = [UPDATED, STATUS, MOVED, CREATED, DELETED]
+SUBTREE_OPS = (STATUS, MOVED)
+
+
+def record_change(
+    kind: str, op: str, entity_id: int, list_id: Optional[int] = None
+) -> None:
+    """
+    Note a change to a task or list, sent once the transaction commits.
+    Deleted tasks need their `list_id`, since their row is gone by then.
+    """
+    if "changes" not in g:
+        g.changes = []
+    g.changes.append((kind, op, entity_id, list_id))
+
+
+def merge_changes(
+    changes: Iterable[Tuple[str, str, int, Optional[int]]]
+) -> Dict[Tuple[str, int], Tuple[str, Optional[int]]]:
+    """
+    Merge the changes of each row, keyed by kind and ID, in order of last
+    change. A row keeps the most telling of its changes, e.g. created then
+    edited is still created, and completed then renamed still changed its
+    subtree. Its current columns are read afterwards either way.
+    """
+    latest: Dict[Tuple[str, int], Tuple[str, Optional[int]]] = {}
+    for kind, op, entity_id, list_id in changes:
+        previous, previous_list_id = latest.pop((kind, entity_id), (op, None))
+        if OPS.index(previous) > OPS.index(op):
+            op = previous
+        if list_id is None:
+            list_id = previous_list_id
+        latest[(kind, entity_id)] = (op, list_id)
+    return latest
+
+
+def pending_changes() -> List[Tuple[str, str, int, Optional[int]]]:
+    """Take the changes recorded so far, one per row, in order of last change."""
+    return [
+        (kind, op, entity_id, list_id)
+        for (kind, entity_id), (op, list_id) in merge_changes(
+            g.pop("changes", [])
+        ).items()
+    ]
+
+
+def collect_changes(versions: Dict[int, int]) -> List[dict]:
+    """
+    Turn the recorded changes into deltas with the current columns of every
+    row that still exists, and the new `versions` of their lists. Rows are
+    read with one query per kind, so this runs in the transaction that
+    changed them.
+    """
+    changes = pending_changes()
+    if not changes:
+        return []
+
+    db.session.flush()
+    rows = {
+        kind: read_rows(
+            model,
+            {
+                entity_id
+                for k, op, entity_id, _ in changes
+                if k == kind and op != DELETED
+            },
+        )
+        for kind, model in ((TASK, Task), (LIST, TaskList))
+    }
+
+    deltas = []
+    for kind, op, entity_id, list_id in changes:
+        delta = {"kind": kind, "op": op, "id": entity_id}
+        row = rows[kind].get(entity_id)
+        if row is not None:
+            delta["data"] = row._asdict()
+            list_id = row.list_id if kind == TASK else entity_id
+        elif op != DELETED:
+            continue  # Deleted along with its parent, which has a delta
+        elif kind == LIST:
+            list_id = entity_id
+
+        if kind == TASK:
+            delta["list_id"] = list_id
+        if list_id in versions:
+            delta["version"] = versions[list_id]
+        deltas.append(delta)
+    return deltas
+
+
+def read_rows(model: type, ids: Set[int]) -> Dict[int, sa.Row]:
+    """Read the serialized columns of the rows with `ids`, keyed by ID."""
+    if not ids:
+        return {}
+
+    return {
+        row.id: row
+        for row in db.session.execute(
+            sa.select(*model.read_columns()).where(model.id.in_(ids))
+        )
+    }
+
+
+def log_changes(user_id: int, deltas: List[dict]) -> None:
+    """Append deltas to the change log with one INSERT, in the current transaction."""
+    if not deltas:
+        return
+
+    now = int(time.time())
+    db.session.execute(
+        sa.insert(ChangeLog),
+        [
+            {
+                "user_id": user_id,
+                "kind": delta["kind"],
+                "op": delta["op"],
+                "entity_id": delta["id"],
+                "list_id": delta.get("list_id"),
+                "created_at": now,
+            }
+            for delta in deltas
+        ],
+    )
+
+
+def log_bounds() -> Tuple[int, int]:
+    """The ID of the newest change log entry, and the compaction horizon."""
+    return db.session.execute(
+        sa.select(
+            sa.select(sa.func.coalesce(sa.func.max(ChangeLog.id), 0)).scalar_subquery(),
+            sa.select(
+                sa.func.coalesce(sa.func.max(SyncHorizon.upto), 0)
+            ).scalar_subquery(),
+        )
+    ).one()
+
+
+class LoggedChange(NamedTuple):
+    """The latest change of a row, with its current columns unless deleted."""
+
+    kind: str
+    op: str
+    id: int
+    list_id: Optional[int]
+    row: Optional[sa.Row]
+
+
+def read_changes(
+    user_id: int, since: int, limit: int
+) -> Tuple[List[LoggedChange], int, bool]:
+    """
+    Read a user's changes after the cursor `since`, at most `limit` entries.
+
+    Entries of the same row are merged as `merge_changes` does, and carry
+    the row's current columns, or None for a tombstone. Rows gone by now are
+    left out: their tombstone, or their ancestor's, comes later in the log.
+    Return the changes, the cursor to continue from, and whether there are
+    more entries after it.
+    """
+    entries = db.session.execute(
+        sa.select(
+            ChangeLog.kind,
+            ChangeLog.op,
+            ChangeLog.entity_id,
+            ChangeLog.list_id,
+            ChangeLog.id,
+        )
+        .where(ChangeLog.user_id == user_id, ChangeLog.id > since)
+        .order_by(ChangeLog.id)
+        .limit(limit + 1)
+    ).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return [], since, False
+
+    latest = merge_changes(
+        (entry.kind, entry.op, entry.entity_id, entry.list_id) for entry in entries
+    )
+
+    rows = {
+        kind: read_rows(
+            model,
+            {
+                entity_id
+                for (k, entity_id), (op, _) in latest.items()
+                if k == kind and op != DELETED
+            },
+        )
+        for kind, model in ((TASK, Task), (LIST, TaskList))
+    }
+
+    changes = []
+    for (kind, entity_id), (op, list_id) in latest.items():
+        row = rows[kind].get(entity_id)
+        if op == DELETED or row is not None:
+            changes.append(LoggedChange(kind, op, entity_id, list_id, row))
+    return changes, entries[-1].id, more
+
+
+def compact_change_log(retention: int) -> Tuple[int, int]:
+    """
+    Bound the size of the change log, in the current transaction.
+
+    Entries superseded by a later entry of the same row are dropped, which no
+    cursor can miss. The latest "status" or "moved" entry of a row stays
+    though, since a later edit doesn't tell about its subtree. Entries older
+    than `retention` seconds are dropped too, and the horizon moves past
+    them. Return how many of each were dropped.
+    """
+    latest = sa.select(sa.func.max(ChangeLog.id)).group_by(
+        ChangeLog.user_id, ChangeLog.kind, ChangeLog.entity_id
+    )
+    latest_subtree = latest.where(ChangeLog.op.in_(SUBTREE_OPS))
+    superseded = db.session.execute(
+        sa.delete(ChangeLog).where(
+            ChangeLog.id.not_in(latest), ChangeLog.id.not_in(latest_subtree)
+        )
+    ).rowcount
+
+    now = int(time.time())
+    upto = db.session.execute(
+        sa.select(sa.func.max(ChangeLog.id)).where(
+            ChangeLog.created_at < now - retention
+        )
+    ).scalar()
+    expired = 0
+    if upto is not None:
+        expired = db.session.execute(
+            sa.delete(ChangeLog).where(ChangeLog.id <= upto)
+        ).rowcount
+        db.session.execute(sa.delete(SyncHorizon))
+        db.session.add(SyncHorizon(upto=upto, compacted_at=now))
+
+    return superseded, expired
@@ -0,0 +1,111 @@
+"""Keep the denormalized counters and versions of tasks and lists up to date."""
+
+from typing import Dict, Iterable, Optional
+
+import sqlalchemy as sa
+
+from . import db
+from .models import Task, TaskList
+from .tree import subtree_ids
+
+
+def count_subtasks(parent_id: Optional[int], total: int = 0, done: int = 0) -> None:
+    """Add to the subtask counters of a parent task. No-op for top-level tasks."""
+    if parent_id is None or not (total or done):
+        return
+
+    db.session.execute(
+        sa.update(Task)
+        .where(Task.id == parent_id)
+        .values(
+            subtask_total=Task.subtask_total + total,
+            subtask_done=Task.subtask_done + done,
+        )
+    )
+
+
+def count_subtasks_by_parent(
+    totals: Dict[int, int], done: Optional[Dict[int, int]] = None
+) -> None:
+    """
+    Add to the subtask counters of many parent tasks with one UPDATE, keyed by
+    parent ID.
+    """
+    done = {parent_id: delta for parent_id, delta in (done or {}).items() if delta}
+    totals = {parent_id: delta for parent_id, delta in totals.items() if delta}
+    if not (totals or done):
+        return
+
+    values = {}
+    if totals:
+        values["subtask_total"] = Task.subtask_total + sa.case(
+            totals, value=Task.id, else_=0
+        )
+    if done:
+        values["subtask_done"] = Task.subtask_done + sa.case(
+            done, value=Task.id, else_=0
+        )
+    db.session.execute(
+        sa.update(Task).where(Task.id.in_(totals.keys() | done.keys())).values(values)
+    )
+
+
+def count_open(deltas: Dict[int, int]) -> None:
+    """Add to the open task counter of each list, keyed by list ID."""
+    deltas = {list_id: delta for list_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    db.session.execute(
+        sa.update(TaskList)
+        .where(TaskList.id.in_(deltas))
+        .values(open_count=TaskList.open_count + sa.case(deltas, value=TaskList.id))
+    )
+
+
+def count_in_subtree(path: str, is_completed: bool = False) -> Dict[int, int]:
+    """Count the open (or completed) tasks in a subtree, keyed by list ID."""
+    return dict(
+        db.session.execute(
+            sa.select(Task.list_id, sa.func.count())
+            .where(Task.in_subtree(path), Task.is_completed.is_(is_completed))
+            .group_by(Task.list_id)
+        ).all()
+    )
+
+
+def count_in_subtrees(
+    task_ids: Iterable[int], is_completed: bool = False
+) -> Dict[int, int]:
+    """
+    Count the open (or completed) tasks in the subtrees of many tasks, keyed by
+    list ID. The subtrees must not overlap.
+    """
+    return dict(
+        db.session.execute(
+            sa.select(Task.list_id, sa.func.count())
+            .where(
+                Task.id.in_(subtree_ids(task_ids)), Task.is_completed.is_(is_completed)
+            )
+            .group_by(Task.list_id)
+        ).all()
+    )
+
+
+def bump_versions(list_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Mark lists as changed, so conditional reads of them miss. Return the new
+    version of each list that still exists, keyed by list ID.
+    """
+    list_ids = set(list_ids)
+    if not list_ids:
+        return {}
+
+    return dict(
+        db.session.execute(
+            sa.update(TaskList)
+            .where(TaskList.id.in_(list_ids))
+            .values(version=TaskList.version + 1)
+            .returning(TaskList.id, TaskList.version)
+        ).all()
+    )
@@ -0,0 +1,190 @@
+"""
+Tune the database engines, send the reads of GET requests to a read-only
+pool, and keep the SQLite full-text search index.
+"""
+
+from typing import Dict
+
+import sqlalchemy as sa
+from flask import Flask, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# Bind key of the engine that serves GET requests
+READ_ONLY_BIND = "read_only"
+READ_ONLY_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Engine options that only apply to a pool of many connections
+POOL_SIZE_OPTIONS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle")
+
+# Full-text index of task and list names, for SQLite. Rows are keyed by
+# 2 * task ID, or 2 * list ID + 1. The owner ("u<user ID>") and scope
+# ("l<list ID>") columns are single tokens, so searches are narrowed to a
+# user or list by the index itself
+SEARCH_INDEX = "search_index"
+SEARCH_INDEX_TRIGGERS = [
+    f"{SEARCH_INDEX}_{kind}_{event}"
+    for kind in ("task", "list")
+    for event in ("insert", "update", "delete")
+]
+SEARCH_INDEX_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE {SEARCH_INDEX} USING fts5(
+        name, owner, scope,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER {SEARCH_INDEX}_task_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO {SEARCH_INDEX} (rowid, name, owner, scope)
+        SELECT new.id * 2, new.name, 'u' || user_id, 'l' || id
+        FROM task_lists WHERE id = new.list_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER {SEARCH_INDEX}_task_update AFTER UPDATE OF name, list_id
+    ON tasks BEGIN
+        DELETE FROM {SEARCH_INDEX} WHERE rowid = old.id * 2;
+        INSERT INTO {SEARCH_INDEX} (rowid, name, owner, scope)
+        SELECT new.id * 2, new.name, 'u' || user_id, 'l' || id
+        FROM task_lists WHERE id = new.list_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER {SEARCH_INDEX}_task_delete AFTER DELETE ON tasks BEGIN
+        DELETE FROM {SEARCH_INDEX} WHERE rowid = old.id * 2;
+    END
+    """,
+    f"""
+    CREATE TRIGGER {SEARCH_INDEX}_list_insert AFTER INSERT ON task_lists BEGIN
+        INSERT INTO {SEARCH_INDEX} (rowid, name, owner, scope)
+        VALUES (new.id * 2 + 1, new.name, 'u' || new.user_id, 'l' || new.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {SEARCH_INDEX}_list_update AFTER UPDATE OF name ON task_lists
+    BEGIN
+        DELETE FROM {SEARCH_INDEX} WHERE rowid = old.id * 2 + 1;
+        INSERT INTO {SEARCH_INDEX} (rowid, name, owner, scope)
+        VALUES (new.id * 2 + 1, new.name, 'u' || new.user_id, 'l' || new.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {SEARCH_INDEX}_list_delete AFTER DELETE ON task_lists BEGIN
+        DELETE FROM {SEARCH_INDEX} WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+    # Index the rows that were there before
+    f"""
+    INSERT INTO {SEARCH_INDEX} (rowid, name, owner, scope)
+    SELECT id * 2 + 1, name, 'u' || user_id, 'l' || id FROM task_lists
+    UNION ALL
+    SELECT tasks.id * 2, tasks.name, 'u' || task_lists.user_id, 'l' || task_lists.id
+    FROM tasks JOIN task_lists ON task_lists.id = tasks.list_id
+    """,
+]
+
+
+def is_sqlite_file(uri: str) -> bool:
+    url = sa.engine.make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def configure_database(app: Flask) -> None:
+    """
+    Fill in the engine settings of the app before the database is bound.
+
+    An in-memory SQLite database is a single shared connection, so it gets no
+    pool size options and no read-only pool.
+    """
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if sa.engine.make_url(uri).get_backend_name() == "sqlite" and not is_sqlite_file(
+        uri
+    ):
+        for option in POOL_SIZE_OPTIONS:
+            options.pop(option, None)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+    read_only_uri = app.config.get("SQLALCHEMY_READ_ONLY_URI")
+    if (
+        read_only_uri is None
+        and app.config.get("READ_ONLY_POOL")
+        and is_sqlite_file(uri)
+    ):
+        read_only_uri = uri
+
+    if read_only_uri:
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds[READ_ONLY_BIND] = {"url": read_only_uri, **options}
+        app.config["SQLALCHEMY_BINDS"] = binds
+
+
+def set_sqlite_pragmas(engine: sa.Engine, pragmas: Dict[str, str]) -> None:
+    """Run the PRAGMA statements on every new connection of a SQLite engine."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @sa.event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def configure_engines(app: Flask, engines: Dict) -> None:
+    """Apply the configured pragmas, and make the read-only pool refuse writes."""
+    pragmas = app.config.get("SQLITE_PRAGMAS", {})
+    for bind_key, engine in engines.items():
+        if bind_key == READ_ONLY_BIND:
+            set_sqlite_pragmas(engine, {**pragmas, "query_only": "ON"})
+        else:
+            set_sqlite_pragmas(engine, pragmas)
+
+
+def create_search_index(connection: sa.Connection) -> None:
+    """Create the SQLite search index and its triggers, unless they exist."""
+    if connection.dialect.name != "sqlite" or sa.inspect(connection).has_table(
+        SEARCH_INDEX
+    ):
+        return
+
+    for statement in SEARCH_INDEX_DDL:
+        connection.exec_driver_sql(statement)
+
+
+def drop_search_index(connection: sa.Connection) -> None:
+    """Drop the SQLite search index and its triggers."""
+    if connection.dialect.name != "sqlite":
+        return
+
+    for trigger in SEARCH_INDEX_TRIGGERS:
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {SEARCH_INDEX}")
+
+
+class RoutingSession(Session):
+    """
+    A session that reads from the read-only pool while serving a GET request.
+
+    Flushes and explicit INSERT/UPDATE/DELETE statements still go to the
+    primary engine, so a GET that happens to write doesn't fail.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and not isinstance(clause, sa.sql.expression.UpdateBase)
+            and has_request_context()
+            and request.method in READ_ONLY_METHODS
+        ):
+            engine = self._db.engines.get(READ_ONLY_BIND)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,100 @@
+import json
+from typing import Iterator, Optional
+
+from flask import Response, current_app, request
+from flask_login import current_user, login_required
+from flask_restx import Namespace, Resource
+
+from .pubsub import ChangeFeed, FeedReset
+from .uri import CHANGES_ENDPOINT, FEED_ENDPOINT
+
+feed_ns = Namespace("feed", description="Change feed", path=FEED_ENDPOINT)
+
+feed_parser = feed_ns.parser()
+feed_parser.add_argument(
+    "since",
+    type=int,
+    location="args",
+    help="ID of the last event received, to resume from. Last-Event-ID wins",
+)
+
+
+def format_event(event_id: int, event_type: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+    return (
+        f"id: {event_id}\nevent: {event_type}\n"
+        f"data: {json.dumps(data, default=str)}\n\n"
+    )
+
+
+def stream_events(
+    feed: ChangeFeed, user_id: int, since: Optional[int], heartbeat: float
+) -> Iterator[str]:
+    """
+    Send a "ready" event, or "reset" when the client has to reload, then the
+    events missed since `since` and every new one until the client goes away.
+    """
+    # Subscribe once streaming starts, so the subscription is always closed
+    try:
+        subscription, missed = feed.subscribe(user_id, since)
+        reset = False
+    except FeedReset:
+        subscription, missed = feed.subscribe(user_id)
+        reset = True
+
+    try:
+        if reset or since is None:
+            yield format_event(subscription.start, "reset" if reset else "ready", {})
+        else:
+            yield format_event(since, "ready", {})
+        for event_id, data in missed:
+            yield format_event(event_id, "change", data)
+
+        while True:
+            event = subscription.get(heartbeat)
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_event(event[0], "change", event[1])
+    except FeedReset:
+        # Fell too far behind. Closing makes EventSource reconnect and resume
+        return
+    finally:
+        subscription.close()
+
+
+@feed_ns.route(CHANGES_ENDPOINT)
+class Changes(Resource):
+    @login_required
+    @feed_ns.expect(feed_parser)
+    @feed_ns.response(200, "Streaming changes as Server-Sent Events")
+    @feed_ns.produces(["text/event-stream"])
+    def get(self):
+        """
+        Stream the current user's task and list changes as Server-Sent Events.
+
+        Each "change" event is a delta: the kind ("task" or "list"), the op
+        ("created", "updated", "moved", "status" or "deleted"), the ID, the
+        list's new version, and the row's columns unless it was deleted. A
+        "status" delta applies to the task's whole subtree. Reconnects with
+        Last-Event-ID (or `since`) replay the changes missed; a "reset" event
+        means they are gone and the client should reload its lists.
+        """
+        since: Optional[int] = feed_parser.parse_args()["since"]
+        last_event_id = request.headers.get("Last-Event-ID", "")
+        if last_event_id.isdigit():
+            since = int(last_event_id)
+
+        # The stream outlives the app context, so it gets the app's feed
+        events = stream_events(
+            current_app.extensions["change_feed"],
+            current_user.id,
+            since,
+            current_app.config["FEED_HEARTBEAT"],
+        )
+        return Response(
+            events,
+            mimetype="text/event-stream",
+            # Don't let proxies buffer the stream
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
@@ -1,14 +1,33 @@
-from typing import Tuple
+import io
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
+import sqlalchemy as sa
+from flask import Response, current_app, request, stream_with_context
 from flask_login import login_required, current_user
-from flask_restx import Namespace, Resource, fields
+from flask_restx import Model, Namespace, Resource, fields, inputs, marshal
 
-from . import db, api
+from . import db
+from .cache import cached, conditional
+from .changes import CREATED, DELETED, LIST, TASK, record_change
 from .models import TaskList, Task
-from .task import task_model, task_model_with_subtasks
+from .task import commit_changes, task_model, task_model_with_subtasks
+from .transfer import (
+    InvalidRecord,
+    commit_import,
+    export_ndjson,
+    import_records,
+    read_records,
+)
+from .serializer import compile_encoder
+from .tree import load_list_trees, load_trees
 from .uri import (
     LISTS_ENDPOINT,
     GET_ALL_LISTS_ENDPOINT,
+    DUE_TASKS_ENDPOINT,
+    EXPORT_LISTS_ENDPOINT,
+    IMPORT_LISTS_ENDPOINT,
     GET_LIST_ENDPOINT,
     GET_TASKS_ENDPOINT,
     CREATE_LIST_ENDPOINT,
@@ -26,6 +45,7 @@ list_model = list_ns.model(
             required=True, description="List name", min_length=1, max_length=50
         ),
         "user_id": fields.Integer(required=True, description="User ID"),
+        "open_count": fields.Integer(description="Number of open tasks in the list"),
         "tasks": fields.List(
             fields.Nested(task_model_with_subtasks), description="Tasks", required=False
         ),
@@ -35,57 +55,389 @@ list_model = list_ns.model(
 list_parser = list_ns.parser()
 list_parser.add_argument("name", type=str, required=True, help="List name")
 
+# Keyset pagination and projection of list/task reads (GET)
+page_parser = list_ns.parser()
+page_parser.add_argument(
+    "limit", type=inputs.positive, location="args", help="Maximum items per page"
+)
+page_parser.add_argument(
+    "cursor",
+    type=inputs.natural,
+    default=0,
+    location="args",
+    help="ID of the last item of the previous page",
+)
+page_parser.add_argument(
+    "fields", type=str, location="args", help="Comma-separated fields to return"
+)
+page_parser.add_argument(
+    "depth",
+    type=inputs.natural,
+    location="args",
+    help="Levels of subtasks to expand. 0 returns top-level tasks only",
+)
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Views of open tasks by due date, across all of a user's lists
+DUE_VIEWS = ["overdue", "today", "upcoming"]
+
+due_parser = list_ns.parser()
+due_parser.add_argument(
+    "view", choices=DUE_VIEWS, default="today", location="args", help="Tasks to show"
+)
+due_parser.add_argument(
+    "days",
+    type=inputs.int_range(1, 366),
+    default=7,
+    location="args",
+    help="Days after today that upcoming tasks are due within",
+)
+due_parser.add_argument(
+    "today",
+    type=inputs.date_from_iso8601,
+    location="args",
+    help="The client's date (YYYY-MM-DD), the server's by default",
+)
+due_parser.add_argument(
+    "limit", type=inputs.positive, location="args", help="Maximum items per page"
+)
+due_parser.add_argument(
+    "cursor",
+    type=str,
+    location="args",
+    help="Due date and ID of the last task of the previous page",
+)
+
+
+def parse_fields(selected: Optional[str], model: Model) -> Tuple[str, ...]:
+    """Get the requested fields of a model, or all of them."""
+    if not selected:
+        return tuple(model)
+
+    names = tuple(name.strip() for name in selected.split(",") if name.strip())
+    unknown = [name for name in names if name not in model]
+    if unknown:
+        list_ns.abort(400, f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def paginate(items: list, limit: int) -> Tuple[list, dict]:
+    """Trim one-past-the-end results to a page and point to the next page."""
+    if len(items) <= limit:
+        return items, {}
+
+    items = items[:limit]
+    return items, {NEXT_CURSOR_HEADER: str(items[-1].id)}
+
+
+def page_size(limit: Optional[int]) -> int:
+    """Get the page size, bounded by the configured maximum."""
+    return min(
+        limit or current_app.config["PAGE_SIZE"], current_app.config["MAX_PAGE_SIZE"]
+    )
+
+
+@lru_cache(maxsize=64)
+def task_projection(names: Tuple[str, ...], subtasks: bool = True) -> Model:
+    """Build an unregistered task model with only `names` at every level."""
+    projection = Model("Task projection", {name: task_model[name] for name in names})
+    if subtasks:
+        projection["subtasks"] = fields.List(fields.Nested(projection))
+    return projection
+
+
+@lru_cache(maxsize=64)
+def list_projection(names: Tuple[str, ...], subtasks: bool = True) -> Model:
+    """Build an unregistered list model with only `names`."""
+    projection = Model(
+        "Task list projection", {name: list_model[name] for name in names}
+    )
+    if "tasks" in names:
+        projection["tasks"] = fields.List(
+            fields.Nested(task_projection(tuple(task_model), subtasks))
+        )
+    return projection
+
+
+def list_version(list_id: int) -> Optional[int]:
+    """The version of one of the current user's lists, or None if there is none."""
+    return db.session.execute(
+        sa.select(TaskList.version).where(
+            TaskList.id == list_id, TaskList.user_id == current_user.id
+        )
+    ).scalar_one_or_none()
+
+
+def get_owned_list(list_id: int) -> Optional[TaskList]:
+    """The list `list_id`, if the current user owns it."""
+    task_list = db.session.get(TaskList, list_id)
+    if task_list is None or task_list.user_id != current_user.id:
+        return None
+    return task_list
+
+
+def all_lists_version() -> List[Tuple[int, int]]:
+    """The ID and version of each of the current user's lists."""
+    versions = db.session.execute(
+        sa.select(TaskList.id, TaskList.version)
+        .where(TaskList.user_id == current_user.id)
+        .order_by(TaskList.id)
+    ).all()
+    return [tuple(row) for row in versions]
+
 
 @list_ns.route(GET_ALL_LISTS_ENDPOINT)
 class GetAllLists(Resource):
     @login_required
-    @list_ns.marshal_with(list_model, as_list=True)
-    @list_ns.response(200, "Succesfully retrieved all lists")
+    @conditional(all_lists_version)
+    @cached(all_lists_version, per_list=False)
+    @list_ns.expect(page_parser)
+    @list_ns.response(200, "Succesfully retrieved all lists", [list_model])
     @list_ns.response(400, "Failed to retrieve lists")
+    @list_ns.header(NEXT_CURSOR_HEADER, "Cursor of the next page, if there is one")
     def get(self):
-        """Get all lists of the current user from the database."""
+        """Get a page of the current user's lists, ordered by ID."""
+        args = page_parser.parse_args()
+        limit = page_size(args["limit"])
+        names = parse_fields(args["fields"], list_model)
 
         try:
-            lists = (
-                db.session.execute(
-                    select(TaskList).where(TaskList.user_id == current_user.id)
+            # Plain rows of the selected columns, kept out of the session
+            lists = db.session.execute(
+                sa.select(*TaskList.read_columns(names))
+                .where(
+                    TaskList.user_id == current_user.id,
+                    TaskList.id > args["cursor"],
                 )
-                .scalars()  # Convert the result to a list
-                .all()  # Get all the results
+                .order_by(TaskList.id)
+                .limit(limit + 1)  # One more to know if there is a next page
+            ).all()
+            lists, headers = paginate(lists, limit)
+
+            fast = current_app.config["FAST_SERIALIZER"]
+            task_encoder = compile_encoder(task_model, tuple(task_model))
+
+            # Load the task trees of every list in one query, if requested
+            trees = {}
+            if "tasks" in names:
+                trees = load_list_trees(
+                    (task_list.id for task_list in lists),
+                    args["depth"],
+                    task_encoder if fast else None,
+                )
+
+            if fast:
+                list_encoder = compile_encoder(list_model, names)
+                data = []
+                for task_list in lists:
+                    node = list_encoder(task_list)
+                    if "tasks" in names:
+                        node["tasks"] = trees[task_list.id]
+                    data.append(node)
+                return data, 200, headers
+
+            lists = [
+                {**task_list._asdict(), "tasks": trees.get(task_list.id, [])}
+                for task_list in lists
+            ]
+            projection = list_projection(names, args["depth"] != 0)
+            return marshal(lists, projection), 200, headers
+        except Exception as e:
+            list_ns.abort(400, f"Failed to retrieve lists. Error: {e}")
+
+
+def due_filter(view: str, today: date, days: int) -> sa.ColumnElement[bool]:
+    """Match the due dates of a view, relative to `today`."""
+    if view == "overdue":
+        return Task.due_date < today
+    if view == "today":
+        return Task.due_date == today
+    return Task.due_date.between(
+        today + timedelta(days=1), today + timedelta(days=days)
+    )
+
+
+def parse_due_cursor(cursor: str) -> Tuple[date, int]:
+    """Split a "YYYY-MM-DD,ID" cursor."""
+    try:
+        due_date, task_id = cursor.split(",")
+        return date.fromisoformat(due_date), int(task_id)
+    except ValueError:
+        list_ns.abort(400, f"Invalid cursor: {cursor}")
+
+
+@list_ns.route(DUE_TASKS_ENDPOINT)
+class GetDueTasks(Resource):
+    @login_required
+    @list_ns.expect(due_parser)
+    @list_ns.response(200, "Successfully retrieved due tasks", [task_model])
+    @list_ns.response(400, "Invalid cursor")
+    @list_ns.header(NEXT_CURSOR_HEADER, "Cursor of the next page, if there is one")
+    def get(self):
+        """
+        Get a page of the current user's open tasks that are overdue, due
+        today, or due within the next `days`, from every list.
+
+        Tasks are flat, without subtasks, ordered by due date then ID. Each
+        page is one range scan of the owner/status/due date index.
+        """
+        args = due_parser.parse_args()
+        limit = page_size(args["limit"])
+        today = args["today"] or date.today()
+
+        query = (
+            sa.select(*Task.read_columns())
+            .where(
+                Task.user_id == current_user.id,
+                Task.is_completed.is_(False),
+                due_filter(args["view"], today, args["days"]),
             )
+            .order_by(Task.due_date, Task.id)
+            .limit(limit + 1)
+        )
+        if args["cursor"]:
+            query = query.where(
+                sa.tuple_(Task.due_date, Task.id) > parse_due_cursor(args["cursor"])
+            )
+        tasks = db.session.execute(query).all()
+
+        headers = {}
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            last = tasks[-1]
+            headers[NEXT_CURSOR_HEADER] = f"{last.due_date.isoformat()},{last.id}"
+
+        if current_app.config["FAST_SERIALIZER"]:
+            encoder = compile_encoder(task_model, tuple(task_model))
+            return [encoder(task) for task in tasks], 200, headers
+        return marshal([task._asdict() for task in tasks], task_model), 200, headers
 
-            return {"lists": [task_list.to_dict() for task_list in lists]}, 200
+
+@list_ns.route(EXPORT_LISTS_ENDPOINT)
+class ExportLists(Resource):
+    @login_required
+    @list_ns.response(200, "Streaming the export as NDJSON")
+    @list_ns.produces(["application/x-ndjson"])
+    def get(self):
+        """
+        Export all of the current user's lists and tasks as NDJSON.
+
+        Each line is a list or a flat task carrying its `parent_id`. Lists come
+        first, and parent tasks before their subtasks.
+        """
+        records = export_ndjson(
+            current_user.id, current_app.config["EXPORT_BATCH_SIZE"]
+        )
+        return Response(
+            stream_with_context(records),
+            mimetype="application/x-ndjson",
+            headers={"Content-Disposition": "attachment; filename=export.ndjson"},
+        )
+
+
+@list_ns.route(IMPORT_LISTS_ENDPOINT)
+class ImportLists(Resource):
+    @login_required
+    @list_ns.response(201, "Lists and tasks imported successfully")
+    @list_ns.response(400, "Invalid record")
+    @list_ns.response(500, "Internal server error")
+    def post(self):
+        """
+        Import lists and tasks from an export, as new lists of the current user.
+
+        The body is NDJSON, or CSV with the export's keys as header when sent as
+        text/csv. It is read as a stream and written in batches.
+        """
+        file_format = "csv" if request.mimetype == "text/csv" else "ndjson"
+        stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+
+        try:
+            list_ids, tasks = import_records(
+                current_user.id,
+                read_records(stream, file_format),
+                current_app.config["IMPORT_BATCH_SIZE"],
+            )
+            commit_import(current_user.id, list_ids)
+        except InvalidRecord as e:
+            db.session.rollback()
+            list_ns.abort(400, f"Failed to import. Error: {e}")
         except Exception as e:
-            task_ns.abort(400, f"Failed to retrieve lists. Error: {e}")
+            db.session.rollback()
+            list_ns.abort(500, f"Failed to import. Error: {e}")
+
+        return {
+            "message": f"Successfully imported {len(list_ids)} lists and {tasks} tasks."
+        }, 201
 
 
 @list_ns.route(GET_LIST_ENDPOINT)
 class GetList(Resource):
     @login_required
+    @conditional(list_version)
+    @cached(list_version)
     @list_ns.marshal_with(list_model)
     @list_ns.response(200, "Successfully retrieved list")
     @list_ns.response(404, "List not found")
     def get(self, list_id: int):
         """Get a specific list by its ID."""
-        task_list = db.session.get(TaskList, list_id)
+        task_list = db.session.execute(
+            sa.select(*TaskList.read_columns()).where(
+                TaskList.id == list_id, TaskList.user_id == current_user.id
+            )
+        ).first()
         if not task_list:
             list_ns.abort(404, message="List not found")
-        return task_list.to_dict(), 200
+        return {
+            **task_list._asdict(),
+            "tasks": load_list_trees([list_id])[list_id],
+        }, 200
 
 
 @list_ns.route(GET_TASKS_ENDPOINT)
 class GetTasks(Resource):
     @login_required
-    @list_ns.marshal_with(task_model, as_list=True)
-    @list_ns.response(200, "Successfully retrieved tasks")
+    @conditional(list_version)
+    @cached(list_version)
+    @list_ns.expect(page_parser)
+    @list_ns.response(200, "Successfully retrieved tasks", [task_model_with_subtasks])
     @list_ns.response(404, "List not found")
+    @list_ns.header(NEXT_CURSOR_HEADER, "Cursor of the next page, if there is one")
     def get(self, list_id: int):
-        """Get all tasks from a specific list."""
-        task_list = db.session.get(TaskList, list_id)
-        if not task_list:
+        """Get a page of top-level tasks from a specific list, with their subtasks."""
+        args = page_parser.parse_args()
+        limit = page_size(args["limit"])
+        names = parse_fields(args["fields"], task_model)
+
+        list_exists = db.session.execute(
+            sa.select(TaskList.id).where(
+                TaskList.id == list_id, TaskList.user_id == current_user.id
+            )
+        ).first()
+        if not list_exists:
             list_ns.abort(404, message="List not found")
-        tasks = task_list.tasks
-        return {"tasks": [task.to_dict() for task in tasks]}, 200
+
+        # Page through top-level tasks, then load the trees of that page
+        task_ids = db.session.execute(
+            sa.select(Task.id)
+            .where(
+                Task.list_id == list_id,
+                Task.parent_id.is_(None),
+                Task.id > args["cursor"],
+            )
+            .order_by(Task.id)
+            .limit(limit + 1)
+        ).all()
+        task_ids, headers = paginate(task_ids, limit)
+
+        task_ids = [row.id for row in task_ids]
+        if current_app.config["FAST_SERIALIZER"]:
+            encoder = compile_encoder(task_model, names)
+            return load_trees(task_ids, args["depth"], encoder, names), 200, headers
+
+        tasks = load_trees(task_ids, args["depth"], names=names)
+        projection = task_projection(names, args["depth"] != 0)
+        return marshal(tasks, projection), 200, headers
 
 
 @list_ns.route(CREATE_LIST_ENDPOINT)
@@ -102,7 +454,9 @@ class CreateList(Resource):
         try:
             new_list = TaskList(name=name, user_id=current_user.id)
             db.session.add(new_list)
-            db.session.commit()
+            db.session.flush()
+            record_change(LIST, CREATED, new_list.id)
+            commit_changes([new_list.id])
             return {
                 "message": f"Successfully created a new list with name {name}."
             }, 201
@@ -120,14 +474,21 @@ class DeleteList(Resource):
     @list_ns.response(500, "Internal server error")
     def delete(self, list_id: int):
         """Delete a specific list."""
-        try:
-            task_list = db.session.get(TaskList, list_id)
-
-            if not task_list:
-                list_ns.abort(404, f"List with ID {list_id} not found.")
+        task_list = get_owned_list(list_id)
+        if not task_list:
+            list_ns.abort(404, f"List with ID {list_id} not found.")
 
+        try:
+            # Delete the tasks first, in one statement, and leave a tombstone
+            # for each. Their search index rows go with them by trigger
+            task_ids = db.session.execute(
+                sa.delete(Task).where(Task.list_id == list_id).returning(Task.id)
+            ).scalars()
+            for task_id in task_ids:
+                record_change(TASK, DELETED, task_id, list_id)
             db.session.delete(task_list)
-            db.session.commit()
+            record_change(LIST, DELETED, list_id)
+            commit_changes([list_id])
 
             return {"message": f"Successfully deleted list ID {list_id}."}, 200
 
@@ -145,17 +506,15 @@ class EditList(Resource):
     @list_ns.response(500, "Internal server error")
     def put(self, list_id: int):
         """Update list name."""
-        args = edit_list_parser.parse_args()
+        args = list_parser.parse_args()
         name = args["name"]
+        task_list = get_owned_list(list_id)
+        if not task_list:
+            list_ns.abort(404, f"List with ID {list_id} not found.")
 
         try:
-            task_list = db.session.get(TaskList, list_id)
-
-            if not task_list:
-                list_ns.abort(404, f"List with ID {list_id} not found.")
-
             task_list.name = name
-            db.session.commit()
+            commit_changes([list_id])
 
             return {
                 "message": f"Successfully updated list ID {list_id} to new name {name}"
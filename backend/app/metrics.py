@@ -0,0 +1,189 @@
+"""Time requests, count their SQL statements, and export both for Prometheus."""
+
+import hmac
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import sqlalchemy as sa
+from flask import Flask, Response, abort, current_app, g, has_request_context, request
+from flask_restx import Api
+
+from .uri import METRICS_ENDPOINT
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class RequestMetrics:
+    """What one request spent, collected while it runs."""
+
+    __slots__ = ("started_at", "statements", "db_time", "serialize_time")
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label set."""
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series: Dict[Tuple, List] = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, labels: Tuple, value: float) -> None:
+        series = self.series.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self, label_names: Tuple[str, ...]) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            label_text = ",".join(
+                f'{name}="{value}"' for name, value in zip(label_names, labels)
+            )
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}'
+                )
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Metrics:
+    """
+    Instrument every request of an app.
+
+    Each response gets a Server-Timing header with the total time, the time
+    and number of SQL statements, and the time spent encoding the body.
+    Latency and statement count histograms per restx resource are served
+    in the Prometheus text format at METRICS_ENDPOINT, to scrapers that send
+    METRICS_TOKEN as a bearer token. They are kept per process, so each
+    worker reports its own.
+    """
+
+    LABELS = ("endpoint", "method")
+
+    def __init__(self):
+        self.latency = Histogram(
+            "http_request_duration_seconds",
+            "Time to serve a request.",
+            LATENCY_BUCKETS,
+        )
+        self.statements = Histogram(
+            "http_request_sql_statements",
+            "SQL statements run by a request.",
+            STATEMENT_BUCKETS,
+        )
+        self.db_time = Histogram(
+            "http_request_sql_duration_seconds",
+            "Time a request spent running SQL statements.",
+            LATENCY_BUCKETS,
+        )
+        self.responses: Dict[Tuple, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask, engines: Iterable[sa.Engine]) -> None:
+        app.extensions["metrics"] = self
+        if not app.config.get("METRICS_ENABLED", True):
+            return
+
+        for engine in engines:
+            sa.event.listen(engine, "before_cursor_execute", self._before_execute)
+            sa.event.listen(engine, "after_cursor_execute", self._after_execute)
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        app.add_url_rule(METRICS_ENDPOINT, "metrics", self.export)
+
+    def instrument_api(self, api: Api) -> None:
+        """Time how long the API takes to encode its responses."""
+        for mediatype, represent in list(api.representations.items()):
+            api.representations[mediatype] = self._timed(represent)
+
+    def export(self) -> Response:
+        """Render every metric in the Prometheus text format."""
+        token = current_app.config.get("METRICS_TOKEN")
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(),
+            f"Bearer {token}".encode(),
+        ):
+            return Response(
+                "Unauthorized\n", 401, {"WWW-Authenticate": "Bearer"}, "text/plain"
+            )
+
+        with self._lock:
+            lines = [
+                "# HELP http_responses_total Responses sent, by status.",
+                "# TYPE http_responses_total counter",
+            ]
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append(
+                    f'http_responses_total{{endpoint="{endpoint}",method="{method}",'
+                    f'status="{status}"}} {count}'
+                )
+            for histogram in (self.latency, self.statements, self.db_time):
+                lines += histogram.render(self.LABELS)
+
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    def _timed(self, represent: Callable) -> Callable:
+        def timed_represent(data, code, headers):
+            started_at = time.perf_counter()
+            response = represent(data, code, headers)
+            if has_request_context() and "request_metrics" in g:
+                g.request_metrics.serialize_time += time.perf_counter() - started_at
+            return response
+
+        return timed_represent
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+        if has_request_context() and "request_metrics" in g:
+            g.request_metrics.statements += 1
+            g.request_metrics.db_time += elapsed
+
+    def _start_request(self) -> None:
+        g.request_metrics = RequestMetrics()
+
+    def _end_request(self, response: Response) -> Response:
+        request_metrics = g.pop("request_metrics", None)
+        if request_metrics is None:
+            return response
+
+        elapsed = time.perf_counter() - request_metrics.started_at
+        response.headers.add(
+            "Server-Timing",
+            f"app;dur={elapsed * 1000:.1f}, "
+            f'db;desc="{request_metrics.statements} statements";'
+            f"dur={request_metrics.db_time * 1000:.1f}, "
+            f"serialize;dur={request_metrics.serialize_time * 1000:.1f}",
+        )
+
+        labels = (request.endpoint or "unmatched", request.method)
+        with self._lock:
+            self.latency.observe(labels, elapsed)
+            self.statements.observe(labels, request_metrics.statements)
+            self.db_time.observe(labels, request_metrics.db_time)
+            self.responses[labels + (response.status_code,)] += 1
+        return response
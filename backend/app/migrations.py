@@ -0,0 +1,276 @@
+"""
+Versioned schema migrations, portable between SQLite and PostgreSQL.
+
+A new database is created from the models and stamped with the latest
+version. A database without a version table was made by `db.create_all()`
+before migrations existed, and gets every migration applied in order.
+"""
+
+from datetime import datetime, timezone
+from typing import Callable, List, NamedTuple, Optional
+
+import click
+import sqlalchemy as sa
+from flask.cli import AppGroup
+
+from . import db
+from .database import create_search_index, drop_search_index
+from .models import PATH_SEPARATOR, RevokedToken, Task, TaskList
+
+metadata = sa.MetaData()
+schema_migrations = sa.Table(
+    "schema_migrations",
+    metadata,
+    sa.Column("version", sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column("description", sa.String(200), nullable=False),
+    sa.Column("applied_at", sa.DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sa.Connection], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str) -> Callable:
+    """Register a function that takes a connection as the next migration."""
+
+    def decorator(apply: Callable[[sa.Connection], None]) -> Callable:
+        assert version == len(MIGRATIONS) + 1, "Migrations must be numbered in order"
+        MIGRATIONS.append(Migration(version, description, apply))
+        return apply
+
+    return decorator
+
+
+def create_indexes(connection: sa.Connection, table: sa.Table, *names: str) -> None:
+    """Create the named indexes of a model's table, unless they exist."""
+    for index in table.indexes:
+        if index.name in names:
+            index.create(connection, checkfirst=True)
+
+
+@migration(1, "Index tasks by list and parent, lists by user, and type due dates")
+def index_reads_and_type_due_dates(connection: sa.Connection) -> None:
+    create_indexes(
+        connection, Task.__table__, "ix_tasks_list_id_parent_id", "ix_tasks_parent_id"
+    )
+    create_indexes(connection, TaskList.__table__, "ix_task_lists_user_id_id")
+
+    # Due dates were free-form strings; keep the valid ones, date the rest today
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(
+            "ALTER TABLE tasks ALTER COLUMN due_date TYPE DATE USING "
+            "CASE WHEN due_date ~ '^\\d{4}-\\d{2}-\\d{2}$' THEN due_date::date "
+            "ELSE CURRENT_DATE END"
+        )
+    else:
+        # SQLite stores dates as ISO text, so only the values need fixing
+        connection.exec_driver_sql(
+            "UPDATE tasks SET due_date = COALESCE(date(due_date), date('now'))"
+        )
+
+
+@migration(2, "Copy list owners to tasks and index tasks by owner and due date")
+def index_tasks_by_owner(connection: sa.Connection) -> None:
+    columns = {column["name"] for column in sa.inspect(connection).get_columns("tasks")}
+    if "user_id" not in columns:
+        connection.exec_driver_sql(
+            "ALTER TABLE tasks ADD COLUMN user_id INTEGER REFERENCES users (id)"
+        )
+    connection.exec_driver_sql(
+        "UPDATE tasks SET user_id = "
+        "(SELECT user_id FROM task_lists WHERE task_lists.id = tasks.list_id)"
+    )
+    create_indexes(connection, Task.__table__, "ix_tasks_user_id_due_date")
+
+
+def add_columns(connection: sa.Connection, table: str, columns: dict) -> List[str]:
+    """Add the columns, keyed by name to their DDL, that the table lacks."""
+    existing = {column["name"] for column in sa.inspect(connection).get_columns(table)}
+    added = [name for name in columns if name not in existing]
+    for name in added:
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN {name} {columns[name]}"
+        )
+    return added
+
+
+def rebuild_sqlite_table(connection: sa.Connection, table: sa.Table) -> None:
+    """
+    Recreate a SQLite table from its model, keeping its rows.
+
+    SQLite can't change the constraints of a column, so the table is copied
+    into a new one, which then takes its place along with its indexes. The
+    search index triggers of tasks and lists go with the old table, so the
+    index is rebuilt for them.
+    """
+    names = ", ".join(column.name for column in table.columns)
+    create = str(sa.schema.CreateTable(table).compile(connection))
+    searched = table.name in (Task.__tablename__, TaskList.__tablename__)
+    connection.exec_driver_sql("PRAGMA defer_foreign_keys = ON")
+    if searched:
+        drop_search_index(connection)
+    connection.exec_driver_sql(
+        create.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE new_{table.name} ")
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO new_{table.name} ({names}) SELECT {names} FROM {table.name}"
+    )
+    connection.exec_driver_sql(f"DROP TABLE {table.name}")
+    connection.exec_driver_sql(f"ALTER TABLE new_{table.name} RENAME TO {table.name}")
+    for index in table.indexes:
+        index.create(connection)
+    if searched:
+        create_search_index(connection)
+
+
+@migration(3, "Add task paths and progress counters, and list versions and counters")
+def add_paths_and_counters(connection: sa.Connection) -> None:
+    postgresql = connection.dialect.name == "postgresql"
+    add_columns(
+        connection,
+        "tasks",
+        {
+            "path": 'VARCHAR COLLATE "C"' if postgresql else "VARCHAR",
+            "subtask_total": "INTEGER NOT NULL DEFAULT 0",
+            "subtask_done": "INTEGER NOT NULL DEFAULT 0",
+        },
+    )
+    add_columns(
+        connection,
+        "task_lists",
+        {
+            "version": "INTEGER NOT NULL DEFAULT 1",
+            "open_count": "INTEGER NOT NULL DEFAULT 0",
+        },
+    )
+
+    # Index every task under its ancestors, roots first
+    separator = f"'{PATH_SEPARATOR}'"
+    connection.exec_driver_sql(
+        "WITH RECURSIVE tree (id, path, depth) AS ("
+        f"SELECT id, CAST(id AS VARCHAR) || {separator}, 0 "
+        "FROM tasks WHERE parent_id IS NULL "
+        "UNION ALL "
+        f"SELECT tasks.id, tree.path || CAST(tasks.id AS VARCHAR) || {separator}, "
+        "tree.depth + 1 FROM tasks JOIN tree ON tasks.parent_id = tree.id) "
+        "UPDATE tasks SET path = tree.path, depth = tree.depth "
+        "FROM tree WHERE tree.id = tasks.id"
+    )
+    # Count the subtasks of every task and the open tasks of every list
+    connection.exec_driver_sql(
+        "UPDATE tasks SET subtask_total = counts.total, subtask_done = counts.done "
+        "FROM (SELECT parent_id, COUNT(*) AS total, "
+        "SUM(CASE WHEN is_completed THEN 1 ELSE 0 END) AS done "
+        "FROM tasks WHERE parent_id IS NOT NULL GROUP BY parent_id) AS counts "
+        "WHERE counts.parent_id = tasks.id"
+    )
+    connection.exec_driver_sql(
+        "UPDATE task_lists SET open_count = counts.open_tasks "
+        "FROM (SELECT list_id, COUNT(*) AS open_tasks FROM tasks "
+        "WHERE NOT is_completed GROUP BY list_id) AS counts "
+        "WHERE counts.list_id = task_lists.id"
+    )
+
+    # A path is always set, so none can pass for the empty subtree
+    if postgresql:
+        connection.exec_driver_sql("ALTER TABLE tasks ALTER COLUMN path SET NOT NULL")
+        connection.exec_driver_sql(
+            "ALTER TABLE users ALTER COLUMN password_hash TYPE VARCHAR(256)"
+        )
+        create_indexes(connection, Task.__table__, "ix_tasks_path")
+    elif any(
+        column["name"] == "path" and column["nullable"]
+        for column in sa.inspect(connection).get_columns("tasks")
+    ):
+        rebuild_sqlite_table(connection, Task.__table__)
+    else:
+        create_indexes(connection, Task.__table__, "ix_tasks_path")
+
+
+@migration(4, "Never reuse the IDs of revoked tokens on SQLite")
+def autoincrement_revoked_tokens(connection: sa.Connection) -> None:
+    # Workers pick up revocations by ID, so a freed ID handed out again would
+    # be skipped by the ones that saw it. PostgreSQL sequences never do that
+    if connection.dialect.name != "sqlite":
+        return
+
+    create = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (RevokedToken.__tablename__,),
+    ).scalar()
+    if "AUTOINCREMENT" not in create.upper():
+        rebuild_sqlite_table(connection, RevokedToken.__table__)
+
+
+def current_version(connection: sa.Connection) -> Optional[int]:
+    """The version of the schema, or None if it isn't versioned yet."""
+    if not sa.inspect(connection).has_table(schema_migrations.name):
+        return None
+    return connection.execute(
+        sa.select(sa.func.coalesce(sa.func.max(schema_migrations.c.version), 0))
+    ).scalar_one()
+
+
+def stamp(connection: sa.Connection, migration: Migration) -> None:
+    connection.execute(
+        schema_migrations.insert().values(
+            version=migration.version,
+            description=migration.description,
+            applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        )
+    )
+
+
+def upgrade(engine: sa.Engine) -> List[Migration]:
+    """
+    Bring the schema up to the latest version in one transaction.
+
+    Returns the migrations that were applied; none for a new database.
+    """
+    with engine.begin() as connection:
+        version = current_version(connection)
+        if version is None:
+            new_database = not sa.inspect(connection).has_table(Task.__tablename__)
+            metadata.create_all(connection)
+            if new_database:
+                db.metadata.create_all(connection)
+                for migration in MIGRATIONS:
+                    stamp(connection, migration)
+                return []
+            version = 0
+
+        # Tables added since the database was made, which no migration creates
+        db.metadata.create_all(connection)
+
+        pending = [migration for migration in MIGRATIONS if migration.version > version]
+        for migration in pending:
+            migration.apply(connection)
+            stamp(connection, migration)
+        return pending
+
+
+db_command = AppGroup("db", help="Manage the database schema.")
+
+
+@db_command.command("upgrade")
+def upgrade_command():
+    """Create the tables, or migrate them to the latest version."""
+    applied = upgrade(db.engine)
+    for migration in applied:
+        click.echo(f"Applied {migration.version}: {migration.description}")
+    with db.engine.connect() as connection:
+        click.echo(f"Schema is at version {current_version(connection)}.")
+
+
+@db_command.command("current")
+def current_command():
+    """Show the version of the schema."""
+    with db.engine.connect() as connection:
+        version = current_version(connection)
+    click.echo("Schema is not versioned." if version is None else f"Version {version}")
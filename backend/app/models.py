@@ -1,17 +1,92 @@
 from datetime import date
-from typing import List, Optional, Set
+from typing import Iterable, List, Optional, Set, Tuple
 
 import sqlalchemy as sa  # database functions
 import sqlalchemy.orm as so
+from flask import current_app, session
 from flask_login import UserMixin
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from backend.app import db, login_manager
+from backend.app import db, login_manager, password_hasher, user_cache
+from backend.app.database import create_search_index, drop_search_index
+
+PATH_SEPARATOR = "/"
+
+
+def read_columns(
+    model: type, serialized: Tuple[str, ...], keys: Tuple[str, ...], names=None
+) -> List[sa.Column]:
+    """
+    Columns of `model` to select for a read that serializes `names`, or every
+    serialized column. The `keys` that rows are grouped by are always included.
+    """
+    wanted = set(serialized if names is None else names) | set(keys)
+    return [
+        model.__table__.c[name]
+        for name in dict.fromkeys(serialized + keys)
+        if name in wanted and name in model.__table__.c
+    ]
+
+
+# Session key of the user payload, see SESSION_USER_PAYLOAD
+SESSION_USER_KEY = "_user"
+
+
+class SessionUser(UserMixin):
+    """The logged-in user as carried by the signed session, without a row."""
+
+    def __init__(self, id: int, username: str):
+        self.id = id
+        self.username = username
+
+    def to_dict(self):
+        return {"id": self.id, "username": self.username}
 
 
 @login_manager.user_loader
-def load_user(id):
-    return db.session.get(User, user_id)
+def load_user(user_id: str):
+    """
+    Load the user of a session from its payload, the user cache, or the database.
+    """
+    user_id = int(user_id)
+
+    if current_app.config.get("SESSION_USER_PAYLOAD"):
+        payload = session.get(SESSION_USER_KEY)
+        if (
+            payload
+            and payload["id"] == user_id
+            and payload["generation"] == user_cache.generation(user_id)
+        ):
+            return SessionUser(payload["id"], payload["username"])
+
+    columns = user_cache.get(user_id)
+    if columns is not None:
+        # Attach a copy to the session as if it had been loaded, without a query
+        user = User.__mapper__.class_manager.new_instance()
+        for name, value in columns.items():
+            setattr(user, name, value)
+        so.make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.set(user_id, user.columns())
+    return user
+
+
+def remember_session_user(user: "User") -> None:
+    """Put the user in the signed session payload, if those are enabled."""
+    if current_app.config.get("SESSION_USER_PAYLOAD"):
+        session[SESSION_USER_KEY] = {
+            "id": user.id,
+            "username": user.username,
+            "generation": user_cache.generation(user.id),
+        }
+
+
+def forget_session_user(user_id: int) -> None:
+    """Stale the cached user and every session payload issued for them."""
+    user_cache.invalidate(user_id)
+    session.pop(SESSION_USER_KEY, None)
 
 
 class User(UserMixin, db.Model):
@@ -21,7 +96,7 @@ class User(UserMixin, db.Model):
     Attributes:
     - id: int, primary key
     - username: str, unique, 32 characters
-    - password_hash: str, 128 characters
+    - password_hash: str, 256 characters
 
     Relationships:
     - Can have multiple task lists
@@ -31,7 +106,7 @@ class User(UserMixin, db.Model):
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     username: so.Mapped[str] = so.mapped_column(sa.String(32), index=True, unique=True)
-    password_hash: so.Mapped[str] = so.mapped_column(sa.String(128))
+    password_hash: so.Mapped[str] = so.mapped_column(sa.String(256))
 
     task_lists: so.WriteOnlyMapped[List["TaskList"]] = so.relationship(
         back_populates="user"
@@ -44,11 +119,97 @@ class User(UserMixin, db.Model):
 
     def is_password_correct(self, password: str) -> bool:
         """Check if the password is valid."""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
     def set_password(self, password: str) -> None:
-        """Set the user's password."""
-        self.password_hash = generate_password_hash(password)
+        """Set the user's password. Logged-in sessions reload the user."""
+        self.password_hash = password_hasher.hash(password)
+        if self.id is not None:
+            user_cache.invalidate(self.id)
+
+    def needs_rehash(self) -> bool:
+        """Check if the password was hashed with outdated parameters."""
+        return password_hasher.needs_rehash(self.password_hash)
+
+    def to_dict(self):
+        return {"id": self.id, "username": self.username}
+
+    def columns(self) -> dict:
+        """The column values of the user, to cache."""
+        return {
+            "id": self.id,
+            "username": self.username,
+            "password_hash": self.password_hash,
+        }
+
+
+class RevokedToken(db.Model):
+    """
+    A token session revoked by logging out, kept until its tokens expire.
+
+    Attributes:
+    - id: int, primary key, in order of revocation, never reused, so workers
+      can pick up new revocations by ID
+    - session_id: str, shared by the access and refresh tokens of a login
+    - expires_at: int, Unix time when the session's last token expires
+    """
+
+    __tablename__ = "revoked_tokens"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
+    session_id: so.Mapped[str] = so.mapped_column(sa.String(32), unique=True)
+    expires_at: so.Mapped[int] = so.mapped_column(index=True)
+
+
+class ChangeLog(db.Model):
+    """
+    An append-only log of the changes to each user's tasks and lists, that
+    clients sync from. Compaction drops the entries that later ones supersede
+    and the ones older than the retention period.
+
+    Attributes:
+    - id: int, primary key, never reused, so it orders the log and is the cursor
+    - user_id: int, owner of the changed row
+    - kind: str, "task" or "list"
+    - op: str, what happened: "created", "updated", "moved", "status", "deleted"
+    - entity_id: int, ID of the changed task or list
+    - list_id: int, list of the task, kept for deleted tasks
+    - created_at: int, Unix time of the change
+    """
+
+    __tablename__ = "change_log"
+    __table_args__ = (
+        # Each user's changes after a cursor
+        sa.Index("ix_change_log_user_id_id", "user_id", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("users.id"))
+    kind: so.Mapped[str] = so.mapped_column(sa.String(8))
+    op: so.Mapped[str] = so.mapped_column(sa.String(8))
+    entity_id: so.Mapped[int]
+    list_id: so.Mapped[Optional[int]]
+    created_at: so.Mapped[int] = so.mapped_column(index=True)
+
+
+class SyncHorizon(db.Model):
+    """
+    The last change log entry that compaction may have dropped outright.
+    Clients that synced before it have to reload everything.
+
+    Attributes:
+    - id: int, primary key, in order of compaction
+    - upto: int, ID of the newest dropped entry
+    - compacted_at: int, Unix time of the compaction
+    """
+
+    __tablename__ = "sync_horizons"
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
+    upto: so.Mapped[int]
+    compacted_at: so.Mapped[int]
 
 
 class TaskList(db.Model):
@@ -59,6 +220,8 @@ class TaskList(db.Model):
     - id: int, primary key
     - name: str, 100 characters
     - user_id: int, foreign key
+    - open_count: int, number of tasks in the list that are not completed
+    - version: int, bumped by every change to the list or its tasks
 
     Relationships:
     - Belongs to a user
@@ -66,28 +229,43 @@ class TaskList(db.Model):
     """
 
     __tablename__ = "task_lists"
+    __table_args__ = (
+        # Keyset pages of a user's lists
+        sa.Index("ix_task_lists_user_id_id", "user_id", "id"),
+        # Never reuse the ID of a deleted list, so (id, version) stays unique
+        {"sqlite_autoincrement": True},
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(100), index=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.Integer, sa.ForeignKey("users.id"))
+    open_count: so.Mapped[int] = so.mapped_column(default=0)
+    version: so.Mapped[int] = so.mapped_column(default=1)
 
     user: so.Mapped["User"] = so.relationship(back_populates="task_lists")
     tasks: so.Mapped[List["Task"]] = so.relationship(
         back_populates="task_list"  # refer to the attr "task_list" in the Task class
     )
 
-    def to_dict(self):
-        """Add top-level tasks to the list"""
-        # Trigger loading of tasks if they are lazy-loaded
-        sections = (
-            self.sections.all() if hasattr(self.sections, "all") else self.sections
-        )
+    # Columns serialized by reads, in order
+    SERIALIZED = ("id", "name", "user_id", "open_count")
+
+    @classmethod
+    def read_columns(cls, names: Optional[Iterable[str]] = None) -> List[sa.Column]:
+        """Columns to select lists as rows, see `read_columns`."""
+        return read_columns(cls, cls.SERIALIZED, ("id",), names)
+
+    def to_dict(self, tasks: Optional[List[dict]] = None):
+        """Add top-level tasks to the list, unless their trees are already loaded"""
+        if tasks is None:
+            tasks = [task.to_dict() for task in self.tasks if task.parent_id is None]
 
         return {
             "id": self.id,
             "name": self.name,
             "user_id": self.user_id,
-            "sections": [section.to_dict() for section in sections],
+            "open_count": self.open_count,
+            "tasks": tasks,
         }
 
 
@@ -98,6 +276,9 @@ class Task(db.Model):
     - due_date: date
     - is_completed: bool
     - list_id: int, foreign key
+    - user_id: int, owner of the list, copied for due-date views across lists
+    - path: str, materialized path of IDs from the root, e.g. "1/5/9/"
+    - subtask_total, subtask_done: int, number of (completed) direct subtasks
 
     Relationships:
     - Falls under task list
@@ -106,42 +287,125 @@ class Task(db.Model):
     """
 
     __tablename__ = "tasks"
+    __table_args__ = (
+        # Top-level tasks of a list, and tasks of a list by parent
+        sa.Index("ix_tasks_list_id_parent_id", "list_id", "parent_id"),
+        # Subtasks of a task, for tree walks and counters
+        sa.Index("ix_tasks_parent_id", "parent_id"),
+        # A user's open (or completed) tasks by due date, across their lists
+        sa.Index(
+            "ix_tasks_user_id_due_date", "user_id", "is_completed", "due_date", "id"
+        ),
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(100))
 
-    due_date: so.Mapped[str] = so.mapped_column(
-        sa.String, default=sa.func.current_date(type_=sa.String)
-    )
+    due_date: so.Mapped[date] = so.mapped_column(sa.Date, default=date.today)
     is_completed: so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
     parent_id: so.Mapped[Optional[int]] = so.mapped_column(
         sa.ForeignKey("tasks.id"), nullable=True
     )
     depth: so.Mapped[int] = so.mapped_column(default=0)
+    # Ancestry index: the ID of every ancestor and the task itself, root first
+    # Compared byte-wise, so range scans work under any PostgreSQL locale.
+    # There is no default: a task inserted without `set_paths` is refused
+    path: so.Mapped[str] = so.mapped_column(
+        sa.String().with_variant(sa.String(collation="C"), "postgresql"),
+        index=True,
+    )
+    # Progress counters over direct subtasks, maintained by the write paths
+    subtask_total: so.Mapped[int] = so.mapped_column(default=0)
+    subtask_done: so.Mapped[int] = so.mapped_column(default=0)
     list_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("task_lists.id"))
+    # Filled in from the list on insert, see `set_task_owner`
+    user_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey("users.id"))
 
     task_list: so.Mapped["TaskList"] = so.relationship(back_populates="tasks")
 
     # self-referential relationship to create a tree of tasks
+    # Whole trees are read with tree.py, so only load subtasks when accessed
     subtasks: so.Mapped[List["Task"]] = so.relationship(
         backref=so.backref("parent", remote_side=[id]),
-        lazy="selectin",
+        lazy="select",
         cascade="all, delete-orphan",
     )
 
-    def to_dict(self):
-        return {
+    # Columns serialized by reads, in order
+    SERIALIZED = (
+        "id",
+        "name",
+        "due_date",
+        "is_completed",
+        "parent_id",
+        "list_id",
+        "subtask_total",
+        "subtask_done",
+    )
+
+    @classmethod
+    def read_columns(cls, names: Optional[Iterable[str]] = None) -> List[sa.Column]:
+        """Columns to select tasks as rows, see `read_columns`. Trees need the keys."""
+        return read_columns(cls, cls.SERIALIZED, ("id", "parent_id", "list_id"), names)
+
+    def to_dict(self, subtasks: bool = True):
+        """Serialize the task. Set `subtasks` to False to skip the nested tree."""
+        task_dict = {
             "id": self.id,
             "name": self.name,
             "due_date": self.due_date,
             "is_completed": self.is_completed,
             "parent_id": self.parent_id,
             "list_id": self.list_id,
-            "subtasks": [subtask.to_dict() for subtask in self.subtasks],
+            "subtask_total": self.subtask_total,
+            "subtask_done": self.subtask_done,
         }
+        if subtasks:
+            task_dict["subtasks"] = [subtask.to_dict() for subtask in self.subtasks]
+        return task_dict
 
     def calculate_depth(self):
-        if self.parent_id is None:
+        if self.path:
+            return self.path.count(PATH_SEPARATOR) - 1
+        elif self.parent_id is None:
             return 0
         else:
             return self.parent.calculate_depth() + 1
+
+    def ancestor_ids(self) -> List[int]:
+        """IDs of the task's ancestors from the root down to its parent."""
+        return [int(task_id) for task_id in self.path.split(PATH_SEPARATOR)[:-2]]
+
+    @staticmethod
+    def in_subtree(path: str) -> sa.ColumnElement[bool]:
+        """
+        Match the task at `path` and all of its descendants.
+
+        Uses a range on the indexed path column rather than LIKE, which SQLite
+        can't serve from a case-sensitive index.
+        """
+        # "/" sorts right before "0", so "1/5/" <= descendant < "1/50"
+        upper_bound = path[:-1] + chr(ord(PATH_SEPARATOR) + 1)
+        return sa.and_(Task.path >= path, Task.path < upper_bound)
+
+
+@sa.event.listens_for(Task, "before_insert")
+def set_task_owner(mapper, connection, task: Task) -> None:
+    """Copy the owner of a new task's list within the INSERT, without a query."""
+    if task.user_id is None:
+        task.user_id = (
+            sa.select(TaskList.user_id)
+            .where(TaskList.id == task.list_id)
+            .scalar_subquery()
+        )
+
+
+# Keep the search index with the tables it is built from, on every create_all
+@sa.event.listens_for(db.metadata, "after_create")
+def on_create_all(metadata, connection, **kwargs):
+    create_search_index(connection)
+
+
+@sa.event.listens_for(db.metadata, "before_drop")
+def on_drop_all(metadata, connection, **kwargs):
+    drop_search_index(connection)
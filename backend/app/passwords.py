@@ -0,0 +1,147 @@
+"""Hash and check passwords off the request threads, and throttle failed logins."""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, Tuple
+
+from flask import Flask
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+
+
+class HasherBusy(Exception):
+    """Raised when every slot of the hashing pool stayed taken for too long."""
+
+
+class PasswordHasher:
+    """
+    Hash and verify passwords with the configured werkzeug method.
+
+    The work runs in a pool of `PASSWORD_HASH_WORKERS` processes, so a burst
+    of logins keeps those cores busy instead of holding the GIL of the web
+    workers. At most `PASSWORD_HASH_QUEUE` jobs are in flight at a time; the
+    rest wait up to `PASSWORD_HASH_TIMEOUT` seconds and then fail with
+    HasherBusy. With no workers, or outside of an app, hashing runs inline.
+    """
+
+    def __init__(self):
+        self.method = DEFAULT_HASH_METHOD
+        self.workers = 0
+        self.timeout: Optional[float] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._dummy_hash: Optional[Tuple[str, str]] = None  # (method, hash)
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions["password_hasher"] = self
+        self.method = app.config.get("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD)
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", 0)
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT")
+        queue = app.config.get("PASSWORD_HASH_QUEUE") or self.workers
+        self._slots = threading.BoundedSemaphore(max(queue, 1))
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+    def verify_missing(self, password: str) -> bool:
+        """
+        Check a password for a user that doesn't exist, which always fails.
+        It takes as long as a wrong password, so timings don't tell which
+        usernames exist.
+        """
+        self.verify(self.dummy_hash(), password)
+        return False
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Whether a hash was made with other parameters than the configured ones.
+
+        The configured method may leave parameters out, e.g. "scrypt", so the
+        parameters werkzeug writes for it, defaults included, are compared.
+        """
+        return password_hash.split("$", 1)[0] != self.dummy_hash().split("$", 1)[0]
+
+    def dummy_hash(self) -> str:
+        """A hash of a random password with the configured method, made once."""
+        dummy = self._dummy_hash
+        if dummy is None or dummy[0] != self.method:
+            dummy = (self.method, self.hash(secrets.token_urlsafe(16)))
+            self._dummy_hash = dummy
+        return dummy[1]
+
+    def _run(self, function: Callable, *args):
+        if not self.workers:
+            return function(*args)
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy("Too many password checks in progress")
+        try:
+            return self._get_pool().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Start the pool on first use, so it's made in each forked web worker
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+
+class LoginThrottle:
+    """
+    Count failed logins per username and client address.
+
+    After `max_failures` failures within `window` seconds, further attempts
+    for that pair are refused until the window runs out, before any password
+    is hashed. At most `max_size` pairs are tracked, oldest dropped first.
+    """
+
+    def __init__(self, max_failures: int = 5, window: float = 300, max_size=10000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_size = max_size
+        self._failures: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions["login_throttle"] = self
+        self.max_failures = app.config.get("LOGIN_MAX_FAILURES", 5)
+        self.window = app.config.get("LOGIN_FAILURE_WINDOW", 300)
+
+    def retry_after(self, username: str, address: str) -> int:
+        """Seconds until the pair may try again, or 0 if it isn't blocked."""
+        with self._lock:
+            entry = self._failures.get((username, address))
+            if entry is None:
+                return 0
+
+            count, started_at = entry
+            remaining = started_at + self.window - time.monotonic()
+            if remaining <= 0:
+                del self._failures[(username, address)]
+                return 0
+            return int(remaining) + 1 if count >= self.max_failures else 0
+
+    def fail(self, username: str, address: str) -> None:
+        with self._lock:
+            key = (username, address)
+            now = time.monotonic()
+            count, started_at = self._failures.pop(key, (0, now))
+            if started_at + self.window <= now:
+                count, started_at = 0, now
+            self._failures[key] = (count + 1, started_at)
+            while len(self._failures) > self.max_size:
+                self._failures.popitem(last=False)
+
+    def reset(self, username: str, address: str) -> None:
+        with self._lock:
+            self._failures.pop((username, address), None)
@@ -0,0 +1,143 @@
+"""Fan changes out to the open change feeds of each user, within one process."""
+
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from flask import Flask
+
+# An event as sent to clients: (sequence number, event data)
+Event = Tuple[int, dict]
+
+
+class FeedReset(Exception):
+    """The feed can't tell what a subscriber missed, so it has to reload."""
+
+
+class Subscription:
+    """The events published to one user while one of their feeds is open."""
+
+    def __init__(self, feed: "ChangeFeed", user_id: int, max_size: int):
+        self.feed = feed
+        self.user_id = user_id
+        self.events: queue.Queue = queue.Queue(max_size)
+        self.overflowed = False
+        # Number of the latest event when the subscription opened
+        self.start = 0
+
+    def push(self, event: Event) -> None:
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # A slow reader gets a reset rather than holding up publishers
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[Event]:
+        """Wait up to `timeout` seconds for the next event, or return None."""
+        if self.overflowed:
+            raise FeedReset()
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        self.feed.unsubscribe(self)
+
+
+class UserBuffer:
+    """The latest events of a user, and the last one that may have been dropped."""
+
+    def __init__(self, max_size: int, forgotten: int):
+        self.events: deque = deque(maxlen=max_size)
+        self.forgotten = forgotten
+
+    def append(self, event: Event) -> None:
+        if len(self.events) == self.events.maxlen:
+            self.forgotten = self.events[0][0]
+        self.events.append(event)
+
+
+class ChangeFeed:
+    """
+    Publish each user's changes to their open feeds, and keep the latest
+    `buffer_size` of them so reconnecting feeds can resume.
+
+    Sequence numbers grow across every user and start from the boot time in
+    microseconds, so a number from before a restart is older than anything
+    the feed knows and triggers a reset instead of a silent gap. The feed
+    lives in each process: run one worker, or sticky sessions, to use it.
+    """
+
+    def __init__(self):
+        self.buffer_size = 256
+        self.max_users = 10000
+        self.queue_size = 1024
+        self._lock = threading.Lock()
+        self._last = time.time_ns() // 1000
+        # Events up to this number may be missing from any new buffer
+        self._forgotten = self._last
+        self._buffers: OrderedDict = OrderedDict()
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions["change_feed"] = self
+        self.buffer_size = app.config.get("FEED_BUFFER_SIZE", 256)
+        self.max_users = app.config.get("FEED_MAX_USERS", 10000)
+        self.queue_size = app.config.get("FEED_QUEUE_SIZE", 1024)
+
+    def publish(self, user_id: int, events: List[dict]) -> None:
+        """Number and buffer a user's events, then hand them to their feeds."""
+        if not events:
+            return
+
+        with self._lock:
+            buffer = self._buffer(user_id)
+            numbered = []
+            for event in events:
+                self._last += 1
+                numbered.append((self._last, event))
+                buffer.append(numbered[-1])
+            subscribers = list(self._subscribers.get(user_id, ()))
+
+        for subscription in subscribers:
+            for event in numbered:
+                subscription.push(event)
+
+    def subscribe(
+        self, user_id: int, since: Optional[int] = None
+    ) -> Tuple[Subscription, List[Event]]:
+        """
+        Open a feed for a user. Return it with the buffered events after
+        `since`, or raise FeedReset when some of them are gone.
+        """
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            buffer = self._buffer(user_id)
+            missed = []
+            if since is not None:
+                if since < buffer.forgotten or since > self._last:
+                    raise FeedReset()
+                missed = [event for event in buffer.events if event[0] > since]
+            subscription.start = self._last
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription, missed
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.user_id, None)
+
+    def _buffer(self, user_id: int) -> UserBuffer:
+        if user_id not in self._buffers:
+            self._buffers[user_id] = UserBuffer(self.buffer_size, self._forgotten)
+            while len(self._buffers) > self.max_users:
+                _, evicted = self._buffers.popitem(last=False)
+                if evicted.events:
+                    self._forgotten = max(self._forgotten, evicted.events[-1][0])
+        self._buffers.move_to_end(user_id)
+        return self._buffers[user_id]
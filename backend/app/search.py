@@ -0,0 +1,238 @@
+import re
+from typing import List, Optional, Tuple
+
+import sqlalchemy as sa
+from flask_login import current_user, login_required
+from flask_restx import Namespace, Resource, fields, inputs
+
+from . import db
+from .changes import LIST, TASK
+from .database import SEARCH_INDEX
+from .list import NEXT_CURSOR_HEADER, page_size
+from .models import Task, TaskList
+from .uri import SEARCH_ENDPOINT, SEARCH_RESULTS_ENDPOINT
+
+search_ns = Namespace(
+    "search", description="Task and list search", path=SEARCH_ENDPOINT
+)
+
+result_model = search_ns.model(
+    "Search result",
+    {
+        "kind": fields.String(enum=[TASK, LIST]),
+        "id": fields.Integer(description="Task or list ID"),
+        "name": fields.String(description="Task or list name"),
+        "list_id": fields.Integer(description="List of the task, or the list itself"),
+    },
+)
+
+search_parser = search_ns.parser()
+search_parser.add_argument(
+    "q", type=str, required=True, location="args", help="Words to find, as prefixes"
+)
+search_parser.add_argument(
+    "list_id", type=int, location="args", help="Only search this list"
+)
+search_parser.add_argument(
+    "kind", choices=[TASK, LIST], location="args", help="Only find tasks or lists"
+)
+search_parser.add_argument(
+    "limit", type=inputs.positive, location="args", help="Maximum results per page"
+)
+search_parser.add_argument(
+    "cursor",
+    type=str,
+    location="args",
+    help="Rank and key of the last result of the previous page",
+)
+
+search_index = sa.table(
+    SEARCH_INDEX,
+    sa.column("rowid", sa.Integer),
+    sa.column("name", sa.String),
+    sa.column("scope", sa.String),
+)
+
+
+# The rank and the search index row ID of a result, which orders results
+Cursor = Tuple[float, int]
+
+
+def search_words(query: str) -> List[str]:
+    """Split a query into words, dropping FTS5 syntax."""
+    return re.findall(r"\w+", query)
+
+
+def parse_search_cursor(cursor: str) -> Cursor:
+    """Split a "rank,key" cursor."""
+    try:
+        rank, key = cursor.split(",")
+        return float(rank), int(key)
+    except ValueError:
+        search_ns.abort(400, f"Invalid cursor: {cursor}")
+
+
+def format_cursor(rank: float, key: int) -> str:
+    """Make the cursor of the page that starts after a result."""
+    return f"{rank!r},{key}"
+
+
+def fts_search(
+    user_id: int,
+    words: List[str],
+    list_id: Optional[int],
+    kind: Optional[str],
+    limit: int,
+    after: Optional[Cursor] = None,
+) -> List[dict]:
+    """
+    Rank the user's tasks and lists that have every word as a prefix, with
+    the FTS5 index. The user and list are matched as index tokens too.
+
+    Results come in (rank, row ID) order, from the first one after `after`.
+    """
+    match = f"owner : u{user_id}"
+    if list_id is not None:
+        match += f" AND scope : l{list_id}"
+    match += " AND name : (" + " ".join(f'"{word}"*' for word in words) + ")"
+
+    # Only the name counts towards the rank
+    rank = sa.literal_column(f"bm25({SEARCH_INDEX}, 1.0, 0.0, 0.0)", sa.Float)
+    query = (
+        sa.select(
+            search_index.c.rowid,
+            search_index.c.name,
+            search_index.c.scope,
+            rank.label("rank"),
+        )
+        .where(sa.text(f"{SEARCH_INDEX} MATCH :match").bindparams(match=match))
+        .order_by(rank, search_index.c.rowid)
+        .limit(limit)
+    )
+    if kind is not None:
+        query = query.where(search_index.c.rowid % 2 == (1 if kind == LIST else 0))
+    if after is not None:
+        query = query.where(sa.tuple_(rank, search_index.c.rowid) > after)
+
+    return [
+        {
+            "kind": LIST if row.rowid % 2 else TASK,
+            "id": row.rowid // 2,
+            "name": row.name,
+            "list_id": int(row.scope[1:]),
+            "cursor": format_cursor(row.rank, row.rowid),
+        }
+        for row in db.session.execute(query)
+    ]
+
+
+def prefix_match(name: sa.ColumnElement[str], word: str) -> sa.ColumnElement[bool]:
+    """Match the names that have a word starting with `word`."""
+    return sa.or_(
+        name.istartswith(word, autoescape=True),
+        name.icontains(f" {word}", autoescape=True),
+    )
+
+
+def like_search(
+    user_id: int,
+    words: List[str],
+    list_id: Optional[int],
+    kind: Optional[str],
+    limit: int,
+    after: Optional[Cursor] = None,
+) -> List[dict]:
+    """
+    Find the names with every word as a prefix where there is no FTS5.
+
+    Only spaces separate the words of a name, where FTS5 splits at any
+    punctuation too. Results are unranked, so every rank is 0, and come in
+    the order of their search index row ID, from the first one after `after`.
+    """
+    tasks = (
+        sa.select(
+            sa.literal(TASK).label("kind"),
+            Task.id,
+            Task.name,
+            Task.list_id,
+            (Task.id * 2).label("key"),
+        )
+        .join(TaskList, TaskList.id == Task.list_id)
+        .where(
+            TaskList.user_id == user_id,
+            *[prefix_match(Task.name, word) for word in words],
+        )
+    )
+    lists = sa.select(
+        sa.literal(LIST).label("kind"),
+        TaskList.id,
+        TaskList.name,
+        TaskList.id.label("list_id"),
+        (TaskList.id * 2 + 1).label("key"),
+    ).where(
+        TaskList.user_id == user_id,
+        *[prefix_match(TaskList.name, word) for word in words],
+    )
+    if list_id is not None:
+        tasks = tasks.where(Task.list_id == list_id)
+        lists = lists.where(TaskList.id == list_id)
+
+    selects = [
+        select
+        for select_kind, select in ((TASK, tasks), (LIST, lists))
+        if kind in (None, select_kind)
+    ]
+    results = sa.union_all(*selects).subquery()
+    query = sa.select(results).order_by(results.c.key).limit(limit)
+    if after is not None:
+        query = query.where(sa.tuple_(0.0, results.c.key) > after)
+
+    return [
+        {
+            "kind": row.kind,
+            "id": row.id,
+            "name": row.name,
+            "list_id": row.list_id,
+            "cursor": format_cursor(0.0, row.key),
+        }
+        for row in db.session.execute(query)
+    ]
+
+
+@search_ns.route(SEARCH_RESULTS_ENDPOINT)
+class Search(Resource):
+    @login_required
+    @search_ns.expect(search_parser)
+    @search_ns.marshal_list_with(result_model)
+    @search_ns.response(200, "Best matches first")
+    @search_ns.response(400, "Invalid cursor")
+    @search_ns.header(NEXT_CURSOR_HEADER, "Cursor of the next page, if there is one")
+    def get(self):
+        """
+        Search the names of the current user's tasks and lists.
+
+        Every word must match the start of a word in the name, so results
+        show up while typing. On SQLite they are ranked by relevance.
+        """
+        args = search_parser.parse_args()
+        limit = page_size(args["limit"])
+        words = search_words(args["q"])
+        if not words:
+            return [], 200, {}
+
+        after = parse_search_cursor(args["cursor"]) if args["cursor"] else None
+        search = fts_search if db.engine.dialect.name == "sqlite" else like_search
+        results = search(
+            current_user.id,
+            words,
+            args["list_id"],
+            args["kind"],
+            limit + 1,  # One more to know if there is a next page
+            after,
+        )
+
+        headers = {}
+        if len(results) > limit:
+            results = results[:limit]
+            headers[NEXT_CURSOR_HEADER] = results[-1]["cursor"]
+        return results, 200, headers
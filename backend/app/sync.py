@@ -0,0 +1,104 @@
+from typing import Optional
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_login import current_user, login_required
+from flask_restx import Namespace, Resource, fields
+
+from . import db
+from .changes import TASK, compact_change_log, log_bounds, read_changes
+from .list import list_model
+from .serializer import compile_encoder
+from .task import task_model
+from .uri import SYNC_CHANGES_ENDPOINT, SYNC_ENDPOINT
+
+sync_ns = Namespace("sync", description="Incremental sync", path=SYNC_ENDPOINT)
+
+sync_parser = sync_ns.parser()
+sync_parser.add_argument(
+    "since", type=int, location="args", help="Cursor from the last sync"
+)
+sync_parser.add_argument(
+    "limit", type=int, location="args", help="Change log entries per page"
+)
+
+change_model = sync_ns.model(
+    "Change",
+    {
+        "kind": fields.String(enum=["task", "list"]),
+        "op": fields.String(
+            enum=["created", "updated", "moved", "status", "deleted"],
+            description='What happened; "status" and "moved" apply to the subtree',
+        ),
+        "id": fields.Integer(description="Task or list ID"),
+        "list_id": fields.Integer(description="List of the task"),
+        "data": fields.Raw(description="Current columns, except for deletes"),
+    },
+)
+sync_model = sync_ns.model(
+    "Sync",
+    {
+        "cursor": fields.Integer(description="Send as `since` on the next sync"),
+        "more": fields.Boolean(description="More changes follow the cursor"),
+        "reset": fields.Boolean(
+            description="Changes since the cursor are gone; reload every list"
+        ),
+        "changes": fields.List(fields.Nested(change_model)),
+    },
+)
+
+
+@sync_ns.route(SYNC_CHANGES_ENDPOINT)
+class Sync(Resource):
+    @login_required
+    @sync_ns.expect(sync_parser)
+    @sync_ns.response(200, "Changes since the cursor", sync_model)
+    def get(self):
+        """
+        Get the current user's task and list changes since a cursor.
+
+        Each row that changed appears once, with its latest change and current
+        columns, or as a tombstone if it was deleted. Without a cursor, or one
+        from before the log was compacted, `reset` tells the client to reload
+        every list and sync from the returned cursor.
+        """
+        args = sync_parser.parse_args()
+        since: Optional[int] = args["since"]
+        max_limit = current_app.config["SYNC_PAGE_SIZE"]
+        limit = min(args["limit"] or max_limit, max_limit)
+
+        newest, horizon = log_bounds()
+        if since is None or since < horizon or since > newest:
+            return {"cursor": newest, "more": False, "reset": True, "changes": []}
+
+        changes, cursor, more = read_changes(current_user.id, since, limit)
+        task_encoder = compile_encoder(task_model, tuple(task_model))
+        list_encoder = compile_encoder(list_model, tuple(list_model))
+
+        data = []
+        for change in changes:
+            node = {"kind": change.kind, "op": change.op, "id": change.id}
+            if change.kind == TASK:
+                node["list_id"] = change.list_id
+            if change.row is not None:
+                encode = task_encoder if change.kind == TASK else list_encoder
+                node["data"] = encode(change.row)
+            data.append(node)
+
+        return {"cursor": cursor, "more": more, "reset": False, "changes": data}
+
+
+sync_command = AppGroup("sync", help="Manage the change log that clients sync from.")
+
+
+@sync_command.command("compact")
+@click.option("--retention", type=int, help="Seconds to keep entries for.")
+def compact_command(retention):
+    """Drop superseded and expired change log entries."""
+    if retention is None:
+        retention = current_app.config["SYNC_LOG_RETENTION"]
+
+    superseded, expired = compact_change_log(retention)
+    db.session.commit()
+    click.echo(f"Dropped {superseded} superseded and {expired} expired entries.")
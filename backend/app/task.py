@@ -1,23 +1,49 @@
-from typing import Tuple
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app, request
 from flask_login import login_required, current_user
-from flask_restx import Resource, fields
-
-from . import db, api
-from .models import Task
+from flask_restx import Model, Namespace, Resource, fields, inputs, marshal
+from jsonschema import Draft4Validator, FormatChecker
+
+from . import change_feed, db, response_cache
+from .changes import (
+    CREATED,
+    DELETED,
+    LIST,
+    MOVED,
+    STATUS,
+    TASK,
+    UPDATED,
+    collect_changes,
+    log_changes,
+    record_change,
+)
+from .counters import (
+    bump_versions,
+    count_in_subtree,
+    count_in_subtrees,
+    count_open,
+    count_subtasks,
+    count_subtasks_by_parent,
+)
+from .models import Task, TaskList
+from .tree import load_subtree, move_subtree, set_paths, subtree_ids
 from .uri import (
     TASKS_ENDPOINT,
     GET_TASK_ENDPOINT,
-    GET_SUBTASKS_ENDPOINT,
     UPDATE_TASK_STATUS_ENDPOINT,
     CREATE_TASK_ENDPOINT,
-    CREATE_SUBTASK_ENDPOINT,
+    SUBTASKS_ENDPOINT,
     DELETE_TASK_ENDPOINT,
     EDIT_TASK_ENDPOINT,
     MOVE_TASK_ENDPOINT,
+    BATCH_TASKS_ENDPOINT,
 )
 
-task_ns = api.namespace("tasks", description="Task operations", path=TASKS_ENDPOINT)
+task_ns = Namespace("tasks", description="Task operations", path=TASKS_ENDPOINT)
 
 # Structure output data (GET) and documents the API in Swagger
 task_model = task_ns.model(
@@ -25,9 +51,7 @@ task_model = task_ns.model(
     {
         "id": fields.Integer(required=True, description="Task ID"),
         "name": fields.String(required=True, description="Task name", max_length=100),
-        "due_date": fields.String(
-            description="Due date of the task", allow_null=True
-        ),  # Assuming date as string for simplicity
+        "due_date": fields.Date(description="Due date of the task (ISO 8601)"),
         "is_completed": fields.Boolean(
             required=True, description="Task completion status", default=False
         ),
@@ -35,12 +59,16 @@ task_model = task_ns.model(
             required=True, description="List ID associated with the task"
         ),
         "parent_id": fields.Integer(description="Parent task ID", allow_null=True),
+        "subtask_total": fields.Integer(description="Number of direct subtasks"),
+        "subtask_done": fields.Integer(
+            description="Number of completed direct subtasks"
+        ),
     },
 )
-task_model_with_subtasks = task_ns.inherit(
-    "Task with subtasks",
-    task_model,
-    {"subtasks": fields.List(fields.Nested(task_model), description="Subtasks")},
+task_model_with_subtasks = task_ns.inherit("Task with subtasks", task_model, {})
+# Subtasks nest the same model, so trees of any depth are marshalled
+task_model_with_subtasks["subtasks"] = fields.List(
+    fields.Nested(task_model_with_subtasks), description="Subtasks"
 )
 
 # validates and parses input data (POST/PUT)
@@ -50,38 +78,258 @@ task_parser.add_argument("parent_id", type=int, help="Parent task ID", required=
 task_parser.add_argument(
     "list_id", required=True, type=int, help="List ID for the task"
 )
+task_parser.add_argument(
+    "due_date",
+    type=inputs.date_from_iso8601,
+    help="Due date of the task (YYYY-MM-DD), today by default",
+)
+
+move_task_parser = task_ns.parser()
+move_task_parser.add_argument(
+    "new_list_id", type=int, help="New List ID for the task, the parent's by default"
+)
+move_task_parser.add_argument(
+    "new_parent_id", type=int, help="New parent task ID, top-level if not given"
+)
 
 
 @task_ns.route(GET_TASK_ENDPOINT)
 class GetTask(Resource):
     @login_required
-    @task_ns.marshal_with(task_model, code=200)
+    @task_ns.marshal_with(task_model_with_subtasks, code=200)
     @task_ns.response(404, "Task not found")
-    def get(self, task_id: int):
-        """Get a specific task by its ID."""
-        task = db.session.get(Task, task_id)
+    def get(self, list_id: int, task_id: int):
+        """Get a specific task by its ID, with all of its subtasks."""
+        task = load_subtree(task_id, list_id, current_user.id)
         if not task:
-            task_ns.abort(404, description="Task not found")
-        return task.to_dict()
+            task_ns.abort(404, "Task not found")
+        return task
+
+
+def get_owned_task(list_id: int, task_id: int) -> Optional[Task]:
+    """The task `task_id` of the list `list_id`, if the current user owns it."""
+    task = db.session.get(Task, task_id)
+    if task is None or task.user_id != current_user.id or task.list_id != list_id:
+        return None
+    return task
+
+
+def build_task(args: dict) -> Task:
+    """Make a task from parsed task arguments."""
+    task = Task(name=args["name"], list_id=args["list_id"])
+    if args.get("due_date") is not None:
+        task.due_date = args["due_date"]
+    return task
+
+
+def create_tasks(new_tasks: List[Tuple[Task, Optional[Task]]]) -> Set[int]:
+    """
+    Add new tasks under their parents (None for top-level) with one flush.
+    New tasks are open, so they reopen the completed parents they go under.
+
+    Return the IDs of the lists that changed.
+    """
+    db.session.add_all(task for task, _ in new_tasks)
+    set_paths(new_tasks)
+
+    count_subtasks_by_parent(Counter(parent.id for _, parent in new_tasks if parent))
+    count_open(Counter(task.list_id for task, _ in new_tasks))
+    for task, parent in new_tasks:
+        record_change(TASK, CREATED, task.id)
+        if parent:
+            record_change(TASK, UPDATED, parent.id)
+
+    completed_parents = {
+        parent.id: parent for _, parent in new_tasks if parent and parent.is_completed
+    }
+    for parent in completed_parents.values():
+        reopen_ancestors(parent.ancestor_ids() + [parent.id])
+
+    return {task.list_id for task, _ in new_tasks} | {
+        parent.list_id for _, parent in new_tasks if parent
+    }
+
+
+def edit_task(task: Task, args: dict) -> Set[int]:
+    """Change the name and due date of a task."""
+    return edit_tasks([(task, args)])
+
+
+def edit_tasks(edits: List[Tuple[Task, dict]]) -> Set[int]:
+    """Change the names and due dates of many tasks with one UPDATE."""
+    names = {task.id: args["name"] for task, args in edits}
+    due_dates = {
+        task.id: args["due_date"]
+        for task, args in edits
+        if args.get("due_date") is not None
+    }
+
+    values = {"name": sa.case(names, value=Task.id)}
+    if due_dates:
+        values["due_date"] = sa.case(due_dates, value=Task.id, else_=Task.due_date)
+    db.session.execute(sa.update(Task).where(Task.id.in_(names)).values(values))
+
+    for task, _ in edits:
+        record_change(TASK, UPDATED, task.id)
+    return {task.list_id for task, _ in edits}
+
+
+def delete_task(task: Task) -> Set[int]:
+    """Delete a task along with its subtasks."""
+    return delete_tasks([task])
+
+
+def delete_tasks(tasks: List[Task]) -> Set[int]:
+    """
+    Delete many tasks along with their subtasks, with one statement per
+    counter and one DELETE. Tasks in the subtree of another one go with it.
+    Parents left with only completed subtasks are completed.
+    """
+    # Subtrees sort right after their root, e.g. "1/5/" < "1/5/9/" < "1/50/"
+    roots: List[Task] = []
+    for task in sorted(tasks, key=lambda task: task.path):
+        if not roots or not task.path.startswith(roots[-1].path):
+            roots.append(task)
+
+    root_ids = [task.id for task in roots]
+    open_tasks = count_in_subtrees(root_ids)
+    parents = [task for task in roots if task.parent_id is not None]
+    totals: Dict[int, int] = {}
+    done: Dict[int, int] = {}
+    for task in parents:
+        totals[task.parent_id] = totals.get(task.parent_id, 0) - 1
+        done[task.parent_id] = done.get(task.parent_id, 0) - int(task.is_completed)
+    count_subtasks_by_parent(totals, done)
+    count_open({list_id: -count for list_id, count in open_tasks.items()})
+
+    # Delete the whole subtrees in one statement instead of cascading
+    db.session.execute(sa.delete(Task).where(Task.id.in_(subtree_ids(root_ids))))
+    for task in tasks:
+        record_change(TASK, DELETED, task.id, task.list_id)
+    for task in parents:
+        record_change(TASK, UPDATED, task.parent_id)
+
+    # Only an open subtask kept its parent open
+    open_parents = {task.parent_id: task for task in parents if not task.is_completed}
+    for task in open_parents.values():
+        complete_ancestors(task.ancestor_ids())
+    return {task.list_id for task in tasks} | set(open_tasks)
+
+
+class InvalidMove(Exception):
+    """A move that would break the task tree."""
+
+
+def owned_list_ids(list_ids: Iterable[int]) -> Set[int]:
+    """The IDs among `list_ids` of the lists that the current user owns."""
+    list_ids = set(list_ids)
+    if not list_ids:
+        return set()
+
+    return set(
+        db.session.execute(
+            sa.select(TaskList.id).where(
+                TaskList.id.in_(list_ids), TaskList.user_id == current_user.id
+            )
+        ).scalars()
+    )
 
 
-@task_ns.route(GET_SUBTASKS_ENDPOINT)
-class GetSubtasks(Resource):
-    @login_required
-    @task_ns.marshal_with(task_model, code=200, as_list=True)
-    @task_ns.response(200, "Success", [task_model])
-    @task_ns.response(404, "Task not found")
-    def get(self, task_id: int):
-        """Get immediate subtasks of a task."""
-        task = db.session.get(Task, task_id)
-        if not task:
-            task_ns.abort(404, description="Task not found")
-
-        subtasks = task.subtasks
-        return {
-            "message": f"Successfully retrieved subtasks from task with id {task_id}.",
-            "subtasks": [subtask.to_dict() for subtask in subtasks],
-        }, 200
+def move_task(
+    task: Task, new_list_id: Optional[int] = None, new_parent: Optional[Task] = None
+) -> Set[int]:
+    """
+    Move a task and its subtasks under `new_parent`, or to the top level of
+    `new_list_id`. Subtasks go to the list of their new parent.
+
+    The status of the old and new parents is then derived again: an open
+    task reopens the completed parents it moves under, and completes the
+    parents it leaves with only completed subtasks.
+
+    Whatever the size of the subtree, this runs a fixed number of statements:
+    one to count its open tasks, one per parent and one per counter to
+    update, one to rewrite its paths, depths and lists, and a few per chain
+    of parents whose status is derived.
+    """
+    old_list_id = task.list_id
+    if new_parent is not None:
+        # A task's descendants have paths that start with its own
+        if new_parent.path.startswith(task.path):
+            raise InvalidMove(f"Task ID {task.id} can't be moved under itself.")
+        if new_list_id is not None and new_list_id != new_parent.list_id:
+            raise InvalidMove(
+                f"Parent task ID {new_parent.id} is not in list ID {new_list_id}."
+            )
+        new_list_id = new_parent.list_id
+    elif new_list_id is None:
+        new_list_id = old_list_id
+
+    new_parent_id = new_parent.id if new_parent else None
+    if new_parent_id == task.parent_id and new_list_id == old_list_id:
+        return {old_list_id}
+
+    done = int(task.is_completed)
+    if new_parent_id != task.parent_id:
+        count_subtasks(task.parent_id, total=-1, done=-done)
+        count_subtasks(new_parent_id, total=1, done=done)
+        for parent_id in (task.parent_id, new_parent_id):
+            if parent_id is not None:
+                record_change(TASK, UPDATED, parent_id)
+
+    open_tasks = count_in_subtree(task.path)
+    if new_list_id != old_list_id:
+        deltas = Counter({list_id: -count for list_id, count in open_tasks.items()})
+        deltas[new_list_id] += sum(open_tasks.values())
+        count_open(deltas)
+
+    old_ancestor_ids = task.ancestor_ids()
+    new_ancestor_ids = new_parent.ancestor_ids() + [new_parent.id] if new_parent else []
+    move_subtree(task, new_parent, new_list_id)
+    record_change(TASK, MOVED, task.id)
+
+    if task.is_completed:
+        complete_ancestors(new_ancestor_ids, task.id)
+    else:
+        # Reopen first, so a shared ancestor sees its reopened subtask
+        reopen_ancestors(new_ancestor_ids)
+        complete_ancestors(old_ancestor_ids)
+    return {old_list_id, new_list_id, *open_tasks}
+
+
+def toggle_status(task: Task) -> Set[int]:
+    """Flip the status of a task, then propagate it down and up its tree."""
+    new_status = not task.is_completed
+
+    # Update the task and all of its subtasks
+    update_subtasks_status(task, new_status)
+    record_change(TASK, STATUS, task.id)
+
+    # Complete the parents whose subtasks are now all done, or reopen the
+    # completed ones of a reopened task, as a move does
+    if new_status:
+        update_parent_status(task)
+    else:
+        reopen_ancestors(task.ancestor_ids())
+
+    return {task.list_id}
+
+
+def commit_changes(list_ids: Iterable[int], user_id: Optional[int] = None) -> None:
+    """
+    Commit the current transaction along with the change log entries of the
+    recorded changes, make reads of the changed lists stale and send the
+    changes to the change feeds of the user, by default the current one.
+    """
+    if user_id is None:
+        user_id = current_user.id
+    list_ids = set(list_ids)
+    for list_id in list_ids:
+        record_change(LIST, UPDATED, list_id)
+    changes = collect_changes(bump_versions(list_ids))
+    log_changes(user_id, changes)
+    db.session.commit()
+    response_cache.invalidate(user_id, list_ids)
+    change_feed.publish(user_id, changes)
 
 
 @task_ns.route(CREATE_TASK_ENDPOINT)
@@ -90,27 +338,39 @@ class CreateTask(Resource):
     @task_ns.expect(task_parser)  # Using task_parser for input validation
     @task_ns.marshal_with(task_model, code=201)  # Marshalling the response
     @task_ns.response(201, "Created a new task")
+    @task_ns.response(404, "List not found")
     @task_ns.response(500, "Failed to create task")
     @task_ns.response(400, "Invalid input")
-    def post(self):
-        """Create a new top-level task."""
+    def post(self, list_id: int):
+        """Create a new top-level task in the list of the URL."""
         args = task_parser.parse_args()
-        name = args["name"]
-        list_id = args["list_id"]
+        if not owned_list_ids([list_id]):
+            task_ns.abort(404, f"List ID {list_id} not found.")
 
         try:
-            new_task = Task(name=name, user_id=current_user.id, list_id=list_id)
-            db.session.add(new_task)
-            db.session.commit()
-            return new_task.to_dict(), 201
+            new_task = build_task({**args, "list_id": list_id})
+            commit_changes(create_tasks([(new_task, None)]))
+            return new_task.to_dict(subtasks=False), 201
 
         except Exception as e:
             db.session.rollback()
             task_ns.abort(500, f"Failed to create task. Error: {str(e)}")
 
 
-@task_ns.route(CREATE_SUBTASK_ENDPOINT)
-class CreateSubtask(Resource):
+@task_ns.route(SUBTASKS_ENDPOINT)
+class Subtasks(Resource):
+    @login_required
+    @task_ns.marshal_with(task_model_with_subtasks, code=200, as_list=True)
+    @task_ns.response(200, "Success", [task_model_with_subtasks])
+    @task_ns.response(404, "Task not found")
+    def get(self, list_id: int, parent_id: int):
+        """Get immediate subtasks of a task, each with its own subtasks."""
+        task = load_subtree(parent_id, list_id, current_user.id)
+        if not task:
+            task_ns.abort(404, "Task not found")
+
+        return task["subtasks"], 200
+
     @login_required
     @task_ns.expect(
         task_parser
@@ -119,23 +379,19 @@ class CreateSubtask(Resource):
     @task_ns.response(201, "Created a new subtask")
     @task_ns.response(404, "Parent task not found")
     @task_ns.response(500, "Failed to create subtask")
-    def post(self, parent_id: int):
+    def post(self, list_id: int, parent_id: int):
         """Create a subtask for a specific parent task."""
         args = task_parser.parse_args()
-        name = args["name"]
-        list_id = args["list_id"]
 
-        parent_task = db.session.get(Task, parent_id)
+        # A subtree never spans lists, so the subtask goes to its parent's list
+        parent_task = get_owned_task(list_id, parent_id)
         if not parent_task:
             task_ns.abort(404, f"Parent task ID {parent_id} not found")
 
         try:
-            new_subtask = Task(
-                name=name, user_id=current_user.id, list_id=list_id, parent_id=parent_id
-            )
-            db.session.add(new_subtask)
-            db.session.commit()
-            return new_subtask.to_dict(), 201
+            new_subtask = build_task({**args, "list_id": parent_task.list_id})
+            commit_changes(create_tasks([(new_subtask, parent_task)]))
+            return new_subtask.to_dict(subtasks=False), 201
 
         except Exception as e:
             db.session.rollback()
@@ -149,15 +405,14 @@ class DeleteTask(Resource):
     @task_ns.response(200, "Successfully deleted task")
     @task_ns.response(404, "Task not found")
     @task_ns.response(500, "Failed to delete task")
-    def delete(self, task_id: int):
-        """Delete a specific task by its ID"""
-        try:
-            task = db.session.get(Task, task_id)
-            if not task:
-                task_ns.abort(404, f"Task with id {task_id} not found.")
+    def delete(self, list_id: int, task_id: int):
+        """Delete a specific task by its ID, along with its subtasks"""
+        task = get_owned_task(list_id, task_id)
+        if not task:
+            task_ns.abort(404, f"Task with id {task_id} not found.")
 
-            db.session.delete(task)
-            db.session.commit()
+        try:
+            commit_changes(delete_task(task))
             return {"message": f"Successfully deleted task with id {task_id}."}, 200
 
         except Exception as e:
@@ -176,19 +431,16 @@ class EditTask(Resource):
     @task_ns.response(200, "Successfully updated task")
     @task_ns.response(404, "Task not found")
     @task_ns.response(500, "Failed to update task")
-    def put(self, task_id: int):
+    def put(self, list_id: int, task_id: int):
         """Edit a specific task by its ID. Possible changes include name and date."""
         args = task_parser.parse_args()
-        try:
-            task = db.session.get(Task, task_id)
-            if not task:
-                task_ns.abort(404, f"Task with id {task_id} not found.")
-
-            task.name = args.get("name", task.name)
-            task.due_date = args.get("due_date", task.due_date)
+        task = get_owned_task(list_id, task_id)
+        if not task:
+            task_ns.abort(404, f"Task with id {task_id} not found.")
 
-            db.session.commit()
-            return task.to_dict(), 200
+        try:
+            commit_changes(edit_task(task, args))
+            return task.to_dict(subtasks=False), 200
 
         except Exception as e:
             db.session.rollback()
@@ -197,66 +449,183 @@ class EditTask(Resource):
             )
 
 
-move_task_parser = task_ns.parser()
-move_task_parser.add_argument(
-    "new_list_id", required=True, type=int, help="New List ID for the task"
-)
-
-
 @task_ns.route(MOVE_TASK_ENDPOINT)
 class MoveTask(Resource):
     @login_required
-    @task_ns.doc("move_task", description="Drag and drop a task to a different list")
+    @task_ns.doc(
+        "move_task", description="Drag and drop a subtree to another list or parent"
+    )
     @task_ns.expect(move_task_parser)
     @task_ns.response(200, "Task successfully moved")
     @task_ns.response(404, "Task not found")
-    @task_ns.response(400, "New list ID not found")
+    @task_ns.response(400, "New list ID not found, or the move would make a cycle")
     @task_ns.response(500, "Failed to move the task")
-    def put(self, task_id: int):
-        """Drag and drop a task to a different list"""
+    def put(self, list_id: int, task_id: int):
+        """Drag and drop a task to a different list or parent"""
         args = move_task_parser.parse_args()
         new_list_id = args.get("new_list_id")
+        new_parent_id = args.get("new_parent_id")
 
-        try:
-            task = db.session.get(Task, task_id)
-            if not task:
-                task_ns.abort(404, f"Task with id {task_id} not found.")
-
-            if not new_list_id:
-                task_ns.abort(400, f"New list ID {new_list_id} not found.")
+        # A move hands the subtree to the owner of its new list, so the task
+        # and where it goes must both be the current user's
+        task = db.session.get(Task, task_id)
+        if not task or task.user_id != current_user.id:
+            task_ns.abort(404, f"Task with id {task_id} not found.")
 
-            task.list_id = new_list_id
-            db.session.commit()
+        new_parent = None
+        if new_parent_id is not None:
+            new_parent = db.session.get(Task, new_parent_id)
+            if not new_parent or new_parent.user_id != current_user.id:
+                task_ns.abort(404, f"Parent task ID {new_parent_id} not found")
+        elif new_list_id is None or not owned_list_ids([new_list_id]):
+            task_ns.abort(400, f"New list ID {new_list_id} not found.")
 
-            return {"message": f"Task ID {task_id} moved to list ID {new_list_id}"}, 200
+        try:
+            commit_changes(move_task(task, new_list_id, new_parent))
+            return {
+                "message": f"Task ID {task_id} moved to list ID {task.list_id}"
+            }, 200
 
+        except InvalidMove as e:
+            db.session.rollback()
+            task_ns.abort(400, str(e))
         except Exception as e:
             db.session.rollback()
             task_ns.abort(500, f"Failed to move the task ID {task_id}. Error: {str(e)}")
 
 
 def update_subtasks_status(task: Task, new_status: bool = True) -> None:
-    """Top-down: If a task is marked as completed, mark all subtasks as done."""
-    for subtask in task.subtasks:
-        subtask.is_completed = new_status
-        update_subtasks_status(subtask, new_status)
+    """Top-down: Mark the task and all of its subtasks with one UPDATE."""
+    if task.is_completed != new_status:
+        count_subtasks(task.parent_id, done=1 if new_status else -1)
+        if task.parent_id is not None:
+            record_change(TASK, UPDATED, task.parent_id)
+
+    # Every task whose status flips changes the open count of its list
+    flipped = count_in_subtree(task.path, is_completed=not new_status)
+    count_open(
+        {list_id: -count if new_status else count for list_id, count in flipped.items()}
+    )
+
+    # All subtasks of a task in the subtree are in the subtree too
+    db.session.execute(
+        sa.update(Task)
+        .where(Task.in_subtree(task.path))
+        .values(
+            is_completed=new_status,
+            subtask_done=Task.subtask_total if new_status else 0,
+        )
+    )
 
 
 def update_parent_status(task: Task) -> None:
     """Bottom-up: If all subtasks of a parent task are marked done, mark the parent task as done."""
+    if task.is_completed:
+        complete_ancestors(task.ancestor_ids(), task.id)
+
+
+def complete_ancestors(ancestor_ids: List[int], child_id: Optional[int] = None) -> None:
+    """
+    Complete the ancestors in `ancestor_ids`, root first, from the nearest up
+    for as long as all of their subtasks are done.
+
+    `child_id` is the completed subtask the nearest ancestor is reached from.
+    Without one, the nearest ancestor is only completed if it has subtasks.
+    """
+    if not ancestor_ids:
+        return
+
+    # Count the open subtasks of each ancestor in one aggregate query. The
+    # subtasks on the way down are left out: each is either the child itself
+    # or an ancestor that gets completed before its parent is checked.
+    on_path = ancestor_ids[1:] + ([child_id] if child_id is not None else [])
+    subtask = so.aliased(Task)
+    open_subtasks = (
+        sa.select(sa.func.count())
+        .where(
+            subtask.parent_id == Task.id,
+            subtask.id.not_in(on_path),
+            subtask.is_completed.is_(False),
+        )
+        .scalar_subquery()
+        .label("open_subtasks")
+    )
+    ancestors = {
+        ancestor.id: ancestor
+        for ancestor in db.session.execute(
+            sa.select(
+                Task.id,
+                Task.list_id,
+                Task.is_completed,
+                Task.subtask_total,
+                open_subtasks,
+            ).where(Task.id.in_(ancestor_ids))
+        ).all()
+    }
+
+    # Walk up from the nearest ancestor until one still has open subtasks
+    completed_ids = []
+    flipped: Dict[int, int] = {}
+    for ancestor_id in reversed(ancestor_ids):
+        ancestor = ancestors[ancestor_id]
+        if ancestor.open_subtasks or not ancestor.subtask_total:
+            break
+        completed_ids.append(ancestor_id)
+        if not ancestor.is_completed:
+            flipped[ancestor.list_id] = flipped.get(ancestor.list_id, 0) - 1
 
-    while task.parent_id is not None:
-        parent_task = db.session.get(Task, task.parent_id)
-        all_completed = all(sibling.is_completed for sibling in parent_task.subtasks)
+    if not completed_ids:
+        return
 
-        if all_completed:
-            parent_task.is_completed = True
-        else:
-            # If any sibling is not completed, don't change the parent status
+    db.session.execute(
+        sa.update(Task)
+        .where(Task.id.in_(completed_ids))
+        .values(is_completed=True, subtask_done=Task.subtask_total)
+    )
+    count_open(flipped)
+    for ancestor_id in completed_ids:
+        record_change(TASK, UPDATED, ancestor_id)
+
+    # The parent of the topmost completed ancestor gains a completed subtask
+    topmost = ancestors[completed_ids[-1]]
+    if not topmost.is_completed and len(completed_ids) < len(ancestor_ids):
+        count_subtasks(ancestor_ids[-len(completed_ids) - 1], done=1)
+        record_change(TASK, UPDATED, ancestor_ids[-len(completed_ids) - 1])
+
+
+def reopen_ancestors(ancestor_ids: List[int]) -> None:
+    """
+    Reopen the ancestors in `ancestor_ids`, root first, of an open task, from
+    the nearest up for as long as they are completed.
+    """
+    if not ancestor_ids:
+        return
+
+    ancestors = {
+        ancestor.id: ancestor
+        for ancestor in db.session.execute(
+            sa.select(Task.id, Task.list_id, Task.is_completed).where(
+                Task.id.in_(ancestor_ids)
+            )
+        ).all()
+    }
+    reopened = []
+    for ancestor_id in reversed(ancestor_ids):
+        if not ancestors[ancestor_id].is_completed:
             break
+        reopened.append(ancestor_id)
+    if not reopened:
+        return
 
-        # Move up the hierarchy
-        task = parent_task
+    db.session.execute(
+        sa.update(Task).where(Task.id.in_(reopened)).values(is_completed=False)
+    )
+    count_open(Counter(ancestors[ancestor_id].list_id for ancestor_id in reopened))
+    # The parent of each reopened ancestor has one completed subtask less
+    parent_ids = ancestor_ids[max(len(ancestor_ids) - len(reopened) - 1, 0) : -1]
+    count_subtasks_by_parent({}, done={parent_id: -1 for parent_id in parent_ids})
+    for ancestor_id in {*reopened, *parent_ids}:
+        record_change(TASK, UPDATED, ancestor_id)
 
 
 @task_ns.route(UPDATE_TASK_STATUS_ENDPOINT)
@@ -269,31 +638,19 @@ class UpdateTaskStatus(Resource):
     @task_ns.response(404, "Task not found")
     @task_ns.response(400, "Invalid task ID")
     @task_ns.response(500, "Failed to update task status")
-    def put(self, task_id: int):
+    def put(self, list_id: int, task_id: int):
         """Update the status of a specific task by its ID."""
-        try:
-            task = db.session.get(Task, task_id)
-            if not task:
-                task_ns.abort(404, f"Task with id {task_id} not found")
-
-            new_status = not task.is_completed
-            task.is_completed = new_status
-
-            # Update all subtasks if the task is marked as complete/incomplete
-            update_subtasks_status(task, new_status)
-
-            # Commit the status change of the task and its subtasks
-            db.session.commit()
-
-            # Update parent status based on the status of siblings
-            update_parent_status(task)
+        task = get_owned_task(list_id, task_id)
+        if not task:
+            task_ns.abort(404, f"Task with id {task_id} not found")
 
-            # Commit any changes made by updating the parent status
-            db.session.commit()
+        try:
+            # Commit both passes in a single transaction
+            commit_changes(toggle_status(task))
 
             return {
                 "message": f"Successfully updated status of task ID {task_id}.",
-                "task": task.to_dict(),
+                "task": marshal(load_subtree(task_id), task_model_with_subtasks),
             }, 200
 
         except Exception as e:
@@ -302,3 +659,296 @@ class UpdateTaskStatus(Resource):
                 500,
                 f"Failed to update status of task ID {task_id}. Error: {str(e)}",
             )
+
+
+BATCH_OPERATIONS = ["create", "edit", "move", "delete", "status"]
+
+batch_operation_model = task_ns.model(
+    "Batch operation",
+    {
+        "op": fields.String(required=True, enum=BATCH_OPERATIONS),
+        "task_id": fields.Integer(description="Target task ID, except for create"),
+        "name": fields.String(description="Task name, for create and edit"),
+        "list_id": fields.Integer(description="List ID, for create and edit"),
+        "due_date": fields.Date(description="Due date, for create and edit"),
+        "parent_id": fields.Integer(description="Parent task ID, for create"),
+        "parent_ref": fields.Integer(
+            description="Index of an earlier create in the batch to nest under"
+        ),
+        "new_list_id": fields.Integer(description="New list ID, for move"),
+        "new_parent_id": fields.Integer(description="New parent task ID, for move"),
+    },
+)
+batch_model = task_ns.model(
+    "Batch",
+    {
+        "operations": fields.List(
+            fields.Nested(batch_operation_model), required=True, min_items=1
+        )
+    },
+)
+
+
+def operation_model(op: str, **fields_: fields.Raw) -> Model:
+    """The model that one kind of batch operation is validated against."""
+    return Model(f"Batch {op}", {"op": fields.String(required=True), **fields_})
+
+
+# Validate each kind of operation with the same rules as its single-task endpoint
+BATCH_MODELS = {
+    "create": operation_model(
+        "create",
+        name=fields.String(required=True),
+        list_id=fields.Integer(required=True),
+        due_date=fields.Date(),
+        parent_id=fields.Integer(),
+        parent_ref=fields.Integer(),
+    ),
+    "edit": operation_model(
+        "edit",
+        task_id=fields.Integer(required=True),
+        name=fields.String(required=True),
+        list_id=fields.Integer(),
+        due_date=fields.Date(),
+    ),
+    "move": operation_model(
+        "move",
+        task_id=fields.Integer(required=True),
+        new_list_id=fields.Integer(),
+        new_parent_id=fields.Integer(),
+    ),
+    "delete": operation_model("delete", task_id=fields.Integer(required=True)),
+    "status": operation_model("status", task_id=fields.Integer(required=True)),
+}
+BATCH_VALIDATORS = {
+    op: Draft4Validator(model.__schema__, format_checker=FormatChecker())
+    for op, model in BATCH_MODELS.items()
+}
+
+
+class BatchError(Exception):
+    def __init__(self, index: int, code: int, message: str):
+        super().__init__(message)
+        self.result = {"index": index, "status": code, "message": message}
+
+
+def parse_operations(operations: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """Parse every operation. Return the parsed ones and the validation errors."""
+    parsed, errors = [], []
+    for index, operation in enumerate(operations):
+        # The batch model already checked the kind and types of the operations
+        op = operation["op"]
+        model = BATCH_MODELS[op]
+        invalid = dict(
+            model.format_error(error)
+            for error in BATCH_VALIDATORS[op].iter_errors(operation)
+        )
+        if invalid:
+            errors.append(
+                {
+                    "index": index,
+                    "status": 400,
+                    "message": "Input payload validation failed",
+                    "errors": invalid,
+                }
+            )
+            continue
+
+        args = {key: operation.get(key) for key in model}
+        if args.get("due_date") is not None:
+            args["due_date"] = inputs.date_from_iso8601(args["due_date"])
+        parsed.append(args)
+
+    return parsed, errors
+
+
+def apply_operations(
+    list_id: int, operations: List[dict]
+) -> Tuple[List[dict], Set[int]]:
+    """
+    Apply parsed operations in order within the current transaction. Every
+    task they target must be in the list `list_id`.
+
+    Runs of consecutive creates are inserted with a single flush, runs of
+    edits with one UPDATE, and runs of deletes with one DELETE. Status
+    changes and moves depend on the tree that the operations before them
+    left, so each is applied on its own, with a fixed number of statements
+    whatever the size of its subtree. Return the result of each operation
+    and the IDs of the lists that changed.
+    """
+    # Load every existing task the batch refers to with one query
+    task_ids = {
+        args[key]
+        for args in operations
+        for key in ("task_id", "parent_id", "new_parent_id")
+        if args.get(key) is not None
+    }
+    tasks = {
+        task.id: task
+        for task in db.session.execute(
+            sa.select(Task).where(
+                Task.id.in_(task_ids), Task.user_id == current_user.id
+            )
+        ).scalars()
+    }
+    # Moves may only take tasks to the current user's lists
+    new_list_ids = owned_list_ids(
+        args["new_list_id"]
+        for args in operations
+        if args["op"] == "move" and args.get("new_list_id") is not None
+    )
+
+    def get_task(index: int, task_id: int, in_list: bool = True) -> Task:
+        task = tasks.get(task_id)
+        if (
+            task is None
+            or sa.inspect(task).deleted
+            or (in_list and task.list_id != list_id)
+        ):
+            raise BatchError(index, 404, f"Task with id {task_id} not found.")
+        return task
+
+    results: List[dict] = []
+    created: Dict[int, Task] = {}
+    list_ids: Set[int] = set()
+    # The run of operations of one kind that is not applied yet
+    run_op: Optional[str] = None
+    run: list = []
+
+    def apply_run() -> Set[int]:
+        if run_op == "create":
+            return create_tasks(run)
+        if run_op == "edit":
+            return edit_tasks(run)
+        if run_op == "delete":
+            return delete_tasks(run)
+        return set()
+
+    for index, args in enumerate(operations):
+        op = args["op"]
+        if op != run_op:
+            list_ids |= apply_run()
+            run_op, run = op, []
+
+        if op == "create":
+            if args["list_id"] != list_id:
+                raise BatchError(
+                    index, 400, f"Tasks must be created in list {list_id}."
+                )
+            parent = None
+            if args["parent_ref"] is not None:
+                parent = created.get(args["parent_ref"])
+                if parent is None:
+                    raise BatchError(
+                        index, 400, f"No create at index {args['parent_ref']}."
+                    )
+            elif args["parent_id"] is not None:
+                parent = get_task(index, args["parent_id"])
+
+            task = build_task(args)
+            created[index] = task
+            run.append((task, parent))
+            results.append({"index": index, "status": 201, "task": task})
+            continue
+
+        task = get_task(index, args["task_id"])
+        if op == "edit":
+            run.append((task, args))
+        elif op == "delete":
+            # Gone already if it is in the subtree of an earlier delete
+            if any(task.path.startswith(deleted.path) for deleted in run):
+                raise BatchError(index, 404, f"Task with id {task.id} not found.")
+            run.append(task)
+            results.append({"index": index, "status": 200, "task_id": task.id})
+            continue
+        elif op == "move":
+            new_parent = None
+            if args["new_parent_id"] is not None:
+                new_parent = get_task(index, args["new_parent_id"], in_list=False)
+            elif args["new_list_id"] is None:
+                raise BatchError(index, 400, "New list or parent ID is required.")
+            elif args["new_list_id"] not in new_list_ids:
+                raise BatchError(
+                    index, 404, f"List ID {args['new_list_id']} not found."
+                )
+            try:
+                list_ids |= move_task(task, args["new_list_id"], new_parent)
+            except InvalidMove as e:
+                raise BatchError(index, 400, str(e))
+        elif op == "status":
+            list_ids |= toggle_status(task)
+        results.append({"index": index, "status": 200, "task": task})
+
+    list_ids |= apply_run()
+    db.session.flush()
+
+    return results, list_ids
+
+
+@task_ns.route(BATCH_TASKS_ENDPOINT)
+class BatchTasks(Resource):
+    @login_required
+    @task_ns.doc(
+        "batch_tasks", description="Apply many task operations in one transaction"
+    )
+    @task_ns.expect(batch_model)
+    @task_ns.response(200, "Applied every operation")
+    @task_ns.response(400, "Invalid operation, nothing was applied")
+    @task_ns.response(404, "List or task not found, nothing was applied")
+    @task_ns.response(500, "Failed to apply the operations")
+    def post(self, list_id: int):
+        """
+        Apply an ordered batch of create/edit/move/delete/status operations.
+
+        Either every operation is applied or none is. Operations target the
+        tasks of this list, though moves can take them to another. The
+        response reports the result of each operation, or of the ones that
+        failed.
+        """
+        task_list = db.session.execute(
+            sa.select(TaskList.id).where(
+                TaskList.id == list_id, TaskList.user_id == current_user.id
+            )
+        ).first()
+        if not task_list:
+            task_ns.abort(404, f"List ID {list_id} not found.")
+
+        operations = request.json["operations"]
+        max_operations = current_app.config["BATCH_MAX_OPERATIONS"]
+        if len(operations) > max_operations:
+            task_ns.abort(400, f"A batch holds at most {max_operations} operations.")
+
+        operations, errors = parse_operations(operations)
+        if errors:
+            return {"message": "Nothing was applied.", "results": errors}, 400
+
+        try:
+            results, list_ids = apply_operations(list_id, operations)
+
+            # Refresh every task in the results with one query before serializing
+            touched = [result["task"] for result in results if "task" in result]
+            db.session.execute(
+                sa.select(Task)
+                .where(Task.id.in_([task.id for task in touched]))
+                .execution_options(populate_existing=True)
+            ).scalars().all()
+            for result in results:
+                if "task" not in result:
+                    continue
+                task = result.pop("task")
+                # Tasks deleted later in the batch are only reported by ID
+                if sa.inspect(task).was_deleted:
+                    result["task_id"] = task.id
+                else:
+                    result["task"] = marshal(task.to_dict(subtasks=False), task_model)
+
+            commit_changes(list_ids)
+            return {"message": "Applied every operation.", "results": results}, 200
+
+        except BatchError as e:
+            db.session.rollback()
+            code = e.result["status"]
+            return {"message": "Nothing was applied.", "results": [e.result]}, code
+        except Exception as e:
+            db.session.rollback()
+            task_ns.abort(500, f"Failed to apply the operations. Error: {str(e)}")
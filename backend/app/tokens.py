@@ -0,0 +1,171 @@
+"""Stateless signed access and refresh tokens, for AUTH_MODE "token"."""
+
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from typing import Dict, Optional, Union
+
+import sqlalchemy as sa
+from flask import Flask, Request, current_app
+from werkzeug.local import LocalProxy
+
+from . import db, login_manager
+from .models import RevokedToken, SessionUser, User
+
+ACCESS = "access"
+REFRESH = "refresh"
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signature(body: str) -> str:
+    key = current_app.config.get("TOKEN_SECRET_KEY") or current_app.config["SECRET_KEY"]
+    return _encode(hmac.new(key.encode(), body.encode(), hashlib.sha256).digest())
+
+
+def sign(claims: dict) -> str:
+    """Serialize claims into a "body.signature" token signed with HMAC-SHA256."""
+    body = _encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{body}.{_signature(body)}"
+
+
+def verify(token: str, token_type: str = ACCESS) -> Optional[dict]:
+    """
+    Get the claims of a token, or None if it is forged, expired, revoked or of
+    another type. Needs no database access.
+    """
+    body, _, signature = token.partition(".")
+    if not signature or not hmac.compare_digest(signature, _signature(body)):
+        return None
+
+    try:
+        claims = json.loads(_decode(body))
+    except ValueError:
+        return None
+
+    if claims.get("typ") != token_type or claims.get("exp", 0) <= time.time():
+        return None
+    if token_revocations.is_revoked(claims["sid"]):
+        return None
+    return claims
+
+
+def issue_tokens(
+    user: Union[User, SessionUser], session_id: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Issue an access token and a refresh token for a user.
+
+    Both belong to one token session, so revoking it revokes the pair. Pass
+    the `session_id` of a refresh token to issue new tokens in its session.
+    """
+    now = int(time.time())
+    session_id = session_id or secrets.token_urlsafe(12)
+    claims = {"sub": user.id, "name": user.username, "sid": session_id, "iat": now}
+    access_ttl = current_app.config["ACCESS_TOKEN_TTL"]
+
+    return {
+        "access_token": sign(
+            {**claims, "typ": ACCESS, "exp": now + access_ttl},
+        ),
+        "refresh_token": sign(
+            {
+                **claims,
+                "typ": REFRESH,
+                "exp": now + current_app.config["REFRESH_TOKEN_TTL"],
+            }
+        ),
+        "token_type": "Bearer",
+        "expires_in": access_ttl,
+    }
+
+
+def bearer_token(request: Request) -> Optional[str]:
+    """Get the token of an "Authorization: Bearer" header."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" and token else None
+
+
+@login_manager.request_loader
+def load_user_from_token(request: Request) -> Optional[SessionUser]:
+    """Log in requests by their access token, when tokens are enabled."""
+    if current_app.config.get("AUTH_MODE") != "token":
+        return None
+
+    token = bearer_token(request)
+    claims = token and verify(token, ACCESS)
+    if not claims:
+        return None
+    return SessionUser(claims["sub"], claims["name"])
+
+
+class TokenRevocations:
+    """
+    The token sessions revoked before they expire.
+
+    Revocations are stored in the revoked_tokens table so every worker sees
+    them, and each worker keeps the live ones in memory. Checking a token
+    reads the table only to pick up new rows, at most every `sync_interval`
+    seconds.
+    """
+
+    def __init__(self):
+        self.sync_interval = 5
+        self._revoked: Dict[str, int] = {}  # session ID -> expiry
+        self._last_id = 0
+        self._synced_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions["token_revocations"] = self
+        self.sync_interval = app.config.get("TOKEN_REVOCATION_SYNC", 5)
+
+    def revoke(self, session_id: str, expires_at: int) -> None:
+        """Revoke a token session and drop expired revocations. Doesn't commit."""
+        db.session.execute(
+            sa.delete(RevokedToken).where(RevokedToken.expires_at <= time.time())
+        )
+        db.session.add(RevokedToken(session_id=session_id, expires_at=expires_at))
+        with self._lock:
+            self._revoked[session_id] = expires_at
+
+    def is_revoked(self, session_id: str) -> bool:
+        if time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+        return session_id in self._revoked
+
+    def sync(self) -> None:
+        """Pick up the revocations made by other workers, and forget expired ones."""
+        rows = db.session.execute(
+            sa.select(RevokedToken.id, RevokedToken.session_id, RevokedToken.expires_at)
+            .where(RevokedToken.id > self._last_id)
+            .order_by(RevokedToken.id)
+        ).all()
+
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                self._revoked[row.session_id] = row.expires_at
+                self._last_id = row.id
+            self._revoked = {
+                session_id: expires_at
+                for session_id, expires_at in self._revoked.items()
+                if expires_at > now
+            }
+            self._synced_at = time.monotonic()
+
+
+# The store of the current app, made by create_app
+token_revocations: TokenRevocations = LocalProxy(
+    lambda: current_app.extensions["token_revocations"]
+)
@@ -0,0 +1,356 @@
+"""Move a user's lists and tasks in and out as flat NDJSON records."""
+
+import csv
+import json
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, TextIO, Tuple
+
+import click
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import db
+from .changes import CREATED, LIST, record_change
+from .models import PATH_SEPARATOR, Task, TaskList, User
+from .task import commit_changes
+
+# Columns of each record type, in the order they are written
+LIST_COLUMNS = (TaskList.id, TaskList.name)
+TASK_COLUMNS = (
+    Task.id,
+    Task.list_id,
+    Task.parent_id,
+    Task.name,
+    Task.due_date,
+    Task.is_completed,
+)
+
+
+def export_records(user_id: int, batch_size: int = 1000) -> Iterator[dict]:
+    """
+    Yield every list of a user, then every task of those lists, as flat dicts.
+
+    Rows are streamed from the cursor `batch_size` at a time as plain column
+    tuples, so no ORM objects pile up in the session. Tasks come in path
+    order, which puts every parent before its subtasks.
+    """
+    lists = db.session.execute(
+        sa.select(*LIST_COLUMNS)
+        .where(TaskList.user_id == user_id)
+        .order_by(TaskList.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in lists:
+        yield {"type": "list", **row._asdict()}
+
+    tasks = db.session.execute(
+        sa.select(*TASK_COLUMNS)
+        .join(TaskList, Task.list_id == TaskList.id)
+        .where(TaskList.user_id == user_id)
+        .order_by(Task.path)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in tasks:
+        yield {"type": "task", **row._asdict()}
+
+
+def export_ndjson(user_id: int, batch_size: int = 1000) -> Iterator[str]:
+    """Yield the records of `export_records` as newline-delimited JSON."""
+    for record in export_records(user_id, batch_size):
+        yield json.dumps(record, default=str) + "\n"
+
+
+class InvalidRecord(ValueError):
+    """A record that can't be imported, with the line it was read from."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def read_ndjson(lines: Iterable[str]) -> Iterator[Tuple[int, dict]]:
+    """Parse newline-delimited JSON records, skipping blank lines."""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            raise InvalidRecord(number, f"Invalid JSON. {e}")
+
+
+def read_csv(lines: Iterable[str]) -> Iterator[Tuple[int, dict]]:
+    """
+    Parse CSV records with a header row of the export's keys.
+
+    Empty cells are null, and is_completed is true for "1", "true" or "yes".
+    """
+    for number, row in enumerate(csv.DictReader(lines), start=2):
+        record = {key: value or None for key, value in row.items()}
+        if record.get("is_completed") is not None:
+            completed = record["is_completed"].strip().lower()
+            record["is_completed"] = completed in ("1", "true", "yes")
+        yield number, record
+
+
+class Importer:
+    """
+    Insert exported records as new lists and tasks of a user, in batches.
+
+    IDs in the records are only used to link tasks to their list and parent;
+    everything gets a new ID. Tasks must come after their list and parent, as
+    they do in an export, so the path and depth of each task are known as it
+    is read. Task IDs are reserved a batch at a time, rather than returned by
+    each INSERT, so a whole batch of a tree can go out in one multi-row
+    INSERT even though its paths hold its IDs.
+    """
+
+    def __init__(self, user_id: int, batch_size: int = 1000):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        # Temporary mappings from the IDs in the records to the new rows
+        self.list_ids: Dict[int, int] = {}
+        self.task_paths: Dict[int, Tuple[int, str, int]] = {}  # (id, path, depth)
+        self.new_lists: Dict[int, dict] = {}
+        self.new_tasks: List[dict] = []
+        self.task_ids: Iterator[int] = iter(())
+        self.task_count = 0
+
+    def add(self, line: int, record: dict) -> None:
+        """Queue one record, writing out a batch when it is full."""
+        kind = record.get("type")
+        if kind == "list":
+            self.add_list(line, record)
+        elif kind == "task":
+            self.add_task(line, record)
+        else:
+            raise InvalidRecord(line, f"Unknown record type {kind!r}.")
+
+    def add_list(self, line: int, record: dict) -> None:
+        old_id = self.record_id(line, record, "id")
+        if old_id in self.list_ids or old_id in self.new_lists:
+            raise InvalidRecord(line, f"Duplicate list ID {old_id}.")
+        if not record.get("name"):
+            raise InvalidRecord(line, "A list needs a name.")
+
+        self.new_lists[old_id] = {"name": record["name"], "user_id": self.user_id}
+        if len(self.new_lists) >= self.batch_size:
+            self.flush_lists()
+
+    def add_task(self, line: int, record: dict) -> None:
+        old_id = self.record_id(line, record, "id")
+        if old_id in self.task_paths:
+            raise InvalidRecord(line, f"Duplicate task ID {old_id}.")
+        if not record.get("name"):
+            raise InvalidRecord(line, "A task needs a name.")
+
+        old_list_id = self.record_id(line, record, "list_id")
+        if old_list_id not in self.list_ids:
+            self.flush_lists()
+        if old_list_id not in self.list_ids:
+            raise InvalidRecord(line, f"List {old_list_id} is not in the import.")
+
+        task_id = next(self.task_ids, None)
+        if task_id is None:
+            self.task_ids = iter(reserve_task_ids(self.batch_size))
+            task_id = next(self.task_ids)
+
+        parent_path, depth = "", 0
+        if record.get("parent_id") is not None:
+            old_parent_id = self.record_id(line, record, "parent_id")
+            if old_parent_id not in self.task_paths:
+                raise InvalidRecord(
+                    line, f"Parent task {old_parent_id} must come before its subtasks."
+                )
+            parent_id, parent_path, parent_depth = self.task_paths[old_parent_id]
+            depth = parent_depth + 1
+        else:
+            parent_id = None
+
+        path = f"{parent_path}{task_id}{PATH_SEPARATOR}"
+        self.task_paths[old_id] = (task_id, path, depth)
+        self.new_tasks.append(
+            {
+                "id": task_id,
+                "name": record["name"],
+                "due_date": self.due_date(line, record),
+                "is_completed": bool(record.get("is_completed")),
+                "parent_id": parent_id,
+                "depth": depth,
+                "path": path,
+                "list_id": self.list_ids[old_list_id],
+                "user_id": self.user_id,
+            }
+        )
+        if len(self.new_tasks) >= self.batch_size:
+            self.flush_tasks()
+
+    @staticmethod
+    def record_id(line: int, record: dict, key: str) -> int:
+        try:
+            return int(record[key])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidRecord(line, f"{key} must be an integer.")
+
+    @staticmethod
+    def due_date(line: int, record: dict) -> date:
+        if not record.get("due_date"):
+            return date.today()
+        try:
+            return date.fromisoformat(record["due_date"])
+        except (TypeError, ValueError):
+            raise InvalidRecord(line, "due_date must be a date like 2024-01-31.")
+
+    def flush_lists(self) -> None:
+        if not self.new_lists:
+            return
+
+        # Keep the new IDs in the order of the rows to map them back
+        new_ids = db.session.execute(
+            sa.insert(TaskList).returning(TaskList.id, sort_by_parameter_order=True),
+            list(self.new_lists.values()),
+        ).scalars()
+        self.list_ids.update(zip(self.new_lists, new_ids))
+        self.new_lists = {}
+
+    def flush_tasks(self) -> None:
+        if not self.new_tasks:
+            return
+
+        db.session.execute(sa.insert(Task).values(self.new_tasks))
+        self.task_count += len(self.new_tasks)
+        self.new_tasks = []
+
+    def finish(self) -> Tuple[List[int], int]:
+        """
+        Write the remaining batches and fill in the counters of the new rows.
+
+        Returns the IDs of the new lists and the number of tasks imported.
+        """
+        self.flush_lists()
+        self.flush_tasks()
+
+        list_ids = list(self.list_ids.values())
+        for start in range(0, len(list_ids), self.batch_size):
+            count_imported(list_ids[start : start + self.batch_size])
+
+        return list_ids, self.task_count
+
+
+def count_imported(list_ids: List[int]) -> None:
+    """Compute the counters of freshly imported lists and their tasks."""
+    subtask = so.aliased(Task)
+    subtasks = sa.select(sa.func.count()).where(subtask.parent_id == Task.id)
+    db.session.execute(
+        sa.update(Task)
+        .where(Task.list_id.in_(list_ids))
+        .values(
+            subtask_total=subtasks.scalar_subquery(),
+            subtask_done=subtasks.where(subtask.is_completed).scalar_subquery(),
+        )
+    )
+
+    open_tasks = sa.select(sa.func.count()).where(
+        Task.list_id == TaskList.id, Task.is_completed.is_(False)
+    )
+    db.session.execute(
+        sa.update(TaskList)
+        .where(TaskList.id.in_(list_ids))
+        .values(open_count=open_tasks.scalar_subquery())
+    )
+
+
+def reserve_task_ids(count: int) -> List[int]:
+    """
+    Take `count` IDs for new tasks.
+
+    On PostgreSQL they come from the ID sequence of the table, like the IDs of
+    any other insert. On SQLite the importer holds the write lock from its
+    first list on, so the IDs past the highest one are free until it commits,
+    and the rowids of later inserts follow them.
+    """
+    if db.engine.dialect.name == "postgresql":
+        sequence = sa.func.pg_get_serial_sequence(Task.__tablename__, "id")
+        return list(
+            db.session.execute(
+                sa.select(sa.func.nextval(sequence)).select_from(
+                    sa.func.generate_series(1, count)
+                )
+            ).scalars()
+        )
+
+    last_id = db.session.execute(sa.select(sa.func.max(Task.id))).scalar() or 0
+    return list(range(last_id + 1, last_id + 1 + count))
+
+
+def import_records(
+    user_id: int, records: Iterable[Tuple[int, dict]], batch_size: int = 1000
+) -> Tuple[List[int], int]:
+    """
+    Import (line, record) pairs as new lists and tasks of a user.
+
+    Doesn't commit. Returns the IDs of the new lists and the number of tasks
+    imported, and raises InvalidRecord on the first bad record.
+    """
+    importer = Importer(user_id, batch_size)
+    for line, record in records:
+        importer.add(line, record)
+    return importer.finish()
+
+
+def commit_import(user_id: int, list_ids: List[int]) -> None:
+    """
+    Commit an import, logging the new lists as created so that syncing
+    clients and change feeds learn about them.
+    """
+    for list_id in list_ids:
+        record_change(LIST, CREATED, list_id)
+    commit_changes(list_ids, user_id)
+
+
+def read_records(stream: TextIO, file_format: str) -> Iterator[Tuple[int, dict]]:
+    """Parse a stream of records in "ndjson" or "csv" format."""
+    if file_format == "csv":
+        return read_csv(stream)
+    return read_ndjson(stream)
+
+
+@click.command("import-data")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--username", required=True, help="User who will own the lists.")
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["ndjson", "csv"]),
+    help="Format of FILE. Guessed from its extension by default.",
+)
+@click.option("--batch-size", type=int, help="Rows per INSERT.")
+@with_appcontext
+def import_command(file, username, file_format, batch_size):
+    """Import lists and tasks from an NDJSON or CSV export."""
+    user = db.session.execute(
+        sa.select(User).where(User.username == username)
+    ).scalar_one_or_none()
+    if user is None:
+        raise click.BadParameter(f"No user named {username}.", param_hint="--username")
+
+    if batch_size is None:
+        batch_size = current_app.config["IMPORT_BATCH_SIZE"]
+    if file_format is None:
+        file_format = "csv" if file.name.endswith(".csv") else "ndjson"
+
+    try:
+        list_ids, tasks = import_records(
+            user.id, read_records(file, file_format), batch_size
+        )
+        commit_import(user.id, list_ids)
+    except InvalidRecord as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    except Exception:
+        db.session.rollback()
+        raise
+
+    click.echo(f"Imported {len(list_ids)} lists and {tasks} tasks for {username}.")
@@ -0,0 +1,221 @@
+"""
+Load whole task trees with a single recursive query and nest them in memory.
+
+Reads select plain column rows rather than `Task` objects, so nothing is added
+to the session and no per-object identity or change tracking is paid for.
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import sqlalchemy as sa
+
+from . import db
+from .models import PATH_SEPARATOR, Task, TaskList
+
+# Turns a task row into its node in a tree
+Encoder = Callable[[sa.Row], dict]
+
+# Path of a new task between its INSERT and the flush that gives it an ID.
+# It sorts after every real path, so no subtree range ever matches it
+UNINDEXED_PATH = "~"
+
+
+def subtree_query(
+    anchor: sa.Select,
+    max_depth: Optional[int] = None,
+    names: Optional[Iterable[str]] = None,
+) -> sa.Select:
+    """
+    Select every task reachable from the tasks matched by `anchor`, along with
+    its level below them.
+
+    `anchor` must select a single `id` column. The tasks are fetched with one
+    `WITH RECURSIVE` statement that walks `tasks.parent_id`, so the number of
+    round trips does not depend on the depth of the tree. `max_depth` stops
+    the walk that many levels below the anchor tasks. Rows hold the columns
+    of the `names` fields only, see `Task.read_columns`.
+    """
+    tree = anchor.add_columns(sa.literal(0).label("level")).cte(
+        "subtree", recursive=True
+    )
+    below = sa.select(Task.id, tree.c.level + 1).where(Task.parent_id == tree.c.id)
+    if max_depth is not None:
+        below = below.where(tree.c.level < max_depth)
+    tree = tree.union_all(below)
+
+    return (
+        sa.select(*Task.read_columns(names), tree.c.level)
+        .join(tree, Task.id == tree.c.id)
+        .order_by(Task.id)
+    )
+
+
+def subtree_ids(task_ids: Iterable[int]) -> sa.Select:
+    """
+    Select the IDs of the tasks in `task_ids` and of all their descendants,
+    with one `WITH RECURSIVE` statement.
+    """
+    tree = (
+        sa.select(Task.id)
+        .where(Task.id.in_(list(task_ids)))
+        .cte("subtree_ids", recursive=True)
+    )
+    tree = tree.union_all(sa.select(Task.id).where(Task.parent_id == tree.c.id))
+    return sa.select(tree.c.id)
+
+
+def nest(
+    rows: Iterable[sa.Row],
+    max_depth: Optional[int] = None,
+    encode: Optional[Encoder] = None,
+) -> List[Tuple[int, dict]]:
+    """
+    Nest flat task rows with their level into trees. Return the roots in id
+    order, each with the ID of its list.
+
+    Each row becomes a node with `encode`, or a dict of its columns by default.
+    Tasks at `max_depth` get no "subtasks" key, since theirs were not loaded;
+    with `encode` they get None, as `marshal` would give them.
+    """
+    nodes: Dict[int, Tuple[dict, Optional[int], int]] = {}
+    for row in rows:
+        if encode:
+            node = encode(row)
+        else:
+            node = row._asdict()
+            del node["level"]
+        if max_depth is None or row.level < max_depth:
+            node["subtasks"] = []
+        elif encode and max_depth:
+            node["subtasks"] = None
+        nodes[row.id] = (node, row.parent_id, row.list_id)
+
+    roots = []
+    for node, parent_id, list_id in nodes.values():
+        parent = nodes.get(parent_id)
+        if parent is None:
+            roots.append((list_id, node))
+        else:
+            parent[0]["subtasks"].append(node)
+
+    return roots
+
+
+def build_forest(
+    rows: Iterable[sa.Row],
+    max_depth: Optional[int] = None,
+    encode: Optional[Encoder] = None,
+) -> List[dict]:
+    """Nest flat task rows into trees. Return the roots in id order."""
+    return [root for _, root in nest(rows, max_depth, encode)]
+
+
+def load_subtree(
+    task_id: int, list_id: Optional[int] = None, user_id: Optional[int] = None
+) -> Optional[dict]:
+    """
+    Get a task with all of its descendants nested, or None if not found or
+    not in the list `list_id` of the user `user_id`, when they are given.
+    """
+    anchor = sa.select(Task.id).where(Task.id == task_id)
+    if list_id is not None:
+        anchor = anchor.where(Task.list_id == list_id)
+    if user_id is not None:
+        anchor = anchor.where(Task.user_id == user_id)
+    rows = db.session.execute(subtree_query(anchor))
+
+    for root in build_forest(rows):
+        return root
+    return None
+
+
+def load_trees(
+    task_ids: Iterable[int],
+    max_depth: Optional[int] = None,
+    encode: Optional[Encoder] = None,
+    names: Optional[Iterable[str]] = None,
+) -> List[dict]:
+    """
+    Get the tasks in `task_ids` with their descendants nested, in id order.
+    Only the columns of the `names` fields are read.
+    """
+    anchor = sa.select(Task.id).where(Task.id.in_(list(task_ids)))
+    rows = db.session.execute(subtree_query(anchor, max_depth, names))
+
+    return build_forest(rows, max_depth, encode)
+
+
+def load_list_trees(
+    list_ids: Iterable[int],
+    max_depth: Optional[int] = None,
+    encode: Optional[Encoder] = None,
+) -> Dict[int, List[dict]]:
+    """Get the task trees of each list in `list_ids`, keyed by list ID."""
+    list_ids = list(list_ids)
+    trees: Dict[int, List[dict]] = {list_id: [] for list_id in list_ids}
+    if not list_ids:
+        return trees
+
+    anchor = sa.select(Task.id).where(
+        Task.list_id.in_(list_ids), Task.parent_id.is_(None)
+    )
+    rows = db.session.execute(subtree_query(anchor, max_depth))
+
+    for list_id, root in nest(rows, max_depth, encode):
+        trees[list_id].append(root)
+
+    return trees
+
+
+def set_path(task: Task, parent: Optional[Task] = None) -> None:
+    """Index a new task under `parent`. Flushes the session to get the task's ID."""
+    set_paths([(task, parent)])
+
+
+def set_paths(new_tasks: List[Tuple[Task, Optional[Task]]]) -> None:
+    """
+    Index new tasks under their parents with a single flush.
+
+    Parents that are new too must come before their subtasks.
+    """
+    for task, parent in new_tasks:
+        task.parent = parent
+        task.depth = parent.depth + 1 if parent else 0
+        task.path = UNINDEXED_PATH
+    db.session.flush()
+
+    for task, parent in new_tasks:
+        task.path = f"{parent.path if parent else ''}{task.id}{PATH_SEPARATOR}"
+
+
+def move_subtree(
+    task: Task, parent: Optional[Task] = None, list_id: Optional[int] = None
+) -> None:
+    """
+    Re-parent a task under `parent`, or make it top-level, and move it to
+    `list_id` if given.
+
+    The parent of the task and the path, depth and list of its whole subtree
+    are rewritten with one UPDATE, whatever its size. The caller must make
+    sure `parent` is not in the subtree.
+    """
+    old_path = task.path
+    new_path = f"{parent.path if parent else ''}{task.id}{PATH_SEPARATOR}"
+    depth_change = (parent.depth + 1 if parent else 0) - task.depth
+    values = {
+        "parent_id": sa.case(
+            (Task.id == task.id, parent.id if parent else None), else_=Task.parent_id
+        ),
+        "path": sa.literal(new_path) + sa.func.substr(Task.path, len(old_path) + 1),
+        "depth": Task.depth + depth_change,
+    }
+    # Only touch the list when it changes, so the search index is left alone
+    if list_id is not None and list_id != task.list_id:
+        values["list_id"] = list_id
+        values["user_id"] = (
+            sa.select(TaskList.user_id).where(TaskList.id == list_id).scalar_subquery()
+        )
+
+    db.session.execute(
+        sa.update(Task).where(Task.in_subtree(old_path)).values(**values)
+    )
@@ -1,11 +1,13 @@
 # CONSTANTS FOR ENDPOINTS
 
 API_ENDPOINT = "/api"
+METRICS_ENDPOINT = "/metrics"
 
 ### AUTH ENDPOINTS
 AUTH_ENDPOINT = "/auth"
 LOGIN_ENDPOINT = "/login"
 LOGOUT_ENDPOINT = "/logout"
+REFRESH_ENDPOINT = "/refresh"
 REGISTER_ENDPOINT = "/register"
 SIGNIN_ENDPOINT = "/signin"
 SIGNOUT_ENDPOINT = "/signout"
@@ -16,6 +18,9 @@ LISTS_ENDPOINT = "/lists"
 CREATE_LIST_ENDPOINT = "/"
 
 GET_ALL_LISTS_ENDPOINT = "/all"
+DUE_TASKS_ENDPOINT = "/due"
+EXPORT_LISTS_ENDPOINT = "/export"
+IMPORT_LISTS_ENDPOINT = "/import"
 GET_LIST_ENDPOINT = "/<int:list_id>"
 GET_TASKS_ENDPOINT = GET_LIST_ENDPOINT + "/tasks"
 
@@ -33,5 +38,18 @@ DELETE_TASK_ENDPOINT = GET_TASK_ENDPOINT + "/delete"
 EDIT_TASK_ENDPOINT = GET_TASK_ENDPOINT + "/edit"
 MOVE_TASK_ENDPOINT = GET_TASK_ENDPOINT + "/move"
 
-GET_SUBTASKS_ENDPOINT = "/<int:parent_id>"
-CREATE_SUBTASK_ENDPOINT = GET_SUBTASKS_ENDPOINT + "/subtasks"
+BATCH_TASKS_ENDPOINT = "/batch"
+
+SUBTASKS_ENDPOINT = "/<int:parent_id>/subtasks"
+
+### CHANGE FEED ENDPOINTS (Prepend with FEED_ENDPOINT)
+FEED_ENDPOINT = "/feed"
+CHANGES_ENDPOINT = "/changes"
+
+### SYNC ENDPOINTS (Prepend with SYNC_ENDPOINT)
+SYNC_ENDPOINT = "/sync"
+SYNC_CHANGES_ENDPOINT = ""
+
+### SEARCH ENDPOINTS (Prepend with SEARCH_ENDPOINT)
+SEARCH_ENDPOINT = "/search"
+SEARCH_RESULTS_ENDPOINT = ""
@@ -0,0 +1 @@
+"""Benchmarks of the API's hot paths on generated data."""
@@ -0,0 +1,254 @@
+"""
+Drive the API's hot paths through the Flask test client and report latency,
+SQL statements per request and peak memory as JSON.
+
+    python -m benchmarks.run --users 5 --roots 200 --depth 8 --output run.json
+    python -m benchmarks.run --compare run.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from importlib import metadata
+from typing import Callable, Dict, List, Optional
+
+import sqlalchemy
+
+from backend.app import create_app, db
+from backend.app.migrations import upgrade
+
+from .seed import PASSWORD, SeededUser, Shape, seed
+
+STATEMENTS = re.compile(r'db;desc="(\d+) statements"')
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of some samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, int(round(fraction * len(ordered))) - 1)]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KiB on Linux, in bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Recorder:
+    """Time requests and read their statement counts from Server-Timing."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statements: Dict[str, List[int]] = defaultdict(list)
+
+    def request(self, name: str, client, method: str, url: str, **kwargs) -> None:
+        started_at = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started_at
+
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name}: {method} {url} -> {response.status_code}")
+        self.latencies[name].append(elapsed * 1000)
+        match = STATEMENTS.search(response.headers.get("Server-Timing", ""))
+        if match:
+            self.statements[name].append(int(match.group(1)))
+
+    def summary(self) -> Dict[str, dict]:
+        results = {}
+        for name, latencies in self.latencies.items():
+            statements = self.statements[name]
+            results[name] = {
+                "requests": len(latencies),
+                "p50_ms": round(percentile(latencies, 0.5), 3),
+                "p99_ms": round(percentile(latencies, 0.99), 3),
+                "mean_ms": round(sum(latencies) / len(latencies), 3),
+                "queries_per_request": (
+                    round(sum(statements) / len(statements), 2) if statements else None
+                ),
+                "max_queries": max(statements) if statements else None,
+            }
+        return results
+
+
+def scenarios(
+    recorder: Recorder, client, user: SeededUser, rng: random.Random
+) -> Dict[str, Callable[[], None]]:
+    """The requests to time for one logged-in user, by resource name."""
+    roots = [
+        (list_id, task_id)
+        for list_id, task_ids in user.root_ids.items()
+        for task_id in task_ids
+    ]
+    rng.shuffle(roots)
+
+    def get_all_lists():
+        recorder.request("GetAllLists", client, "GET", "/lists/all")
+
+    def get_tasks():
+        list_id = rng.choice(user.list_ids)
+        recorder.request("GetTasks", client, "GET", f"/lists/{list_id}/tasks")
+
+    def update_task_status():
+        list_id, task_id = rng.choice(roots)
+        recorder.request(
+            "UpdateTaskStatus",
+            client,
+            "PUT",
+            f"/lists/{list_id}/tasks/{task_id}/status",
+        )
+
+    def move_task():
+        list_id, task_id = rng.choice(roots)
+        recorder.request(
+            "MoveTask",
+            client,
+            "PUT",
+            f"/lists/{list_id}/tasks/{task_id}/move",
+            json={"new_list_id": rng.choice(user.list_ids)},
+        )
+
+    def delete_task():
+        # Each delete takes a different tree, so run them last
+        list_id, task_id = roots.pop()
+        recorder.request(
+            "DeleteTask", client, "DELETE", f"/lists/{list_id}/tasks/{task_id}/delete"
+        )
+
+    return {
+        "GetAllLists": get_all_lists,
+        "GetTasks": get_tasks,
+        "UpdateTaskStatus": update_task_status,
+        "MoveTask": move_task,
+        "DeleteTask": delete_task,
+    }
+
+
+def run(
+    shape: Shape,
+    iterations: int,
+    database_url: Optional[str] = None,
+    cache: bool = False,
+    random_seed: int = 0,
+) -> dict:
+    """Seed a database, run every scenario and return the report."""
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = (
+            database_url or f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": database_url,
+                "SECRET_KEY": "benchmark",
+                "SESSION_COOKIE_SECURE": False,
+                "CACHE_TYPE": "lru" if cache else "null",
+                # Seeding users shouldn't be the slow part
+                "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+                "PASSWORD_HASH_WORKERS": 0,
+                "LOGIN_MAX_FAILURES": 10**9,
+            }
+        )
+
+        started_at = time.perf_counter()
+        with app.app_context():
+            upgrade(db.engine)
+            users = seed(shape)
+        seed_seconds = time.perf_counter() - started_at
+
+        rng = random.Random(random_seed)
+        recorder = Recorder()
+        deletes = min(iterations, shape.lists * shape.roots)
+        for user in users:
+            client = app.test_client()
+            client.post(
+                "/auth/login", json={"username": user.username, "password": PASSWORD}
+            )
+            steps = scenarios(recorder, client, user, rng)
+            for name, step in steps.items():
+                for _ in range(deletes if name == "DeleteTask" else iterations):
+                    step()
+
+        with app.app_context():
+            db.engine.dispose()
+
+    return {
+        "shape": shape._asdict(),
+        "iterations": iterations,
+        "cache": cache,
+        "database": sqlalchemy.engine.make_url(database_url).get_backend_name(),
+        "environment": {
+            "python": platform.python_version(),
+            "flask": metadata.version("flask"),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "results": recorder.summary(),
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """List the resources whose p50 or queries grew past `threshold` times the baseline."""
+    regressions = []
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        for key in ("p50_ms", "queries_per_request"):
+            if before[key] and result[key] and result[key] > before[key] * threshold:
+                regressions.append(f"{name} {key}: {before[key]} -> {result[key]}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    for field, default in Shape._field_defaults.items():
+        parser.add_argument(f"--{field}", type=int, default=default)
+    parser.add_argument(
+        "--iterations", type=int, default=50, help="Requests per resource and user"
+    )
+    parser.add_argument(
+        "--database-url", help="Database to seed, a temporary SQLite file by default"
+    )
+    parser.add_argument(
+        "--cache", action="store_true", help="Enable the response cache"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument(
+        "--compare", help="Baseline JSON report to check for regressions"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=1.25, help="Allowed slowdown ratio"
+    )
+    args = parser.parse_args(argv)
+
+    shape = Shape(*(getattr(args, field) for field in Shape._fields))
+    report = run(shape, args.iterations, args.database_url, args.cache, args.seed)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Generate users with lists of task trees in configurable shapes."""
+
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import sqlalchemy as sa
+
+from backend.app import db
+from backend.app.models import Task, TaskList, User
+from backend.app.transfer import import_records
+
+PASSWORD = "benchmark"
+
+
+class Shape(NamedTuple):
+    """
+    How much data to generate.
+
+    Every user gets `lists` lists. Each list has `roots` top-level tasks,
+    and each of those a tree `depth` levels deep in which every task has
+    `fanout` subtasks. A fanout of 1 makes chains.
+    """
+
+    users: int = 5
+    lists: int = 4
+    roots: int = 50
+    depth: int = 5
+    fanout: int = 1
+
+    def tasks_per_list(self) -> int:
+        per_tree = sum(self.fanout**level for level in range(self.depth + 1))
+        return self.roots * per_tree
+
+
+class SeededUser(NamedTuple):
+    username: str
+    list_ids: List[int]
+    root_ids: Dict[int, List[int]]  # List ID -> IDs of its top-level tasks
+
+
+def tree_records(shape: Shape) -> Iterator[Tuple[int, dict]]:
+    """Yield the import records of one user's lists, parents first."""
+    line = 0
+    next_id = 0
+
+    def record(**fields) -> Tuple[int, dict]:
+        nonlocal line
+        line += 1
+        return line, fields
+
+    for list_number in range(shape.lists):
+        yield record(type="list", id=list_number, name=f"List {list_number}")
+
+        for root_number in range(shape.roots):
+            level = [next_id]
+            yield record(
+                type="task",
+                id=next_id,
+                list_id=list_number,
+                parent_id=None,
+                name=f"Task {root_number}",
+            )
+            next_id += 1
+
+            for depth in range(1, shape.depth + 1):
+                below = []
+                for parent_id in level:
+                    for _ in range(shape.fanout):
+                        yield record(
+                            type="task",
+                            id=next_id,
+                            list_id=list_number,
+                            parent_id=parent_id,
+                            name=f"Subtask {depth}.{next_id}",
+                        )
+                        below.append(next_id)
+                        next_id += 1
+                level = below
+
+
+def seed(shape: Shape, batch_size: int = 1000) -> List[SeededUser]:
+    """Create the users and their data. Needs an app context."""
+    users = [
+        User(username=f"bench{number}", password=PASSWORD)
+        for number in range(shape.users)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+
+    for user in users:
+        import_records(user.id, tree_records(shape), batch_size)
+    db.session.commit()
+
+    seeded = []
+    for user in users:
+        list_ids = (
+            db.session.execute(
+                sa.select(TaskList.id)
+                .where(TaskList.user_id == user.id)
+                .order_by(TaskList.id)
+            )
+            .scalars()
+            .all()
+        )
+        root_ids: Dict[int, List[int]] = {list_id: [] for list_id in list_ids}
+        for list_id, task_id in db.session.execute(
+            sa.select(Task.list_id, Task.id)
+            .where(Task.list_id.in_(list_ids), Task.parent_id.is_(None))
+            .order_by(Task.id)
+        ):
+            root_ids[list_id].append(task_id)
+        seeded.append(SeededUser(user.username, list_ids, root_ids))
+
+    return seeded
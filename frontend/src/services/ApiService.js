@@ -108,4 +108,20 @@ export default class ApiService {
   async delete(url, options) {
     return this.request({method: 'DELETE', url, ...options});
   }
+
+  /**
+   * Opens the change feed of the logged-in user, instead of polling for changes.
+   * The browser reconnects on its own and resumes from the last change received.
+   * @param {function(object): void} onChange - Called with each task or list delta.
+   * @param {function(): void} onReset - Called when changes were missed, to reload.
+   * @returns {EventSource} - The open feed, to close when done.
+   */
+  subscribe(onChange, onReset) {
+    const feed = new EventSource(this.base_url + '/feed/changes', {
+      withCredentials: true,
+    });
+    feed.addEventListener('change', (event) => onChange(JSON.parse(event.data)));
+    feed.addEventListener('reset', () => onReset());
+    return feed;
+  }
 }
\ No newline at end of file
@@ -30,7 +30,7 @@ export const TASK_ENDPOINTS = {
 	DELETE_TASK: (listId, taskId) =>
 		`${API_BASE_URL}/lists/${listId}/tasks/${taskId}/delete`,
 	GET_SUBTASKS: (listId, parentId) =>
-		`${API_BASE_URL}/lists/${listId}/tasks/${parentId}/`,
+		`${API_BASE_URL}/lists/${listId}/tasks/${parentId}/subtasks`,
 	CREATE_SUBTASK: (listId, parentId) =>
 		`${API_BASE_URL}/lists/${listId}/tasks/${parentId}/subtasks`,
 };
@@ -1,14 +1,25 @@
 import pytest
+import sqlalchemy as sa
+
 from backend.app import create_app, db
 from backend.app.models import User
 
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 def test_app():
     """
     Create a Flask application configured for testing.
+
+    Shared by the whole session, so the in-memory database is only set up once.
     """
-    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    app = create_app(
+        {
+            "TESTING": True,
+            "SECRET_KEY": "test",
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+            "SESSION_COOKIE_SECURE": False,
+        }
+    )
 
     # Create the database and the database table
     with app.app_context():
@@ -29,6 +40,26 @@ def test_client(test_app):
     return test_app.test_client()
 
 
+@pytest.fixture(scope="session")
+def auth_client(test_app):
+    """
+    A test client with a logged-in user.
+    """
+    with test_app.app_context():
+        user = User(username="authuser", password="authpassword")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    client = test_app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+
+    client.user_id = user_id
+    return client
+
+
 @pytest.fixture(scope="module")
 def test_runner(test_app):
     """
@@ -50,3 +81,24 @@ def init_database():
 
     db.session.close()
     db.drop_all()
+
+
+@pytest.fixture
+def count_statements():
+    """
+    Start collecting the SQL statements run on the engine. Return them with a
+    function that stops collecting.
+    """
+
+    def start():
+        statements = []
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        sa.event.listen(db.engine, "before_cursor_execute", on_execute)
+        return statements, lambda: sa.event.remove(
+            db.engine, "before_cursor_execute", on_execute
+        )
+
+    return start
@@ -0,0 +1,63 @@
+import sqlalchemy as sa
+
+from backend.app import create_app, db, login_throttle, response_cache
+from backend.app.cache import LRUCache, NullCache
+
+TEST_CONFIG = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"}
+
+
+def test_create_app_twice():
+    """
+    GIVEN the app factory
+    WHEN it builds two apps
+    THEN each gets its own API with every route
+    """
+    first = create_app(TEST_CONFIG)
+    second = create_app({**TEST_CONFIG, "SWAGGER_UI": False})
+
+    for app in (first, second):
+        rules = {rule.rule for rule in app.url_map.iter_rules()}
+        assert {"/auth/login", "/lists/all", "/lists/<int:list_id>/tasks/"} <= rules
+        assert app.test_client().get("/lists/all").status_code == 401
+
+    assert first.test_client().get("/api").status_code in (200, 301, 308)
+    assert second.test_client().get("/api").status_code == 404
+
+
+def test_extensions_are_per_app():
+    """
+    GIVEN two apps with different configs
+    WHEN each serves a request
+    THEN each uses its own extensions, configured by its own config, and
+    records only its own requests
+    """
+    first = create_app({**TEST_CONFIG, "LOGIN_MAX_FAILURES": 3})
+    second = create_app({**TEST_CONFIG, "CACHE_TYPE": "none"})
+
+    with first.app_context():
+        assert isinstance(response_cache.backend, LRUCache)
+        assert login_throttle.max_failures == 3
+    with second.app_context():
+        assert isinstance(response_cache.backend, NullCache)
+        assert login_throttle.max_failures == 5
+
+    second.test_client().get("/lists/all")
+    assert first.extensions["metrics"].responses == {}
+    assert list(second.extensions["metrics"].responses.values()) == [1]
+
+
+def test_boot_does_not_touch_the_schema():
+    """
+    GIVEN a new database
+    WHEN an app is created for it
+    THEN no tables are created until the schema is upgraded
+    """
+    app = create_app(TEST_CONFIG)
+
+    with app.app_context():
+        assert sa.inspect(db.engine).get_table_names() == []
+
+    result = app.test_cli_runner().invoke(args=["db", "upgrade"])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert "tasks" in sa.inspect(db.engine).get_table_names()
@@ -1,18 +1,34 @@
+import time
+
 import pytest
 from flask import url_for
 
-from tests.conftest import test_app, test_client
+from backend.app import db
+from backend.app.cache import LRUCache
+from backend.app.models import SessionUser, User
+from backend.app.passwords import LoginThrottle
+from backend.app.tokens import TokenRevocations, issue_tokens, verify
+
+
+@pytest.fixture
+def password_hasher(test_app):
+    """The password hasher of the test app, to patch outside of its context."""
+    return test_app.extensions["password_hasher"]
 
 
 @pytest.fixture(scope="module")
-def test_user() -> dict:
+def test_user(test_app) -> dict:
     """
-    Create a user for testing in terms of JSON
+    Create a user for testing, and return their credentials in terms of JSON
     """
-    return {
+    user = {
         "username": "testuser",
         "password": "testpassword",
     }
+    with test_app.app_context():
+        db.session.add(User(**user))
+        db.session.commit()
+    return user
 
 
 def test_login(test_app, test_client, test_user):
@@ -29,3 +45,264 @@ def test_login(test_app, test_client, test_user):
         assert response.status_code == 200
         assert response.json.get("message") == "Login succeeded"
         assert response.json.get("user").get("username") == test_user.get("username")
+
+
+def test_register_and_login(test_client, password_hasher):
+    """
+    GIVEN a new user
+    WHEN they register and then log in (POST)
+    THEN both succeed and the password is hashed with the configured method
+    """
+    user = {"username": "hasheduser", "password": "hashedpassword"}
+
+    response = test_client.post("/auth/register", json=user)
+    assert response.status_code == 201
+
+    response = test_client.post("/auth/login", json=user)
+    assert response.status_code == 200
+    assert response.json["user"]["username"] == "hasheduser"
+
+    with test_client.application.app_context():
+        stored = db.session.execute(
+            db.select(User).where(User.username == "hasheduser")
+        ).scalar_one()
+        assert stored.password_hash.startswith(password_hasher.method + "$")
+
+
+def test_login_rehashes_outdated_hashes(test_client, password_hasher, monkeypatch):
+    """
+    GIVEN a user whose password was hashed with other parameters
+    WHEN they log in (POST)
+    THEN their hash is upgraded to the configured parameters
+    """
+    user = {"username": "rehashuser", "password": "rehashpassword"}
+    monkeypatch.setattr(password_hasher, "method", "pbkdf2:sha256:1000")
+    assert test_client.post("/auth/register", json=user).status_code == 201
+    monkeypatch.undo()
+
+    response = test_client.post("/auth/login", json=user)
+    assert response.status_code == 200
+
+    with test_client.application.app_context():
+        stored = db.session.execute(
+            db.select(User).where(User.username == "rehashuser")
+        ).scalar_one()
+        assert not stored.needs_rehash()
+        assert stored.is_password_correct("rehashpassword")
+
+
+def test_bare_methods_are_not_rehashed(test_client, password_hasher, monkeypatch):
+    """
+    GIVEN a method configured without its parameters, e.g. "scrypt"
+    WHEN a hash made with it is checked
+    THEN it doesn't need a rehash, while other parameters still do
+    """
+    monkeypatch.setattr(password_hasher, "method", "scrypt")
+    password_hash = password_hasher.hash("barepassword")
+
+    assert not password_hasher.needs_rehash(password_hash)
+    assert password_hasher.needs_rehash("scrypt:16384:8:1$salt$hash")
+
+
+def test_unknown_users_are_checked_against_a_hash(
+    test_client, password_hasher, monkeypatch
+):
+    """
+    GIVEN a username nobody registered
+    WHEN someone logs in with it (POST)
+    THEN a password hash is still checked before they are refused
+    """
+    checked = []
+    verify = password_hasher.verify
+
+    def counting_verify(password_hash, password):
+        checked.append(password_hash)
+        return verify(password_hash, password)
+
+    monkeypatch.setattr(password_hasher, "verify", counting_verify)
+    guess = {"username": "nobodyuser", "password": "nobodypassword"}
+    response = test_client.post("/auth/login", json=guess)
+
+    assert response.status_code == 401
+    assert len(checked) == 1
+    assert not password_hasher.needs_rehash(checked[0])
+
+
+def test_failed_logins_are_throttled(test_client, password_hasher, monkeypatch):
+    """
+    GIVEN a user
+    WHEN someone keeps guessing their password (POST)
+    THEN they are refused without checking it once the limit is reached
+    """
+    user = {"username": "throttleduser", "password": "throttledpassword"}
+    assert test_client.post("/auth/register", json=user).status_code == 201
+    guess = {**user, "password": "wrongpassword"}
+
+    for _ in range(test_client.application.extensions["login_throttle"].max_failures):
+        assert test_client.post("/auth/login", json=guess).status_code == 401
+
+    def no_hashing(*args):
+        raise AssertionError("A throttled login was checked")
+
+    monkeypatch.setattr(password_hasher, "verify", no_hashing)
+    response = test_client.post("/auth/login", json=user)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+
+def test_login_throttle_window():
+    """
+    GIVEN a throttle that has blocked a username and address
+    WHEN its window runs out
+    THEN the pair may try again, and other pairs were never blocked
+    """
+    throttle = LoginThrottle(max_failures=2, window=60)
+    throttle.fail("user", "1.2.3.4")
+    throttle.fail("user", "1.2.3.4")
+
+    assert throttle.retry_after("user", "1.2.3.4") > 0
+    assert throttle.retry_after("user", "5.6.7.8") == 0
+
+    throttle._failures[("user", "1.2.3.4")] = (2, time.monotonic() - 61)
+    assert throttle.retry_after("user", "1.2.3.4") == 0
+
+
+def user_queries(test_app, count_statements, client, url="/lists/all", headers=None):
+    """Count the queries of the users table made by one authenticated GET."""
+    with test_app.app_context():
+        statements, stop = count_statements()
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        with test_app.app_context():
+            stop()
+    return response, [s for s in statements if "FROM users" in s]
+
+
+def test_user_loader_is_cached(test_app, auth_client, count_statements):
+    """
+    GIVEN a logged-in session
+    WHEN it makes requests before and after the user's password changes
+    THEN the user is loaded once, and again after the change
+    """
+    with test_app.app_context():
+        test_app.extensions["user_cache"].invalidate(auth_client.user_id)
+
+    response, queries = user_queries(test_app, count_statements, auth_client)
+    assert response.status_code == 200
+    assert len(queries) == 1
+
+    response, queries = user_queries(test_app, count_statements, auth_client)
+    assert response.status_code == 200
+    assert queries == []
+
+    with test_app.app_context():
+        user = db.session.get(User, auth_client.user_id)
+        user.set_password("authpassword")
+        db.session.commit()
+
+    response, queries = user_queries(test_app, count_statements, auth_client)
+    assert len(queries) == 1
+
+
+def test_session_payload_skips_user_loads(test_app, monkeypatch, count_statements):
+    """
+    GIVEN sessions that carry a signed user payload
+    WHEN a user logs in, makes a request, and logs out
+    THEN the request doesn't load the user unless another worker serves it,
+    and the session ends on logout
+    """
+    monkeypatch.setitem(test_app.config, "SESSION_USER_PAYLOAD", True)
+    client = test_app.test_client()
+    user = {"username": "payloaduser", "password": "payloadpassword"}
+    assert client.post("/auth/register", json=user).status_code == 201
+    assert client.post("/auth/login", json=user).status_code == 200
+
+    response, queries = user_queries(test_app, count_statements, client)
+    assert response.status_code == 200
+    assert queries == []
+
+    # Another worker without shared generations doesn't trust the payload
+    monkeypatch.setattr(test_app.extensions["user_cache"], "generations", LRUCache())
+    response, queries = user_queries(test_app, count_statements, client)
+    assert response.status_code == 200
+    assert len(queries) == 1
+
+    assert client.post("/auth/logout").status_code == 200
+    response, _ = user_queries(test_app, count_statements, client)
+    assert response.status_code == 401
+
+
+def test_token_auth(test_app, monkeypatch, count_statements):
+    """
+    GIVEN the token auth mode
+    WHEN a user logs in, uses and refreshes their tokens, then logs out
+    THEN requests are authorized by token alone until the tokens are revoked
+    """
+    monkeypatch.setitem(test_app.config, "AUTH_MODE", "token")
+    monkeypatch.setattr(test_app.extensions["token_revocations"], "sync_interval", 0)
+    client = test_app.test_client()
+    user = {"username": "tokenuser", "password": "tokenpassword"}
+    assert client.post("/auth/register", json=user).status_code == 201
+
+    tokens = client.post("/auth/login", json=user).json
+    assert tokens["token_type"] == "Bearer"
+    assert client.get("/lists/all").status_code == 401
+
+    bearer = {"Authorization": f"Bearer {tokens['access_token']}"}
+    response, queries = user_queries(test_app, count_statements, client, headers=bearer)
+    assert response.status_code == 200
+    assert queries == []
+
+    forged = tokens["access_token"][:-2] + "xx"
+    response = client.get("/lists/all", headers={"Authorization": f"Bearer {forged}"})
+    assert response.status_code == 401
+    # A refresh token isn't an access token
+    response = client.get(
+        "/lists/all", headers={"Authorization": f"Bearer {tokens['refresh_token']}"}
+    )
+    assert response.status_code == 401
+
+    refresh = {"refresh_token": tokens["refresh_token"]}
+    refreshed = client.post("/auth/refresh", json=refresh).json
+    bearer = {"Authorization": f"Bearer {refreshed['access_token']}"}
+    assert client.get("/lists/all", headers=bearer).status_code == 200
+
+    assert client.post("/auth/logout", headers=bearer).status_code == 200
+    assert client.get("/lists/all", headers=bearer).status_code == 401
+    assert client.post("/auth/refresh", json=refresh).status_code == 401
+
+
+def test_expired_tokens_are_refused(test_app, monkeypatch):
+    """
+    GIVEN an access token
+    WHEN its lifetime has passed
+    THEN it no longer verifies
+    """
+    with test_app.test_request_context():
+        user = SessionUser(1, "someone")
+        token = issue_tokens(user)["access_token"]
+        assert verify(token)["sub"] == 1
+
+        later = time.time() + test_app.config["ACCESS_TOKEN_TTL"] + 1
+        monkeypatch.setattr(time, "time", lambda: later)
+        assert verify(token) is None
+
+
+def test_revocations_reach_other_workers(test_app):
+    """
+    GIVEN a worker that synced a revocation which has expired since
+    WHEN another revocation drops the expired one and takes its place
+    THEN the worker still picks the new revocation up
+    """
+    revoking, other = TokenRevocations(), TokenRevocations()
+    with test_app.app_context():
+        revoking.revoke("expired-session", int(time.time()) - 1)
+        db.session.commit()
+        other.sync()
+
+        revoking.revoke("new-session", int(time.time()) + 60)
+        db.session.commit()
+        other.sync()
+
+        assert other.is_revoked("new-session")
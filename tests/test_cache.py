@@ -0,0 +1,129 @@
+import time
+
+import pytest
+
+from backend.app import db
+from backend.app.cache import LRUCache
+from backend.app.models import TaskList
+
+
+def test_lru_cache_bounds_and_expiry(monkeypatch):
+    """
+    GIVEN an LRU cache of two entries
+    WHEN a third entry is added and time passes the TTL
+    THEN the least recently used entry is evicted and the rest expire
+    """
+    cache = LRUCache(max_size=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+def test_lru_cache_bounds_generations():
+    """
+    GIVEN an LRU cache of two entries
+    WHEN more generations are bumped than it can hold
+    THEN they are evicted like entries, and never come back with an old value
+    """
+    cache = LRUCache(max_size=2, ttl=10)
+    seen = {cache.generation("list:1"), cache.incr("list:1")}
+    for list_id in range(2, 10):
+        seen.add(cache.incr(f"list:{list_id}"))
+
+    assert len(cache._entries) == 2
+    assert cache.generation("list:1") not in seen
+
+
+@pytest.fixture(scope="module")
+def cached_list(test_app, auth_client):
+    """
+    An empty list of the logged-in user.
+    """
+    with test_app.app_context():
+        task_list = TaskList(name="Cached", user_id=auth_client.user_id)
+        db.session.add(task_list)
+        db.session.commit()
+        return task_list.id
+
+
+def test_writes_invalidate_reads(test_app, auth_client, cached_list):
+    """
+    GIVEN cached reads of a list and its tasks
+    WHEN the list is edited and a task is created in it through the API
+    THEN the next reads see the changes
+    """
+    list_url, tasks_url = f"/lists/{cached_list}", f"/lists/{cached_list}/tasks"
+    assert auth_client.get(list_url).json["name"] == "Cached"
+    assert auth_client.get(tasks_url).json == []
+
+    # A write that bypasses the API doesn't invalidate the cached read
+    with test_app.app_context():
+        db.session.get(TaskList, cached_list).name = "Bypassed"
+        db.session.commit()
+    assert auth_client.get(list_url).json["name"] == "Cached"
+
+    response = auth_client.put(f"{list_url}/edit", json={"name": "Renamed"})
+    assert response.status_code == 200
+    assert auth_client.get(list_url).json["name"] == "Renamed"
+
+    response = auth_client.post(
+        f"{tasks_url}/", json={"name": "New", "list_id": cached_list}
+    )
+    assert response.status_code == 201
+    assert [task["name"] for task in auth_client.get(tasks_url).json] == ["New"]
+
+
+def test_reads_follow_versions_of_other_workers(test_app, auth_client, cached_list):
+    """
+    GIVEN a cached read of a list
+    WHEN another worker renames it and bumps its version, without touching
+    this worker's cache
+    THEN the next read has the new name and a new ETag
+    """
+    list_url = f"/lists/{cached_list}"
+    first = auth_client.get(list_url)
+
+    with test_app.app_context():
+        task_list = db.session.get(TaskList, cached_list)
+        task_list.name = "Elsewhere"
+        task_list.version += 1
+        db.session.commit()
+
+    response = auth_client.get(list_url)
+    assert response.json["name"] == "Elsewhere"
+    assert response.headers["ETag"] != first.headers["ETag"]
+    all_lists = auth_client.get("/lists/all").json
+    assert "Elsewhere" in [task_list["name"] for task_list in all_lists]
+
+
+def test_etag_and_cache_share_one_version(
+    test_app, auth_client, cached_list, count_statements
+):
+    """
+    GIVEN a cached read of a list
+    WHEN it is read again
+    THEN its version is read once, for both the ETag and the cache entry,
+    and the body comes from the cache
+    """
+    list_url = f"/lists/{cached_list}"
+    etag = auth_client.get(list_url).headers["ETag"]
+
+    with test_app.app_context():
+        statements, stop = count_statements()
+    try:
+        response = auth_client.get(list_url)
+    finally:
+        with test_app.app_context():
+            stop()
+
+    assert response.headers["ETag"] == etag
+    versions = [s for s in statements if "task_lists.version" in s]
+    assert len(versions) == 1 and len(statements) == 1
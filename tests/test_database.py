@@ -0,0 +1,91 @@
+import pytest
+import sqlalchemy as sa
+from flask import Flask
+
+from backend.app import db
+from backend.app.config import Config
+from backend.app.database import (
+    READ_ONLY_BIND,
+    configure_database,
+    configure_engines,
+    set_sqlite_pragmas,
+)
+from backend.app.models import User
+
+
+def make_config_app(uri: str) -> Flask:
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    configure_database(app)
+    return app
+
+
+def test_sqlite_file_gets_a_read_only_pool(tmp_path):
+    """
+    GIVEN a SQLite file database
+    WHEN the app's database settings are filled in
+    THEN it gets the pool options and a read-only bind to the same file
+    """
+    uri = f"sqlite:///{tmp_path / 'todo.db'}"
+    app = make_config_app(uri)
+
+    assert app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"] == 10
+    assert app.config["SQLALCHEMY_BINDS"][READ_ONLY_BIND]["url"] == uri
+
+
+def test_memory_database_has_no_pool_sizes():
+    """
+    GIVEN an in-memory SQLite database
+    WHEN the app's database settings are filled in
+    THEN pool size options are dropped and there's no read-only bind
+    """
+    app = make_config_app("sqlite:///:memory:")
+
+    assert "pool_size" not in app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    assert app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_pre_ping"] is True
+    assert READ_ONLY_BIND not in (app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+def test_pragmas_and_read_only_pool(tmp_path):
+    """
+    GIVEN a primary and a read-only engine on the same SQLite file
+    WHEN they connect
+    THEN the pragmas are set, and the read-only engine refuses writes
+    """
+    uri = f"sqlite:///{tmp_path / 'todo.db'}"
+    engines = {None: sa.create_engine(uri), READ_ONLY_BIND: sa.create_engine(uri)}
+    configure_engines(make_config_app(uri), engines)
+
+    with engines[None].begin() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        connection.exec_driver_sql("CREATE TABLE notes (id INTEGER PRIMARY KEY)")
+
+    with engines[READ_ONLY_BIND].connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM notes").scalar() == 0
+        with pytest.raises(sa.exc.OperationalError):
+            connection.exec_driver_sql("INSERT INTO notes DEFAULT VALUES")
+
+
+def test_get_requests_read_from_read_only_pool(test_app, monkeypatch):
+    """
+    GIVEN an app with a read-only pool
+    WHEN the session picks an engine while serving requests
+    THEN reads of GET requests use the read-only pool, and writes don't
+    """
+    read_only = sa.create_engine("sqlite://")
+    set_sqlite_pragmas(read_only, {"query_only": "ON"})
+
+    with test_app.app_context():
+        monkeypatch.setitem(db.engines, READ_ONLY_BIND, read_only)
+        primary = db.engines[None]
+
+        with test_app.test_request_context(method="GET"):
+            assert db.session.get_bind(User) is read_only
+            assert db.session.get_bind(User, clause=sa.update(User)) is primary
+
+        with test_app.test_request_context(method="POST"):
+            assert db.session.get_bind(User) is primary
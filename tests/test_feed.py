@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from backend.app.pubsub import ChangeFeed, FeedReset
+
+
+def read_events(response, count: int) -> list:
+    """Read the first `count` events of a stream, then close it."""
+    events = []
+    chunks = response.iter_encoded()
+    while len(events) < count:
+        chunk = next(chunks).decode()
+        if chunk.startswith(":"):
+            continue
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    response.close()
+    return events
+
+
+def test_feed_replays_missed_events():
+    """
+    GIVEN a feed with events published to two users
+    WHEN a user subscribes from an earlier event
+    THEN only their own events after it are replayed
+    """
+    feed = ChangeFeed()
+    feed.publish(1, [{"n": 1}])
+    subscription, _ = feed.subscribe(1)
+    since = subscription.start
+    subscription.close()
+
+    feed.publish(1, [{"n": 2}, {"n": 3}])
+    feed.publish(2, [{"n": 4}])
+
+    subscription, missed = feed.subscribe(1, since)
+    assert [data for _, data in missed] == [{"n": 2}, {"n": 3}]
+
+    feed.publish(1, [{"n": 5}])
+    assert subscription.get(0)[1] == {"n": 5}
+    assert subscription.get(0) is None
+    subscription.close()
+
+
+def test_feed_resets_when_events_are_gone():
+    """
+    GIVEN a feed that kept only the latest 2 events of a user
+    WHEN they resume from before those, or from an unknown event
+    THEN the feed is reset
+    """
+    feed = ChangeFeed()
+    feed.buffer_size = 2
+    subscription, _ = feed.subscribe(1)
+    since = subscription.start
+    subscription.close()
+    feed.publish(1, [{"n": 1}, {"n": 2}, {"n": 3}])
+
+    with pytest.raises(FeedReset):
+        feed.subscribe(1, since)
+    with pytest.raises(FeedReset):
+        feed.subscribe(1, since + 100)
+    _, missed = feed.subscribe(1, since + 1)
+    assert [data for _, data in missed] == [{"n": 2}, {"n": 3}]
+
+
+def test_feed_drops_slow_subscribers():
+    """
+    GIVEN a subscriber that reads slower than events come
+    WHEN its queue overflows
+    THEN it is reset instead of blocking publishers
+    """
+    feed = ChangeFeed()
+    feed.queue_size = 1
+    subscription, _ = feed.subscribe(1)
+    feed.publish(1, [{"n": 1}, {"n": 2}])
+
+    with pytest.raises(FeedReset):
+        subscription.get(0)
+
+
+def test_changes_endpoint(test_app, auth_client):
+    """
+    GIVEN a logged-in user with an open change feed
+    WHEN they create a list and a task, then resume the feed
+    THEN the deltas are streamed with the list's version
+    """
+    ready = read_events(auth_client.get("/feed/changes"), 1)
+    assert ready[0][1] == "ready"
+    since = ready[0][0]
+
+    response = auth_client.post("/lists/", json={"name": "Feed"})
+    assert response.status_code == 201
+    list_id = max(row["id"] for row in auth_client.get("/lists/all").json)
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/", json={"name": "Watched", "list_id": list_id}
+    )
+    task_id = response.json["id"]
+
+    events = read_events(
+        auth_client.get("/feed/changes", headers={"Last-Event-ID": str(since)}), 4
+    )
+    deltas = [data for _, event_type, data in events if event_type == "change"]
+
+    assert events[0][1] == "ready"
+    assert [(delta["kind"], delta["op"], delta["id"]) for delta in deltas] == [
+        ("list", "created", list_id),
+        ("task", "created", task_id),
+        ("list", "updated", list_id),
+    ]
+    assert deltas[1]["data"]["name"] == "Watched"
+    assert deltas[1]["version"] == deltas[2]["version"] == deltas[0]["version"] + 1
+    assert deltas[2]["data"]["open_count"] == 1
+
+
+def test_changes_endpoint_resets(test_app, auth_client):
+    """
+    GIVEN a logged-in user
+    WHEN they resume the feed from an unknown event
+    THEN a reset event tells them to reload
+    """
+    response = auth_client.get("/feed/changes?since=1")
+
+    assert response.mimetype == "text/event-stream"
+    assert read_events(response, 1)[0][1] == "reset"
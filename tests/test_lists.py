@@ -0,0 +1,393 @@
+import json
+from datetime import date
+
+import pytest
+import sqlalchemy as sa
+
+from backend.app import db
+from backend.app.cache import NullCache
+from backend.app.models import Task, TaskList
+from backend.app.tree import set_path
+
+
+@pytest.fixture(scope="module")
+def paged_lists(test_app, auth_client):
+    """
+    Three lists, the first with five top-level tasks that each have a subtask.
+    """
+    with test_app.app_context():
+        task_lists = [
+            TaskList(name=f"Paged {number}", user_id=auth_client.user_id)
+            for number in range(3)
+        ]
+        db.session.add_all(task_lists)
+        db.session.flush()
+
+        for number in range(5):
+            task = Task(name=f"Task {number}", list_id=task_lists[0].id)
+            db.session.add(task)
+            set_path(task)
+
+            subtask = Task(name=f"Subtask {number}", list_id=task_lists[0].id)
+            subtask.parent = task
+            db.session.add(subtask)
+            set_path(subtask, task)
+
+        db.session.commit()
+        return [task_list.id for task_list in task_lists]
+
+
+def test_get_tasks_pages(auth_client, paged_lists):
+    """
+    GIVEN a list with five top-level tasks
+    WHEN its tasks are requested two at a time (GET)
+    THEN the pages follow each other through the next cursor
+    """
+    url = f"/lists/{paged_lists[0]}/tasks"
+    names, cursor = [], 0
+    while cursor is not None:
+        response = auth_client.get(url, query_string={"limit": 2, "cursor": cursor})
+        assert response.status_code == 200
+        assert len(response.json) <= 2
+
+        names += [task["name"] for task in response.json]
+        cursor = response.headers.get("X-Next-Cursor")
+
+    assert names == [f"Task {number}" for number in range(5)]
+
+
+def test_get_tasks_projection(auth_client, paged_lists):
+    """
+    GIVEN a list of tasks with subtasks
+    WHEN only some fields and no subtasks are requested (GET)
+    THEN the tasks carry just those fields
+    """
+    response = auth_client.get(
+        f"/lists/{paged_lists[0]}/tasks",
+        query_string={"fields": "id,name", "depth": 0, "limit": 1},
+    )
+
+    assert response.status_code == 200
+    assert response.json == [{"id": response.json[0]["id"], "name": "Task 0"}]
+
+    response = auth_client.get(
+        f"/lists/{paged_lists[0]}/tasks", query_string={"fields": "nope"}
+    )
+    assert response.status_code == 400
+
+
+def test_get_all_lists_pages(auth_client, paged_lists):
+    """
+    GIVEN a user with several lists
+    WHEN one list is requested per page without tasks (GET)
+    THEN each page has one projected list and a cursor to the next
+    """
+    response = auth_client.get(
+        "/lists/all",
+        query_string={"fields": "id,open_count", "limit": 1, "cursor": 0},
+    )
+    assert response.status_code == 200
+    assert list(response.json[0]) == ["id", "open_count"]
+
+    response = auth_client.get(
+        "/lists/all",
+        query_string={"limit": 1, "cursor": paged_lists[0] - 1, "depth": 1},
+    )
+    tasks = response.json[0]["tasks"]
+    assert response.headers["X-Next-Cursor"] == str(paged_lists[0])
+    assert len(tasks) == 5
+    assert tasks[0]["subtasks"][0]["name"] == "Subtask 0"
+    # Subtasks below the depth cap are not expanded
+    assert tasks[0]["subtasks"][0]["subtasks"] is None
+
+
+def test_conditional_gets(auth_client, paged_lists):
+    """
+    GIVEN a list read with its ETag
+    WHEN it is read again with If-None-Match, before and after a write
+    THEN it is Not Modified until a task in the list changes
+    """
+    list_id = paged_lists[1]
+    urls = [f"/lists/{list_id}", f"/lists/{list_id}/tasks", "/lists/all"]
+    etags = {}
+    for url in urls:
+        etags[url] = auth_client.get(url).headers["ETag"]
+        response = auth_client.get(url, headers={"If-None-Match": etags[url]})
+        assert response.status_code == 304
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/", json={"name": "Changed", "list_id": list_id}
+    )
+    assert response.status_code == 201
+
+    for url in urls:
+        response = auth_client.get(url, headers={"If-None-Match": etags[url]})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etags[url]
+
+
+def test_export_streams_flat_records(auth_client, paged_lists):
+    """
+    GIVEN a user with lists of tasks and subtasks
+    WHEN their data is exported (GET)
+    THEN it is streamed as NDJSON, lists first and parents before subtasks
+    """
+    response = auth_client.get("/lists/export")
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+
+    records = [json.loads(line) for line in response.data.decode().splitlines()]
+    lists = [record for record in records if record["type"] == "list"]
+    tasks = [record for record in records if record["type"] == "task"]
+    assert records == lists + tasks
+    assert {record["id"] for record in lists} >= set(paged_lists)
+
+    seen = set()
+    for task in tasks:
+        assert "subtasks" not in task
+        assert task["parent_id"] is None or task["parent_id"] in seen
+        seen.add(task["id"])
+    assert len([task for task in tasks if task["list_id"] == paged_lists[0]]) == 10
+
+
+def test_import_round_trips_export(auth_client, paged_lists):
+    """
+    GIVEN an export of a user's lists and task trees
+    WHEN it is imported back (POST)
+    THEN copies of the lists are created with the same trees and counters,
+    and synced as new lists
+    """
+    since = auth_client.get("/sync").json["cursor"]
+    export = auth_client.get(
+        f"/lists/{paged_lists[0]}/tasks", query_string={"limit": 500}
+    ).json
+    records = [
+        {"type": "list", "id": 1, "name": "Imported"},
+        *(
+            {**task, "type": "task", "list_id": 1}
+            for tree in export
+            for task in [tree, *tree["subtasks"]]
+        ),
+    ]
+    body = "\n".join(json.dumps(record) for record in records)
+
+    response = auth_client.post(
+        "/lists/import", data=body, content_type="application/x-ndjson"
+    )
+    assert response.status_code == 201
+    assert response.json["message"] == "Successfully imported 1 lists and 10 tasks."
+
+    lists = auth_client.get("/lists/all", query_string={"limit": 500}).json
+    imported = next(task_list for task_list in lists if task_list["name"] == "Imported")
+    assert imported["open_count"] == 10
+    assert [task["name"] for task in imported["tasks"]] == [
+        task["name"] for task in export
+    ]
+    for task in imported["tasks"]:
+        assert task["subtask_total"] == 1
+        assert task["subtasks"][0]["parent_id"] == task["id"]
+
+    sync = auth_client.get("/sync", query_string={"since": since}).json
+    assert [
+        (change["kind"], change["op"], change["id"]) for change in sync["changes"]
+    ] == [("list", "created", imported["id"])]
+
+    with auth_client.application.app_context():
+        subtask = db.session.get(Task, imported["tasks"][0]["subtasks"][0]["id"])
+        assert subtask.depth == 1
+        assert subtask.path == f"{subtask.parent_id}/{subtask.id}/"
+
+
+def test_import_rejects_orphans(auth_client):
+    """
+    GIVEN an import whose subtask comes before its parent
+    WHEN it is imported (POST)
+    THEN nothing is imported and the line is reported
+    """
+    body = "\n".join(
+        [
+            json.dumps({"type": "list", "id": 1, "name": "Orphans"}),
+            json.dumps(
+                {"type": "task", "id": 2, "list_id": 1, "parent_id": 3, "name": "A"}
+            ),
+        ]
+    )
+
+    response = auth_client.post(
+        "/lists/import", data=body, content_type="application/x-ndjson"
+    )
+
+    assert response.status_code == 400
+    assert "Line 2" in response.json["message"]
+    with auth_client.application.app_context():
+        assert not db.session.execute(
+            db.select(TaskList).where(TaskList.name == "Orphans")
+        ).first()
+
+
+def test_import_command_reads_csv(test_app, test_runner, auth_client, tmp_path):
+    """
+    THEN the tasks are nested, completed ones are counted and the list is synced
+    WHEN it is imported with the import-data command, in batches of two
+    THEN the tasks are nested and completed ones are counted
+    """
+    csv_file = tmp_path / "tasks.csv"
+    csv_file.write_text(
+        "type,id,list_id,parent_id,name,due_date,is_completed\n"
+        "list,7,,,From CSV,,\n"
+        "task,1,7,,Parent,2024-01-01,false\n"
+        "task,2,7,1,Done child,2024-01-01,true\n"
+        "task,3,7,1,Open child,,false\n"
+    )
+    since = auth_client.get("/sync").json["cursor"]
+
+    result = test_runner.invoke(
+        args=[
+            "import-data",
+            str(csv_file),
+            "--username",
+            "authuser",
+            "--batch-size",
+            "2",
+        ]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Imported 1 lists and 3 tasks" in result.output
+    with test_app.app_context():
+        task_list = db.session.execute(
+            db.select(TaskList).where(TaskList.name == "From CSV")
+        ).scalar_one()
+        parent = db.session.execute(
+            db.select(Task).where(Task.list_id == task_list.id, Task.depth == 0)
+        ).scalar_one()
+        assert task_list.open_count == 2
+        assert (parent.subtask_total, parent.subtask_done) == (2, 1)
+
+    # Logged like an import through the API
+    sync = auth_client.get("/sync", query_string={"since": since}).json
+    assert [(change["op"], change["id"]) for change in sync["changes"]] == [
+        ("created", task_list.id)
+    ]
+
+
+@pytest.mark.parametrize(
+    "url, query",
+    [
+        ("/lists/{list_id}/tasks", {}),
+        ("/lists/{list_id}/tasks", {"depth": 1}),
+        ("/lists/{list_id}/tasks", {"depth": 0, "fields": "id,due_date"}),
+        ("/lists/all", {}),
+        ("/lists/all", {"depth": 0}),
+        ("/lists/all", {"fields": "id,tasks", "depth": 1}),
+    ],
+)
+def test_fast_serializer_matches_marshal(
+    test_app, auth_client, paged_lists, monkeypatch, url, query
+):
+    """
+    GIVEN list and task reads
+    WHEN they are served with and without the fast serializer (GET)
+    THEN the responses are the same
+    """
+    monkeypatch.setattr(test_app.extensions["response_cache"], "backend", NullCache())
+    url = url.format(list_id=paged_lists[0])
+
+    monkeypatch.setitem(test_app.config, "FAST_SERIALIZER", True)
+    fast = auth_client.get(url, query_string={"limit": 500, **query})
+    monkeypatch.setitem(test_app.config, "FAST_SERIALIZER", False)
+    marshalled = auth_client.get(url, query_string={"limit": 500, **query})
+
+    assert fast.status_code == marshalled.status_code == 200
+    assert fast.json == marshalled.json
+
+
+@pytest.fixture(scope="module")
+def due_tasks(test_app, auth_client):
+    """
+    Tasks due around 15 June 2001, in two lists, one of them completed.
+    """
+    with test_app.app_context():
+        task_lists = [
+            TaskList(name=f"Due {number}", user_id=auth_client.user_id)
+            for number in range(2)
+        ]
+        db.session.add_all(task_lists)
+        db.session.flush()
+
+        parent = None
+        for name, day, list_index, is_completed in [
+            ("Late", date(2001, 6, 10), 0, False),
+            ("Later late", date(2001, 6, 1), 1, False),
+            ("Now", date(2001, 6, 15), 0, False),
+            ("Done now", date(2001, 6, 15), 1, True),
+            ("Soon", date(2001, 6, 17), 1, False),
+            ("Far", date(2001, 7, 30), 0, False),
+            ("Sub soon", date(2001, 6, 16), 0, False),
+        ]:
+            task = Task(
+                name=name,
+                due_date=day,
+                is_completed=is_completed,
+                list_id=task_lists[list_index].id,
+            )
+            db.session.add(task)
+            set_path(task, parent if name == "Sub soon" else None)
+            parent = parent or task
+        db.session.commit()
+
+
+@pytest.mark.parametrize(
+    "view, names",
+    [
+        ("overdue", ["Later late", "Late"]),
+        ("today", ["Now"]),
+        ("upcoming", ["Sub soon", "Soon"]),
+    ],
+)
+def test_due_views(auth_client, due_tasks, view, names):
+    """
+    GIVEN open and completed tasks due on several days, in several lists
+    WHEN a due-date view is requested (GET)
+    THEN it has the open tasks due in its range, flat and by due date
+    """
+    response = auth_client.get(
+        "/lists/due", query_string={"view": view, "today": "2001-06-15"}
+    )
+
+    assert response.status_code == 200
+    assert [task["name"] for task in response.json] == names
+    assert all("subtasks" not in task for task in response.json)
+
+
+def test_due_view_pages(test_app, auth_client, due_tasks):
+    """
+    GIVEN tasks due in the next two months
+    WHEN they are requested one at a time (GET)
+    THEN the pages follow each other through the next cursor, off the index
+    """
+    names, cursor = [], None
+    while True:
+        query = {"view": "upcoming", "today": "2001-06-15", "days": 60, "limit": 1}
+        if cursor:
+            query["cursor"] = cursor
+        response = auth_client.get("/lists/due", query_string=query)
+        names += [task["name"] for task in response.json]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert names == ["Sub soon", "Soon", "Far"]
+
+    with test_app.app_context():
+        plan = db.session.execute(
+            sa.text(
+                "EXPLAIN QUERY PLAN SELECT id FROM tasks WHERE user_id = 1 "
+                "AND is_completed = 0 AND due_date BETWEEN '2001-06-16' AND "
+                "'2001-06-22' ORDER BY due_date, id"
+            )
+        ).all()
+    assert "ix_tasks_user_id_due_date" in str(plan)
+    assert "TEMP B-TREE" not in str(plan)
@@ -0,0 +1,77 @@
+import re
+
+import pytest
+
+from backend.app import db
+from backend.app.models import Task, TaskList
+from backend.app.tree import set_paths
+
+
+@pytest.fixture(scope="module")
+def metrics_list(test_app, auth_client):
+    """A list with a task and a subtask."""
+    with test_app.app_context():
+        task_list = TaskList(name="Metrics", user_id=auth_client.user_id)
+        db.session.add(task_list)
+        db.session.flush()
+
+        task = Task(name="Task", list_id=task_list.id)
+        subtask = Task(name="Subtask", list_id=task_list.id)
+        db.session.add_all([task, subtask])
+        set_paths([(task, None), (subtask, task)])
+        db.session.commit()
+        return task_list.id
+
+
+def test_server_timing_counts_statements(auth_client, metrics_list):
+    """
+    GIVEN a list of tasks
+    WHEN its tasks are read (GET)
+    THEN the response reports its time, SQL statements and serialization
+    """
+    response = auth_client.get(f"/lists/{metrics_list}/tasks")
+
+    timing = response.headers["Server-Timing"]
+    assert re.match(r"app;dur=[\d.]+", timing)
+    assert re.search(r'db;desc="\d+ statements";dur=[\d.]+', timing)
+    assert re.search(r"serialize;dur=[\d.]+", timing)
+
+
+def test_metrics_endpoint_has_histograms(
+    test_app, auth_client, metrics_list, monkeypatch
+):
+    """
+    GIVEN requests to a resource
+    WHEN the metrics are scraped with the metrics token
+    THEN they have latency and statement histograms for that resource
+    """
+    monkeypatch.setitem(test_app.config, "METRICS_TOKEN", "metrics-token")
+    auth_client.get(f"/lists/{metrics_list}/tasks")
+
+    response = auth_client.get(
+        "/metrics", headers={"Authorization": "Bearer metrics-token"}
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.data.decode()
+    labels = 'endpoint="list_get_tasks",method="GET"'
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}' in text
+    assert f"http_request_sql_statements_count{{{labels}}}" in text
+    assert re.search(rf'http_responses_total{{{labels},status="200"}} \d+', text)
+
+
+def test_metrics_endpoint_needs_the_token(test_app, auth_client, monkeypatch):
+    """
+    GIVEN the metrics endpoint
+    WHEN it is requested without a token configured, or without the token
+    THEN the metrics aren't served, even to a logged-in user
+    """
+    monkeypatch.setitem(test_app.config, "METRICS_TOKEN", None)
+    assert auth_client.get("/metrics").status_code == 404
+
+    monkeypatch.setitem(test_app.config, "METRICS_TOKEN", "metrics-token")
+    assert auth_client.get("/metrics").status_code == 401
+    response = auth_client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
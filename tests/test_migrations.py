@@ -0,0 +1,189 @@
+from datetime import date
+
+import pytest
+import sqlalchemy as sa
+
+from backend.app import db
+from backend.app.migrations import MIGRATIONS, current_version, upgrade
+from backend.app.models import TaskList
+
+NEW_INDEXES = {
+    "ix_tasks_list_id_parent_id",
+    "ix_tasks_parent_id",
+    "ix_tasks_user_id_due_date",
+}
+
+
+# The tables as `db.create_all()` made them before migrations existed
+LEGACY_DDL = [
+    "CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR(32) NOT NULL, "
+    "password_hash VARCHAR(128) NOT NULL, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX ix_users_username ON users (username)",
+    "CREATE TABLE task_lists (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, "
+    "user_id INTEGER NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(user_id) REFERENCES users (id))",
+    "CREATE INDEX ix_task_lists_name ON task_lists (name)",
+    "CREATE TABLE tasks (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, "
+    "due_date VARCHAR NOT NULL, is_completed BOOLEAN NOT NULL, parent_id INTEGER, "
+    "depth INTEGER NOT NULL, list_id INTEGER NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(parent_id) REFERENCES tasks (id), "
+    "FOREIGN KEY(list_id) REFERENCES task_lists (id))",
+]
+
+
+def columns(engine: sa.Engine, table: str) -> dict:
+    """The names of a table's columns, with whether they are nullable."""
+    return {
+        column["name"]: column["nullable"]
+        for column in sa.inspect(engine).get_columns(table)
+    }
+
+
+def task_indexes(engine: sa.Engine) -> set:
+    return {index["name"] for index in sa.inspect(engine).get_indexes("tasks")}
+
+
+def test_new_database_is_created_at_latest_version(tmp_path):
+    """
+    GIVEN an empty database
+    WHEN it is upgraded
+    THEN the tables are created from the models and stamped as up to date
+    """
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+
+    assert upgrade(engine) == []
+    with engine.connect() as connection:
+        assert current_version(connection) == len(MIGRATIONS)
+    assert NEW_INDEXES <= task_indexes(engine)
+    # Upgrading again does nothing
+    assert upgrade(engine) == []
+
+
+def test_unversioned_database_is_migrated(tmp_path):
+    """
+    GIVEN a database made by create_all before migrations, with free-form dates
+    WHEN it is upgraded
+    THEN the indexes are added, every due date becomes a valid date, tasks
+    get the owner of their list, their paths and counters, and the schema
+    matches a new database
+    """
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        for statement in LEGACY_DDL:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(
+            "INSERT INTO users (id, username, password_hash) VALUES (1, 'old', 'x')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO task_lists (id, name, user_id) VALUES (1, 'Legacy', 1)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO tasks (id, name, due_date, is_completed, parent_id, depth, "
+            "list_id) VALUES "
+            "(1, 'Dated', '2024-02-03', 0, NULL, 0, 1), "
+            "(2, 'Someday', 'someday', 0, NULL, 0, 1), "
+            "(3, 'Done', '2024-02-03', 1, 1, 0, 1), "
+            "(4, 'Deep', '2024-02-03', 0, 3, 0, 1)"
+        )
+
+    applied = upgrade(engine)
+
+    assert [migration.version for migration in applied] == list(
+        range(1, len(MIGRATIONS) + 1)
+    )
+    assert NEW_INDEXES <= task_indexes(engine)
+    with engine.connect() as connection:
+        due_dates = connection.execute(
+            sa.select(sa.column("due_date", sa.Date))
+            .select_from(sa.table("tasks"))
+            .order_by(sa.text("id"))
+        ).scalars()
+        assert list(due_dates)[:2] == [date(2024, 2, 3), date.today()]
+        tasks = connection.exec_driver_sql(
+            "SELECT user_id, path, depth, subtask_total, subtask_done "
+            "FROM tasks ORDER BY id"
+        ).all()
+        assert [tuple(task) for task in tasks] == [
+            (1, "1/", 0, 1, 1),
+            (1, "2/", 0, 0, 0),
+            (1, "1/3/", 1, 1, 0),
+            (1, "1/3/4/", 2, 0, 0),
+        ]
+        lists = connection.exec_driver_sql(
+            "SELECT open_count, version FROM task_lists"
+        ).all()
+        assert [tuple(task_list) for task_list in lists] == [(3, 1)]
+        # Migrated rows are still searchable
+        assert connection.exec_driver_sql(
+            "SELECT rowid FROM search_index WHERE search_index MATCH 'deep'"
+        ).scalars().all() == [8]
+
+    new_engine = sa.create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    upgrade(new_engine)
+    for table in ("users", "task_lists", "tasks"):
+        assert columns(engine, table) == columns(new_engine, table)
+    with engine.begin() as connection:
+        with pytest.raises(sa.exc.IntegrityError):
+            connection.exec_driver_sql(
+                "INSERT INTO tasks (name, due_date, is_completed, depth, "
+                "subtask_total, subtask_done, list_id) "
+                "VALUES ('Pathless', '2024-02-03', 0, 0, 0, 0, 1)"
+            )
+
+
+def test_due_dates_are_dates(auth_client, test_app):
+    """
+    GIVEN a list
+    WHEN tasks are created with and without a due date (POST)
+    THEN the dates are stored as dates, and invalid ones are refused
+    """
+    with test_app.app_context():
+        task_list = TaskList(name="Dates", user_id=auth_client.user_id)
+        db.session.add(task_list)
+        db.session.commit()
+        list_id = task_list.id
+
+    url = f"/lists/{list_id}/tasks/"
+    response = auth_client.post(
+        url, json={"name": "Dated", "list_id": list_id, "due_date": "2024-05-06"}
+    )
+    assert response.status_code == 201
+    assert response.json["due_date"] == "2024-05-06"
+
+    response = auth_client.post(url, json={"name": "Undated", "list_id": list_id})
+    assert response.json["due_date"] == date.today().isoformat()
+
+    response = auth_client.post(
+        url, json={"name": "Vague", "list_id": list_id, "due_date": "someday"}
+    )
+    assert response.status_code == 400
+
+
+def test_revoked_token_ids_are_never_reused(tmp_path):
+    """
+    GIVEN a SQLite database whose revoked tokens table reuses freed IDs
+    WHEN it is upgraded
+    THEN the table is rebuilt with AUTOINCREMENT and keeps its rows
+    """
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'tokens.db'}")
+    upgrade(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE revoked_tokens")
+        connection.exec_driver_sql(
+            "CREATE TABLE revoked_tokens (id INTEGER NOT NULL, "
+            "session_id VARCHAR(32) NOT NULL UNIQUE, expires_at INTEGER NOT NULL, "
+            "PRIMARY KEY (id))"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO revoked_tokens VALUES (7, 'session', 4102444800)"
+        )
+        connection.exec_driver_sql("DELETE FROM schema_migrations WHERE version = 4")
+
+    assert [migration.version for migration in upgrade(engine)] == [4]
+    with engine.connect() as connection:
+        create = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE name = 'revoked_tokens'"
+        ).scalar()
+        rows = connection.exec_driver_sql("SELECT * FROM revoked_tokens").all()
+    assert "AUTOINCREMENT" in create
+    assert [tuple(row) for row in rows] == [(7, "session", 4102444800)]
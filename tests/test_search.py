@@ -0,0 +1,152 @@
+import pytest
+
+from backend.app import db
+from backend.app.models import Task, TaskList, User
+from backend.app.search import fts_search, like_search, parse_search_cursor
+from backend.app.tree import set_path
+
+
+@pytest.fixture(scope="module")
+def searchable(test_app, auth_client):
+    """
+    Two lists of the logged-in user, and a list of another user, to search.
+    """
+    with test_app.app_context():
+        other = User(username="searchother", password="password")
+        db.session.add(other)
+        db.session.flush()
+
+        ids = {}
+        for name, user_id, task_names in [
+            ("Groceries", auth_client.user_id, ["Buy milk", "Buy bread", "Cheese"]),
+            ("Errands", auth_client.user_id, ["Buy stamps", "Bank visit"]),
+            ("Secret", other.id, ["Buy gifts"]),
+        ]:
+            task_list = TaskList(name=name, user_id=user_id)
+            db.session.add(task_list)
+            db.session.flush()
+            ids[name] = task_list.id
+            for task_name in task_names:
+                task = Task(name=task_name, list_id=task_list.id)
+                db.session.add(task)
+                set_path(task)
+                ids[task_name] = task.id
+        db.session.commit()
+    return ids
+
+
+def names(response) -> list:
+    return [result["name"] for result in response.json]
+
+
+def test_search_matches_prefixes(test_app, auth_client, searchable):
+    """
+    GIVEN tasks and lists of two users
+    WHEN the logged-in user searches for a prefix (GET)
+    THEN only their own matching tasks are found
+    """
+    response = auth_client.get("/search", query_string={"q": "bu"})
+
+    assert response.status_code == 200
+    assert sorted(names(response)) == ["Buy bread", "Buy milk", "Buy stamps"]
+    result = next(row for row in response.json if row["name"] == "Buy stamps")
+    assert result == {
+        "kind": "task",
+        "id": searchable["Buy stamps"],
+        "name": "Buy stamps",
+        "list_id": searchable["Errands"],
+    }
+
+
+def test_search_scopes_and_pages(test_app, auth_client, searchable):
+    """
+    GIVEN tasks in two lists
+    WHEN a search is narrowed to a list, to lists only, or paged
+    THEN only those results are returned
+    """
+    in_list = auth_client.get(
+        "/search", query_string={"q": "buy", "list_id": searchable["Groceries"]}
+    )
+    assert sorted(names(in_list)) == ["Buy bread", "Buy milk"]
+
+    lists = auth_client.get("/search", query_string={"q": "err", "kind": "list"})
+    assert lists.json == [
+        {
+            "kind": "list",
+            "id": searchable["Errands"],
+            "name": "Errands",
+            "list_id": searchable["Errands"],
+        }
+    ]
+
+    page = auth_client.get("/search", query_string={"q": "buy", "limit": 2})
+    assert len(page.json) == 2
+    rest = auth_client.get(
+        "/search",
+        query_string={"q": "buy", "limit": 2, "cursor": page.headers["X-Next-Cursor"]},
+    )
+    assert len(rest.json) == 1 and "X-Next-Cursor" not in rest.headers
+
+
+def test_search_follows_writes(test_app, auth_client, searchable):
+    """
+    GIVEN an indexed task
+    WHEN it is renamed, then deleted
+    THEN searches find its new name, then nothing
+    """
+    list_id = searchable["Groceries"]
+    task_id = searchable["Cheese"]
+    auth_client.put(
+        f"/lists/{list_id}/tasks/{task_id}/edit",
+        json={"name": "Brie cheese", "list_id": list_id},
+    )
+    assert names(auth_client.get("/search", query_string={"q": "brie"})) == [
+        "Brie cheese"
+    ]
+
+    auth_client.delete(f"/lists/{list_id}/tasks/{task_id}/delete")
+    assert auth_client.get("/search", query_string={"q": "brie"}).json == []
+
+
+def test_like_search_matches_fts_search(test_app, auth_client, searchable):
+    """
+    GIVEN the same tasks and lists
+    WHEN they are searched with and without the FTS5 index, whole or in pages
+    THEN the same results are found, by the start of their words only
+    """
+
+    def search(search_function, words, limit=10):
+        results, after = [], None
+        while True:
+            page = search_function(auth_client.user_id, words, None, None, limit, after)
+            results += page
+            if len(page) < limit:
+                return sorted(
+                    (row["kind"], row["id"], row["name"], row["list_id"])
+                    for row in results
+                )
+            after = parse_search_cursor(page[-1]["cursor"])
+
+    with test_app.app_context():
+        for words in (["buy"], ["b"], ["uy"], ["bank", "vis"], ["e"]):
+            fts = search(fts_search, words)
+            assert fts == search(like_search, words) == search(like_search, words, 1)
+            assert fts == search(fts_search, words, 1)
+
+        assert [row[2] for row in search(like_search, ["b"])] == [
+            "Buy milk",
+            "Buy bread",
+            "Buy stamps",
+            "Bank visit",
+        ]
+        assert search(like_search, ["uy"]) == []
+
+
+def test_search_rejects_bad_cursors(test_app, auth_client, searchable):
+    """
+    GIVEN a search
+    WHEN it is paged with a cursor that isn't "rank,key" (GET)
+    THEN it is refused
+    """
+    response = auth_client.get("/search", query_string={"q": "buy", "cursor": "3"})
+    assert response.status_code == 400
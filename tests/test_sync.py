@@ -0,0 +1,173 @@
+import sqlalchemy as sa
+
+from backend.app import db
+from backend.app.changes import compact_change_log
+from backend.app.models import ChangeLog, Task
+
+
+def make_list(auth_client, name: str) -> int:
+    response = auth_client.post("/lists/", json={"name": name})
+    assert response.status_code == 201
+    return max(row["id"] for row in auth_client.get("/lists/all").json)
+
+
+def make_task(auth_client, list_id: int, name: str) -> int:
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/", json={"name": name, "list_id": list_id}
+    )
+    assert response.status_code == 201
+    return response.json["id"]
+
+
+def test_sync_returns_changes_since_cursor(test_app, auth_client):
+    """
+    GIVEN a client that synced once
+    WHEN tasks are created, edited and deleted
+    THEN the next sync has each changed row once, with tombstones for deletes
+    """
+    first = auth_client.get("/sync").json
+    assert first["reset"] and first["changes"] == []
+
+    list_id = make_list(auth_client, "Synced")
+    kept = make_task(auth_client, list_id, "Kept")
+    gone = make_task(auth_client, list_id, "Gone")
+    response = auth_client.put(
+        f"/lists/{list_id}/tasks/{kept}/edit",
+        json={"name": "Renamed", "list_id": list_id},
+    )
+    assert response.status_code == 200
+    auth_client.delete(f"/lists/{list_id}/tasks/{gone}/delete")
+
+    sync = auth_client.get("/sync", query_string={"since": first["cursor"]}).json
+    changes = {(change["kind"], change["id"]): change for change in sync["changes"]}
+
+    assert not sync["reset"] and not sync["more"]
+    assert len(changes) == len(sync["changes"]) == 3
+    assert changes[("task", kept)]["data"]["name"] == "Renamed"
+    assert changes[("task", gone)]["op"] == "deleted"
+    assert "data" not in changes[("task", gone)]
+    assert changes[("list", list_id)]["data"]["open_count"] == 1
+
+    again = auth_client.get("/sync", query_string={"since": sync["cursor"]}).json
+    assert again["changes"] == [] and again["cursor"] == sync["cursor"]
+
+
+def test_sync_pages(test_app, auth_client):
+    """
+    GIVEN a new task in a new list
+    WHEN the changes are synced one log entry at a time
+    THEN every page but the last says there is more
+    """
+    since = auth_client.get("/sync").json["cursor"]
+    make_task(auth_client, make_list(auth_client, "Paged"), "Paged task")
+
+    first = auth_client.get("/sync", query_string={"since": since, "limit": 1}).json
+    second = auth_client.get(
+        "/sync", query_string={"since": first["cursor"], "limit": 1}
+    ).json
+
+    assert first["more"] and len(first["changes"]) == 1
+    assert second["more"] and second["cursor"] > first["cursor"]
+
+
+def test_compaction(test_app, auth_client):
+    """
+    GIVEN a change log with several entries for the same list
+    WHEN it is compacted, then compacted with no retention
+    THEN superseded entries go first, then all of them, and old cursors reset
+    """
+    since = auth_client.get("/sync").json["cursor"]
+    list_id = make_list(auth_client, "Compacted")
+    for name in ["Once", "Twice"]:
+        auth_client.put(f"/lists/{list_id}/edit", json={"name": name})
+
+    with test_app.app_context():
+        superseded, expired = compact_change_log(retention=3600)
+        db.session.commit()
+        entries = db.session.execute(
+            sa.select(ChangeLog.op).where(
+                ChangeLog.kind == "list", ChangeLog.entity_id == list_id
+            )
+        ).all()
+
+    assert superseded >= 2 and expired == 0
+    assert len(entries) == 1
+    sync = auth_client.get("/sync", query_string={"since": since}).json
+    assert sync["changes"][0]["data"]["name"] == "Twice"
+
+    with test_app.app_context():
+        compact_change_log(retention=-1)
+        db.session.commit()
+
+    assert auth_client.get("/sync", query_string={"since": since}).json["reset"]
+
+
+def test_subtree_changes_outlive_later_edits(test_app, auth_client):
+    """
+    GIVEN a parent task that was completed, then renamed
+    WHEN the changes are synced, before and after the log is compacted
+    THEN the parent's change is still "status", so its subtree gets reloaded
+    """
+    list_id = make_list(auth_client, "Subtree sync")
+    parent = make_task(auth_client, list_id, "Parent")
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/{parent}/subtasks",
+        json={"name": "Child", "list_id": list_id},
+    )
+    assert response.status_code == 201
+    since = auth_client.get("/sync").json["cursor"]
+
+    response = auth_client.put(f"/lists/{list_id}/tasks/{parent}/status")
+    assert response.status_code == 200
+    response = auth_client.put(
+        f"/lists/{list_id}/tasks/{parent}/edit",
+        json={"name": "Parent renamed", "list_id": list_id},
+    )
+    assert response.status_code == 200
+
+    for compact in (False, True):
+        if compact:
+            with test_app.app_context():
+                compact_change_log(retention=3600)
+                db.session.commit()
+        sync = auth_client.get("/sync", query_string={"since": since}).json
+        changes = {(change["kind"], change["id"]): change for change in sync["changes"]}
+        assert changes[("task", parent)]["op"] == "status"
+        assert changes[("task", parent)]["data"]["name"] == "Parent renamed"
+
+
+def test_deleting_a_list_leaves_tombstones(test_app, auth_client):
+    """
+    GIVEN a list with a task and a subtask
+    WHEN the list is deleted (DELETE)
+    THEN its tasks go with it, out of the search index too, and the next
+    sync has a tombstone for each of them and the list
+    """
+    list_id = make_list(auth_client, "Doomed")
+    parent = make_task(auth_client, list_id, "Doomed zebra")
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/{parent}/subtasks",
+        json={"name": "Doomed zebra child", "list_id": list_id},
+    )
+    child = response.json["id"]
+    since = auth_client.get("/sync").json["cursor"]
+
+    response = auth_client.delete(f"/lists/{list_id}/delete")
+    assert response.status_code == 200
+
+    sync = auth_client.get("/sync", query_string={"since": since}).json
+    assert sorted(
+        (change["kind"], change["op"], change["id"]) for change in sync["changes"]
+    ) == [
+        ("list", "deleted", list_id),
+        ("task", "deleted", parent),
+        ("task", "deleted", child),
+    ]
+    with test_app.app_context():
+        assert db.session.get(Task, parent) is None
+        matches = db.session.execute(
+            sa.text(
+                "SELECT count(*) FROM search_index WHERE search_index MATCH 'zebra'"
+            )
+        ).scalar()
+        assert matches == 0
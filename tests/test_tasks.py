@@ -0,0 +1,476 @@
+import pytest
+import sqlalchemy as sa
+
+from backend.app import db
+from backend.app.models import Task, TaskList, User
+from backend.app.tree import set_paths
+
+
+@pytest.fixture(scope="module")
+def task_tree(test_app, auth_client):
+    """
+    A list with the tree: root -> (a -> a1, b), created through the API
+    """
+    with test_app.app_context():
+        task_list = TaskList(name="Project", user_id=auth_client.user_id)
+        db.session.add(task_list)
+        db.session.commit()
+        ids = {"list": task_list.id}
+
+    tasks_url = f"/lists/{ids['list']}/tasks"
+    for name, parent_name in [
+        ("root", None),
+        ("a", "root"),
+        ("a1", "a"),
+        ("b", "root"),
+    ]:
+        if parent_name:
+            url = f"{tasks_url}/{ids[parent_name]}/subtasks"
+        else:
+            url = f"{tasks_url}/"
+        response = auth_client.post(url, json={"name": name, "list_id": ids["list"]})
+        assert response.status_code == 201
+        ids[name] = response.json["id"]
+
+    return ids
+
+
+def statuses(test_app, task_tree) -> dict:
+    with test_app.app_context():
+        query = sa.select(Task.name, Task.is_completed).where(
+            Task.list_id == task_tree["list"]
+        )
+        return dict(db.session.execute(query).all())
+
+
+def toggle(auth_client, task_tree, name):
+    response = auth_client.put(
+        f"/lists/{task_tree['list']}/tasks/{task_tree[name]}/status"
+    )
+    assert response.status_code == 200
+    return response
+
+
+def test_update_status_propagates(test_app, auth_client, task_tree):
+    """
+    GIVEN a tree of open tasks
+    WHEN its leaves are completed one by one
+    THEN each parent is completed once all of its subtasks are
+    """
+    toggle(auth_client, task_tree, "a1")
+    assert statuses(test_app, task_tree) == {
+        "root": False,
+        "a": True,
+        "a1": True,
+        "b": False,
+    }
+
+    response = toggle(auth_client, task_tree, "b")
+    assert statuses(test_app, task_tree) == {
+        "root": True,
+        "a": True,
+        "a1": True,
+        "b": True,
+    }
+    assert response.json["task"]["is_completed"] is True
+
+
+def test_update_status_reopens_subtree(test_app, auth_client, task_tree):
+    """
+    GIVEN a completed tree
+    WHEN the root is reopened
+    THEN the whole subtree is reopened in the same request
+    """
+    response = toggle(auth_client, task_tree, "root")
+
+    assert statuses(test_app, task_tree) == {
+        "root": False,
+        "a": False,
+        "a1": False,
+        "b": False,
+    }
+    assert response.json["task"]["subtasks"][0]["subtasks"][0]["is_completed"] is False
+
+
+def counters(test_app, task_tree) -> dict:
+    with test_app.app_context():
+        query = sa.select(Task.name, Task.subtask_done, Task.subtask_total).where(
+            Task.list_id == task_tree["list"]
+        )
+        counts = {
+            name: (done, total) for name, done, total in db.session.execute(query)
+        }
+        counts["list"] = db.session.get(TaskList, task_tree["list"]).open_count
+        return counts
+
+
+def test_counters_follow_writes(test_app, auth_client, task_tree):
+    """
+    GIVEN an open tree
+    WHEN tasks are completed and deleted
+    THEN the subtask and open counters stay in step
+    """
+    assert counters(test_app, task_tree) == {
+        "root": (0, 2),
+        "a": (0, 1),
+        "a1": (0, 0),
+        "b": (0, 0),
+        "list": 4,
+    }
+
+    toggle(auth_client, task_tree, "a1")
+    assert counters(test_app, task_tree) == {
+        "root": (1, 2),
+        "a": (1, 1),
+        "a1": (0, 0),
+        "b": (0, 0),
+        "list": 2,
+    }
+
+    response = auth_client.delete(
+        f"/lists/{task_tree['list']}/tasks/{task_tree['a']}/delete"
+    )
+    assert response.status_code == 200
+    assert counters(test_app, task_tree) == {
+        "root": (0, 1),
+        "b": (0, 0),
+        "list": 2,
+    }
+
+    toggle(auth_client, task_tree, "b")
+    assert counters(test_app, task_tree) == {"root": (1, 1), "b": (0, 0), "list": 0}
+
+
+def test_batch_applies_in_order(test_app, auth_client, task_tree):
+    """
+    GIVEN a list
+    WHEN a batch creates a tree, completes its leaf and renames its root (POST)
+    THEN every operation is applied and reported in order
+    """
+    list_id = task_tree["list"]
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={
+            "operations": [
+                {"op": "create", "name": "Batch root", "list_id": list_id},
+                {
+                    "op": "create",
+                    "name": "Batch leaf",
+                    "list_id": list_id,
+                    "parent_ref": 0,
+                },
+                {"op": "status", "task_id": task_tree["root"]},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    results = response.json["results"]
+    assert [result["status"] for result in results] == [201, 201, 200]
+    root_id, leaf_id = results[0]["task"]["id"], results[1]["task"]["id"]
+    assert results[1]["task"]["parent_id"] == root_id
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={
+            "operations": [
+                {"op": "status", "task_id": leaf_id},
+                {
+                    "op": "edit",
+                    "task_id": root_id,
+                    "name": "Renamed",
+                    "list_id": list_id,
+                },
+                {"op": "delete", "task_id": leaf_id},
+            ]
+        },
+    )
+    assert response.status_code == 200
+
+    with test_app.app_context():
+        root = db.session.get(Task, root_id)
+        assert root.name == "Renamed"
+        assert root.is_completed is True
+        assert (root.subtask_done, root.subtask_total) == (0, 0)
+        assert db.session.get(Task, leaf_id) is None
+
+
+def test_batch_is_all_or_nothing(test_app, auth_client, task_tree):
+    """
+    GIVEN a list
+    WHEN a batch holds an invalid operation, targets a missing task or moves a
+    task under its own subtask (POST)
+    THEN nothing is applied and the failing operation is reported
+    """
+    list_id = task_tree["list"]
+    create = {"op": "create", "name": "Never", "list_id": list_id}
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={"operations": [create, {"op": "create", "list_id": list_id}]},
+    )
+    assert response.status_code == 400
+    assert response.json["results"][0]["index"] == 1
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={"operations": [create, {"op": "delete", "task_id": 999999}]},
+    )
+    assert response.status_code == 404
+    assert response.json["results"] == [
+        {"index": 1, "status": 404, "message": "Task with id 999999 not found."}
+    ]
+
+    move = {"op": "move", "task_id": task_tree["root"], "new_parent_id": task_tree["b"]}
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch", json={"operations": [create, move]}
+    )
+    assert response.status_code == 400
+    assert response.json["results"][0]["index"] == 1
+
+    with test_app.app_context():
+        names = db.session.execute(sa.select(Task.name)).scalars().all()
+        assert "Never" not in names
+
+
+def test_batch_runs_are_set_based(test_app, auth_client, task_tree, count_statements):
+    """
+    GIVEN a list with a few tasks
+    WHEN a batch renames them all, then deletes a subtask and most of them (POST)
+    THEN each run of edits and of deletes is applied with one statement
+    """
+    list_id = task_tree["list"]
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={
+            "operations": [
+                {"op": "create", "name": f"Run {i}", "list_id": list_id}
+                for i in range(3)
+            ]
+        },
+    )
+    ids = [result["task"]["id"] for result in response.json["results"]]
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/{ids[0]}/subtasks",
+        json={"name": "Run child", "list_id": list_id},
+    )
+    child_id = response.json["id"]
+
+    operations = [
+        {"op": "edit", "task_id": task_id, "name": f"Run renamed {task_id}"}
+        for task_id in ids
+    ] + [
+        {"op": "delete", "task_id": child_id},
+        *({"op": "delete", "task_id": task_id} for task_id in ids[1:]),
+    ]
+    with test_app.app_context():
+        statements, stop = count_statements()
+        response = auth_client.post(
+            f"/lists/{list_id}/tasks/batch", json={"operations": operations}
+        )
+        stop()
+
+    assert response.status_code == 200
+    results = response.json["results"]
+    assert results[0]["task"]["name"] == f"Run renamed {ids[0]}"
+    assert results[0]["task"]["subtask_total"] == 0
+    # Renamed, then deleted
+    assert [result["task_id"] for result in results[1:3]] == ids[1:]
+    assert len([s for s in statements if s.startswith("UPDATE tasks SET name")]) == 1
+    assert len([s for s in statements if "DELETE FROM tasks" in s]) == 1
+    with test_app.app_context():
+        names = db.session.execute(sa.select(Task.name)).scalars().all()
+        assert [name for name in names if name.startswith("Run")] == [
+            f"Run renamed {ids[0]}"
+        ]
+        assert (
+            db.session.get(TaskList, list_id).open_count
+            == counters(test_app, task_tree)["list"]
+        )
+
+
+def test_batch_stays_in_its_list(test_app, auth_client, task_tree):
+    """
+    GIVEN a task in another list
+    WHEN a batch targets it, creates a task in another list, or leaves out
+    what an operation requires (POST)
+    THEN nothing is applied
+    """
+    list_id = task_tree["list"]
+    with test_app.app_context():
+        other = TaskList(name="Other", user_id=auth_client.user_id)
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+    response = auth_client.post(
+        f"/lists/{other_id}/tasks/", json={"name": "Elsewhere", "list_id": other_id}
+    )
+    elsewhere_id = response.json["id"]
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={"operations": [{"op": "delete", "task_id": elsewhere_id}]},
+    )
+    assert response.status_code == 404
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={"operations": [{"op": "create", "name": "Out", "list_id": other_id}]},
+    )
+    assert response.status_code == 400
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/batch",
+        json={"operations": [{"op": "edit", "task_id": elsewhere_id}]},
+    )
+    assert response.status_code == 400
+    assert "name" in response.json["results"][0]["errors"]
+
+
+def assert_consistent(test_app, list_id):
+    """
+    Check the counters and statuses of a list against its tasks: each task
+    counts its (completed) subtasks, a parent is completed exactly when all
+    of its subtasks are, and the list counts its open tasks.
+    """
+    with test_app.app_context():
+        tasks = db.session.execute(
+            sa.select(Task).where(Task.list_id == list_id)
+        ).scalars()
+        subtasks = {}
+        for task in tasks:
+            subtasks.setdefault(task.id, [])
+            if task.parent_id is not None:
+                subtasks.setdefault(task.parent_id, []).append(task)
+        for task_id, children in subtasks.items():
+            task = db.session.get(Task, task_id)
+            done = sum(child.is_completed for child in children)
+            assert (task.subtask_done, task.subtask_total) == (done, len(children))
+            if children:
+                assert task.is_completed == (done == len(children)), task.name
+
+        open_count = sum(
+            not task.is_completed
+            for task_id in subtasks
+            for task in [db.session.get(Task, task_id)]
+        )
+        assert db.session.get(TaskList, list_id).open_count == open_count
+
+
+def test_parent_status_follows_every_write(test_app, auth_client):
+    """
+    GIVEN a completed parent
+    WHEN its subtasks are reopened, created, deleted, moved or batched
+    THEN it is reopened and completed again with them, whatever the path
+    """
+    with test_app.app_context():
+        task_list = TaskList(name="Invariant", user_id=auth_client.user_id)
+        db.session.add(task_list)
+        db.session.commit()
+        list_id = task_list.id
+    tasks_url = f"/lists/{list_id}/tasks"
+
+    def create(name, parent=None):
+        url = f"{tasks_url}/{parent}/subtasks" if parent else f"{tasks_url}/"
+        response = auth_client.post(url, json={"name": name, "list_id": list_id})
+        assert response.status_code == 201
+        return response.json["id"]
+
+    def completed(task_id):
+        with test_app.app_context():
+            return db.session.get(Task, task_id).is_completed
+
+    def write(method, url, **kwargs):
+        response = getattr(auth_client, method)(url, **kwargs)
+        assert response.status_code == 200
+        assert_consistent(test_app, list_id)
+        return response
+
+    root = create("Root")
+    parent = create("Parent", root)
+    children = [create("Child", parent), create("Child", parent)]
+    for child in children:
+        write("put", f"{tasks_url}/{child}/status")
+    assert completed(root)
+
+    # Reopening a subtask
+    write("put", f"{tasks_url}/{children[0]}/status")
+    assert not completed(parent) and not completed(root)
+    write("put", f"{tasks_url}/{children[0]}/status")
+    assert completed(root)
+
+    # Creating a subtask, then deleting it
+    extra = create("Extra", parent)
+    assert_consistent(test_app, list_id)
+    assert not completed(parent) and not completed(root)
+    write("delete", f"{tasks_url}/{extra}/delete")
+    assert completed(root)
+
+    # Moving an open task in and out
+    other = create("Other")
+    moved = create("Moved", other)
+    write("put", f"{tasks_url}/{moved}/move", json={"new_parent_id": parent})
+    assert not completed(root)
+    write("put", f"{tasks_url}/{moved}/move", json={"new_parent_id": other})
+    assert completed(root)
+
+    # Creating and completing in a batch
+    operations = [
+        {"op": "create", "name": "Batched", "list_id": list_id, "parent_id": parent}
+    ]
+    response = write("post", f"{tasks_url}/batch", json={"operations": operations})
+    assert not completed(root)
+    batched = response.json["results"][0]["task"]["id"]
+    operations = [{"op": "status", "task_id": batched}]
+    write("post", f"{tasks_url}/batch", json={"operations": operations})
+    assert completed(root)
+
+
+def test_other_users_lists_and_tasks_are_not_found(test_app, auth_client):
+    """
+    GIVEN a list and tasks of another user
+    WHEN the current user reads, creates in, edits, completes or deletes them
+    THEN each request is answered with a 404 and nothing changes
+    """
+    with test_app.app_context():
+        other = User(username="strangeruser", password="strangerpassword")
+        db.session.add(other)
+        db.session.flush()
+        theirs = TaskList(name="Theirs", user_id=other.id)
+        db.session.add(theirs)
+        db.session.flush()
+        parent = Task(name="Their parent", list_id=theirs.id)
+        child = Task(name="Their child", list_id=theirs.id)
+        db.session.add_all([parent, child])
+        set_paths([(parent, None), (child, parent)])
+        parent.subtask_total = 1
+        theirs.open_count = 2
+        db.session.commit()
+        list_id, parent_id, child_id = theirs.id, parent.id, child.id
+
+    list_url = f"/lists/{list_id}"
+    task_url = f"{list_url}/tasks/{child_id}"
+    task = {"name": "Intruder", "list_id": list_id}
+    requests = [
+        ("get", list_url, {}),
+        ("get", f"{list_url}/tasks", {}),
+        ("put", f"{list_url}/edit", {"json": {"name": "Renamed"}}),
+        ("delete", f"{list_url}/delete", {}),
+        ("post", f"{list_url}/tasks/", {"json": task}),
+        ("get", task_url, {}),
+        ("get", f"{list_url}/tasks/{parent_id}/subtasks", {}),
+        ("post", f"{list_url}/tasks/{parent_id}/subtasks", {"json": task}),
+        ("put", f"{task_url}/edit", {"json": task}),
+        ("put", f"{task_url}/status", {}),
+        ("delete", f"{task_url}/delete", {}),
+    ]
+    for method, url, kwargs in requests:
+        response = getattr(auth_client, method)(url, **kwargs)
+        assert response.status_code == 404, (method, url)
+
+    with test_app.app_context():
+        task_list = db.session.get(TaskList, list_id)
+        assert (task_list.name, task_list.open_count) == ("Theirs", 2)
+        rows = db.session.execute(
+            sa.select(Task.name, Task.is_completed).where(Task.list_id == list_id)
+        ).all()
+        assert sorted(rows) == [("Their child", False), ("Their parent", False)]
@@ -0,0 +1,464 @@
+import pytest
+import sqlalchemy as sa
+
+from backend.app import db
+from backend.app.models import Task, TaskList, User
+from backend.app.tree import (
+    load_list_trees,
+    load_subtree,
+    load_trees,
+    move_subtree,
+    set_path,
+    set_paths,
+)
+
+
+@pytest.fixture(scope="module")
+def deep_list(test_app, auth_client):
+    """
+    A list with one chain of tasks 10 levels deep and one flat task.
+    """
+    with test_app.app_context():
+        task_list = TaskList(name="Deep list", user_id=auth_client.user_id)
+        db.session.add(task_list)
+        db.session.flush()
+
+        parent = None
+        for level in range(10):
+            task = Task(name=f"Level {level}", list_id=task_list.id, parent=parent)
+            db.session.add(task)
+            set_path(task, parent)
+            parent = task
+
+        flat = Task(name="Flat", list_id=task_list.id)
+        db.session.add(flat)
+        set_path(flat)
+        db.session.commit()
+
+        root_id = db.session.execute(
+            sa.select(Task.id).where(Task.name == "Level 0")
+        ).scalar_one()
+        yield {"list_id": task_list.id, "root_id": root_id}
+
+
+def test_load_subtree_nests_every_level(test_app, deep_list, count_statements):
+    """
+    GIVEN a chain of tasks 10 levels deep
+    WHEN the root's subtree is loaded
+    THEN every level is nested and only one statement is run
+    """
+    with test_app.app_context():
+        statements, stop = count_statements()
+        tree = load_subtree(deep_list["root_id"])
+        stop()
+
+        assert len(statements) == 1
+        assert "WITH RECURSIVE" in statements[0]
+
+        depth = 0
+        while tree["subtasks"]:
+            assert len(tree["subtasks"]) == 1
+            tree = tree["subtasks"][0]
+            depth += 1
+        assert depth == 9
+        assert tree["name"] == "Level 9"
+
+
+def test_load_list_trees(test_app, deep_list):
+    """
+    GIVEN a list with a deep tree and a flat task
+    WHEN the list's trees are loaded
+    THEN only the top-level tasks are roots
+    """
+    with test_app.app_context():
+        trees = load_list_trees([deep_list["list_id"]])[deep_list["list_id"]]
+
+        assert [task["name"] for task in trees] == ["Level 0", "Flat"]
+        assert load_subtree(-1) is None
+
+
+def test_load_trees_reads_rows(test_app, deep_list, count_statements):
+    """
+    GIVEN a chain of tasks 10 levels deep
+    WHEN its tree is loaded with only some fields
+    THEN only their columns are selected and no task enters the session
+    """
+    with test_app.app_context():
+        statements, stop = count_statements()
+        trees = load_trees([deep_list["root_id"]], names=("name",))
+        stop()
+
+        assert "due_date" not in statements[0]
+        assert len(db.session.identity_map) == 0
+        assert set(trees[0]) == {"id", "name", "parent_id", "list_id", "subtasks"}
+
+
+def test_get_tasks_endpoint(test_app, auth_client, deep_list):
+    """
+    GIVEN a logged-in user with a deep list
+    WHEN the list's tasks are requested (GET)
+    THEN the whole tree is returned
+    """
+    list_id = deep_list["list_id"]
+    response = auth_client.get(f"/lists/{list_id}/tasks")
+
+    assert response.status_code == 200
+    assert [task["name"] for task in response.json] == ["Level 0", "Flat"]
+    assert response.json[0]["subtasks"][0]["subtasks"][0]["name"] == "Level 2"
+
+
+def test_get_subtasks_endpoint(test_app, auth_client, deep_list):
+    """
+    GIVEN a logged-in user with a deep list
+    WHEN a task and its subtasks are requested (GET)
+    THEN the task comes with its tree and the subtasks without it
+    """
+    tasks_url = f"/lists/{deep_list['list_id']}/tasks/{deep_list['root_id']}"
+    task = auth_client.get(tasks_url).json
+    subtasks = auth_client.get(f"{tasks_url}/subtasks").json
+
+    assert task["name"] == "Level 0"
+    assert [subtask["name"] for subtask in subtasks] == ["Level 1"]
+    assert subtasks == task["subtasks"]
+
+
+def test_paths_and_depths(test_app, deep_list):
+    """
+    GIVEN a chain of tasks 10 levels deep
+    WHEN the deepest task is loaded
+    THEN its path lists every ancestor and gives its depth
+    """
+    with test_app.app_context():
+        leaf = db.session.execute(
+            sa.select(Task).where(Task.name == "Level 9")
+        ).scalar_one()
+
+        assert len(leaf.ancestor_ids()) == 9
+        assert leaf.ancestor_ids()[0] == deep_list["root_id"]
+        assert leaf.depth == leaf.calculate_depth() == 9
+
+        subtree = db.session.execute(
+            sa.select(sa.func.count()).where(Task.in_subtree(leaf.path))
+        ).scalar_one()
+        assert subtree == 1
+
+
+def test_create_move_and_delete_subtree(test_app, auth_client, deep_list):
+    """
+    GIVEN a logged-in user with a deep list
+    WHEN a subtask is created, moved to the top level and deleted
+    THEN the paths and depths of its subtree follow along
+    """
+    list_id, root_id = deep_list["list_id"], deep_list["root_id"]
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/{root_id}/subtasks",
+        json={"name": "Branch", "list_id": list_id},
+    )
+    assert response.status_code == 201
+    branch_id = response.json["id"]
+
+    with test_app.app_context():
+        branch = db.session.get(Task, branch_id)
+        assert branch.path == f"{root_id}/{branch_id}/"
+        assert branch.depth == 1
+
+        leaf = Task(name="Leaf", list_id=list_id, parent=branch)
+        db.session.add(leaf)
+        set_path(leaf, branch)
+        move_subtree(branch)
+        db.session.commit()
+
+        leaf = db.session.execute(
+            sa.select(Task).where(Task.name == "Leaf")
+        ).scalar_one()
+        assert leaf.path == f"{branch_id}/{leaf.id}/"
+        assert leaf.depth == 1
+
+    response = auth_client.delete(f"/lists/{list_id}/tasks/{branch_id}/delete")
+    assert response.status_code == 200
+
+    with test_app.app_context():
+        names = db.session.execute(sa.select(Task.name)).scalars().all()
+        assert "Branch" not in names and "Leaf" not in names
+        assert "Level 9" in names
+
+
+@pytest.fixture(scope="module")
+def wide_subtree(test_app, auth_client):
+    """
+    Two lists: one with a top-level task holding 1000 subtasks under 10
+    branches, the other with a single task to move it under.
+    """
+    with test_app.app_context():
+        source = TaskList(name="Source", user_id=auth_client.user_id)
+        target = TaskList(name="Target", user_id=auth_client.user_id)
+        db.session.add_all([source, target])
+        db.session.flush()
+
+        root = Task(name="Big root", list_id=source.id)
+        anchor = Task(name="Anchor", list_id=target.id)
+        db.session.add_all([root, anchor])
+        set_paths([(root, None), (anchor, None)])
+        branches = [Task(name=f"Branch {i}", list_id=source.id) for i in range(10)]
+        db.session.add_all(branches)
+        set_paths([(branch, root) for branch in branches])
+        leaves = [
+            (Task(name=f"Leaf {i}", list_id=source.id), branches[i % 10])
+            for i in range(990)
+        ]
+        db.session.add_all([leaf for leaf, _ in leaves])
+        set_paths(leaves)
+
+        # Counters as the API would have kept them
+        root.subtask_total = 10
+        for branch in branches:
+            branch.subtask_total = 99
+        source.open_count = 1001
+        target.open_count = 1
+        db.session.commit()
+
+        yield {
+            "source": source.id,
+            "target": target.id,
+            "root_id": root.id,
+            "anchor_id": anchor.id,
+            "branch_id": branches[0].id,
+        }
+
+
+def test_move_rejects_cycles(test_app, auth_client, wide_subtree):
+    """
+    GIVEN a task with subtasks
+    WHEN it is moved under itself or one of its descendants (PUT)
+    THEN the move is refused and nothing changes
+    """
+    source, root_id = wide_subtree["source"], wide_subtree["root_id"]
+    for parent_id in (root_id, wide_subtree["branch_id"]):
+        response = auth_client.put(
+            f"/lists/{source}/tasks/{root_id}/move",
+            json={"new_parent_id": parent_id},
+        )
+        assert response.status_code == 400
+
+    response = auth_client.put(
+        f"/lists/{source}/tasks/{root_id}/move", json={"new_parent_id": 999999}
+    )
+    assert response.status_code == 404
+
+    with test_app.app_context():
+        assert db.session.get(Task, root_id).path == f"{root_id}/"
+
+
+def test_move_subtree_across_lists(
+    test_app, auth_client, wide_subtree, count_statements
+):
+    """
+    GIVEN a subtree of 1000 tasks in one list
+    WHEN it is moved under a task of another list (PUT)
+    THEN every descendant follows with its list, path and depth recomputed,
+    and a fixed number of statements is run whatever the size of the subtree
+    """
+    source, target = wide_subtree["source"], wide_subtree["target"]
+    root_id, anchor_id = wide_subtree["root_id"], wide_subtree["anchor_id"]
+
+    with test_app.app_context():
+        statements, stop = count_statements()
+        response = auth_client.put(
+            f"/lists/{source}/tasks/{root_id}/move",
+            json={"new_parent_id": anchor_id},
+        )
+        stop()
+    assert response.status_code == 200
+    updates = [s for s in statements if s.startswith("UPDATE tasks")]
+    assert len(statements) < 20 and len(updates) == 2
+
+    with test_app.app_context():
+        subtree = db.session.execute(
+            sa.select(Task.list_id, Task.depth, sa.func.count())
+            .where(Task.in_subtree(f"{anchor_id}/"))
+            .group_by(Task.list_id, Task.depth)
+        ).all()
+        assert sorted(subtree) == [
+            (target, 0, 1),
+            (target, 1, 1),
+            (target, 2, 10),
+            (target, 3, 990),
+        ]
+
+        leaf = db.session.execute(
+            sa.select(Task).where(Task.name == "Leaf 0")
+        ).scalar_one()
+        assert leaf.path.startswith(f"{anchor_id}/{root_id}/")
+        assert leaf.user_id == auth_client.user_id
+
+        anchor = db.session.get(Task, anchor_id)
+        assert (anchor.subtask_done, anchor.subtask_total) == (0, 1)
+        assert db.session.get(TaskList, source).open_count == 0
+        assert db.session.get(TaskList, target).open_count == 1002
+
+    # Back to the top level of its first list. Requests get a session of their
+    # own, rather than the fixture's which still holds the tasks it created
+    with test_app.app_context():
+        response = auth_client.put(
+            f"/lists/{target}/tasks/{root_id}/move", json={"new_list_id": source}
+        )
+        assert response.status_code == 200
+
+        moved = db.session.execute(
+            sa.select(Task.list_id, sa.func.min(Task.depth), sa.func.count())
+            .where(Task.in_subtree(f"{root_id}/"))
+            .group_by(Task.list_id)
+        ).all()
+        assert moved == [(source, 0, 1001)]
+        assert db.session.get(Task, anchor_id).subtask_total == 0
+        assert db.session.get(TaskList, target).open_count == 1
+
+
+def test_move_derives_parent_status(test_app, auth_client):
+    """
+    GIVEN an open task whose siblings are all completed, and a completed chain
+    WHEN the open task is moved under the bottom of the chain (PUT)
+    THEN the chain is reopened and the task's old parent is completed, with
+    their counters and the list's open count following
+    """
+    with test_app.app_context():
+        task_list = TaskList(name="Statuses", user_id=auth_client.user_id)
+        db.session.add(task_list)
+        db.session.flush()
+
+        tasks = {
+            name: Task(name=name, list_id=task_list.id, is_completed=completed)
+            for name, completed in [
+                ("Done root", True),
+                ("Done parent", True),
+                ("Done child", True),
+                ("Open parent", False),
+                ("Leaving", False),
+                ("Finished", True),
+            ]
+        }
+        db.session.add_all(tasks.values())
+        set_paths(
+            [
+                (tasks["Done root"], None),
+                (tasks["Done parent"], tasks["Done root"]),
+                (tasks["Done child"], tasks["Done parent"]),
+                (tasks["Open parent"], None),
+                (tasks["Leaving"], tasks["Open parent"]),
+                (tasks["Finished"], tasks["Open parent"]),
+            ]
+        )
+        # Counters as the API would have kept them
+        tasks["Done root"].subtask_total = tasks["Done root"].subtask_done = 1
+        tasks["Done parent"].subtask_total = tasks["Done parent"].subtask_done = 1
+        tasks["Open parent"].subtask_total, tasks["Open parent"].subtask_done = 2, 1
+        task_list.open_count = 2
+        db.session.commit()
+        ids = {name: task.id for name, task in tasks.items()}
+        list_id = task_list.id
+
+    with test_app.app_context():
+        response = auth_client.put(
+            f"/lists/{list_id}/tasks/{ids['Leaving']}/move",
+            json={"new_parent_id": ids["Done parent"]},
+        )
+        assert response.status_code == 200
+
+        def status(name):
+            task = db.session.get(Task, ids[name])
+            return task.is_completed, task.subtask_total, task.subtask_done
+
+        assert status("Done parent") == (False, 2, 1)
+        assert status("Done root") == (False, 1, 0)
+        assert status("Open parent") == (True, 1, 1)
+        assert db.session.get(TaskList, list_id).open_count == 3
+
+
+def test_move_stays_with_the_owner(test_app, auth_client):
+    """
+    GIVEN a task, and a list and task of another user
+    WHEN the task is moved under their task or into their list (PUT, batch)
+    THEN the move is refused and the task stays where it was
+    """
+    with test_app.app_context():
+        other = User(username="otherowner", password="otherpassword")
+        db.session.add(other)
+        db.session.flush()
+        mine = TaskList(name="Mine", user_id=auth_client.user_id)
+        theirs = TaskList(name="Theirs", user_id=other.id)
+        db.session.add_all([mine, theirs])
+        db.session.flush()
+        task = Task(name="Kept", list_id=mine.id)
+        their_task = Task(name="Not mine", list_id=theirs.id)
+        db.session.add_all([task, their_task])
+        set_paths([(task, None), (their_task, None)])
+        db.session.commit()
+        mine_id, theirs_id = mine.id, theirs.id
+        task_id, their_task_id = task.id, their_task.id
+
+    url = f"/lists/{mine_id}/tasks/{task_id}/move"
+    response = auth_client.put(url, json={"new_parent_id": their_task_id})
+    assert response.status_code == 404
+    response = auth_client.put(url, json={"new_list_id": theirs_id})
+    assert response.status_code == 400
+    response = auth_client.put(
+        f"/lists/{theirs_id}/tasks/{their_task_id}/move",
+        json={"new_list_id": mine_id},
+    )
+    assert response.status_code == 404
+
+    for move in ({"new_list_id": theirs_id}, {"new_parent_id": their_task_id}):
+        response = auth_client.post(
+            f"/lists/{mine_id}/tasks/batch",
+            json={"operations": [{"op": "move", "task_id": task_id, **move}]},
+        )
+        assert response.status_code == 404
+
+    with test_app.app_context():
+        kept = db.session.get(Task, task_id)
+        assert (kept.list_id, kept.path, kept.user_id) == (
+            mine_id,
+            f"{task_id}/",
+            auth_client.user_id,
+        )
+
+
+def test_subtasks_stay_in_their_parents_list(test_app, auth_client):
+    """
+    GIVEN a task in one list, and another list
+    WHEN a subtask is created under it naming the other list, or through the
+    other list's URL (POST)
+    THEN the subtask goes to its parent's list, or the parent isn't found
+    """
+    with test_app.app_context():
+        lists = [
+            TaskList(name=name, user_id=auth_client.user_id)
+            for name in ("Parent's", "Other")
+        ]
+        db.session.add_all(lists)
+        db.session.flush()
+        parent = Task(name="Parent", list_id=lists[0].id)
+        db.session.add(parent)
+        set_path(parent)
+        db.session.commit()
+        list_id, other_id, parent_id = lists[0].id, lists[1].id, parent.id
+
+    response = auth_client.post(
+        f"/lists/{list_id}/tasks/{parent_id}/subtasks",
+        json={"name": "Child", "list_id": other_id},
+    )
+    assert response.status_code == 201
+    assert response.json["list_id"] == list_id
+
+    response = auth_client.post(
+        f"/lists/{other_id}/tasks/{parent_id}/subtasks",
+        json={"name": "Stray", "list_id": other_id},
+    )
+    assert response.status_code == 404
+
+    with test_app.app_context():
+        assert db.session.get(TaskList, other_id).open_count == 0
+        names = db.session.execute(
+            sa.select(Task.name).where(Task.list_id == list_id)
+        ).scalars()
+        assert sorted(names) == ["Child", "Parent"]